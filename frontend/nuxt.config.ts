@@ -15,6 +15,12 @@ export default defineNuxtConfig({
       ]
     }
   },
+  runtimeConfig: {
+    public: {
+      // Read API (service/consulta.py); override with NUXT_PUBLIC_API_BASE
+      apiBase: 'http://localhost:8090'
+    }
+  },
   colorMode: {
     classSuffix: '',
     preference: 'system',
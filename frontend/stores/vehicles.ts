@@ -1,97 +1,94 @@
 import { defineStore } from 'pinia'
-import type { Vehicle, Brand, Model, Year, ReferenceTable } from '~/types/vehicle'
+import type { Vehicle, Brand, Model, VehiclePage } from '~/types/vehicle'
 
+// Filtering, search, pagination and the price range are computed by the
+// read API (service/consulta.py) from its indexes; the store only holds the
+// current page.
 export const useVehicleStore = defineStore('vehicles', {
   state: () => ({
     vehicles: [] as Vehicle[],
     brands: [] as Brand[],
     models: [] as Model[],
-    years: [] as Year[],
-    referenceTable: [] as ReferenceTable[],
+    years: [] as number[],
+    total: 0,
+    page: 1,
+    perPage: 24,
+    priceBounds: { min: null as number | null, max: null as number | null },
+    loading: false,
     searchQuery: '',
+    // brand and model are "<tipo>:<codigo>": the same code exists for cars, motorcycles and trucks
     filters: {
-      brand: null as number | null,
-      model: null as number | null,
+      brand: null as string | null,
+      model: null as string | null,
       year: null as number | null,
-      priceRange: [0, 100000] as [number, number]
+      priceRange: [null, null] as [number | null, number | null]
     }
   }),
 
   getters: {
-    filteredVehicles: (state) => {
-      return state.vehicles.filter(vehicle => {
-        // Apply search query
-        if (state.searchQuery) {
-          const searchLower = state.searchQuery.toLowerCase()
-          const brand = state.brands.find(b => b.codigo === vehicle.marca_id)
-          const model = state.models.find(m => m.codigo === vehicle.modelo_id)
-          const searchString = `${brand?.nome || ''} ${model?.nome || ''} ${vehicle.ano_id} ${vehicle.combustivel}`.toLowerCase()
-          
-          if (!searchString.includes(searchLower)) return false
-        }
-
-        // Apply filters
-        if (state.filters.brand && vehicle.marca_id !== state.filters.brand) return false
-        if (state.filters.model && vehicle.modelo_id !== state.filters.model) return false
-        if (state.filters.year && vehicle.ano_id !== state.filters.year) return false
-        if (vehicle.preco < state.filters.priceRange[0] || vehicle.preco > state.filters.priceRange[1]) return false
-        
-        return true
-      })
-    },
-    availableYears: (state) => {
-      const years = new Set<number>()
-      state.filteredVehicles.forEach(vehicle => {
-        years.add(vehicle.ano_id)
-      })
-      return Array.from(years).sort((a, b) => b - a)
-    },
-    priceRange: (state) => {
-      const prices = state.vehicles.map(v => v.preco)
-      return {
-        min: Math.min(...prices),
-        max: Math.max(...prices)
-      }
-    }
+    filteredVehicles: (state) => state.vehicles,
+    availableYears: (state) => state.years,
+    priceRange: (state) => state.priceBounds,
+    pageCount: (state) => Math.max(1, Math.ceil(state.total / state.perPage))
   },
 
   actions: {
     setSearchQuery(query: string) {
       this.searchQuery = query
+      this.page = 1
+      return this.fetchVehicles()
     },
-    
+
+    setPage(page: number) {
+      this.page = page
+      return this.fetchVehicles()
+    },
+
+    async fetchCatalog() {
+      const { public: { apiBase } } = useRuntimeConfig()
+      const [brands, models] = await Promise.all([
+        $fetch<Brand[]>('/marcas', { baseURL: apiBase }),
+        $fetch<Model[]>('/modelos', { baseURL: apiBase })
+      ])
+      this.brands = brands
+      this.models = models
+    },
+
     async fetchVehicles() {
-      // Mock data for now - replace with actual API calls
-      this.vehicles = [
-        {
-          marca_id: 1,
-          modelo_id: 1,
-          ano_id: 2024,
-          placa_referencia_id: 1,
-          codigo_tec: 'ABC123',
-          combustivel: 'Gasoline',
-          preco: 50000
-        },
-        {
-          marca_id: 1,
-          modelo_id: 1,
-          ano_id: 2023,
-          placa_referencia_id: 1,
-          codigo_tec: 'ABC124',
-          combustivel: 'Gasoline',
-          preco: 45000
-        }
-      ]
+      const { public: { apiBase } } = useRuntimeConfig()
+      const [minPrice, maxPrice] = this.filters.priceRange
+      const query: Record<string, string | number> = { pagina: this.page, por_pagina: this.perPage }
+      if (this.searchQuery) query.busca = this.searchQuery
+      if (this.filters.brand) query.marca = this.filters.brand
+      if (this.filters.model) query.modelo = this.filters.model
+      if (this.filters.year) query.ano = this.filters.year
+      // v-model.number leaves '' in a cleared input
+      if (typeof minPrice === 'number') query.preco_min = minPrice
+      if (typeof maxPrice === 'number') query.preco_max = maxPrice
 
-      // Mock brands data
-      this.brands = [
-        { codigo: 1, nome: 'Toyota' }
-      ]
+      this.loading = true
+      try {
+        const result = await $fetch<VehiclePage>('/veiculos', { baseURL: apiBase, query })
+        this.vehicles = result.itens
+        this.total = result.total
+        this.years = result.anos
+        this.priceBounds = { min: result.preco_min, max: result.preco_max }
+      } finally {
+        this.loading = false
+      }
+    },
 
-      // Mock models data
-      this.models = [
-        { codigo: 1, nome: 'Corolla', marca_id: 1 }
-      ]
+    async fetchVehicle(id: string) {
+      const cached = this.vehicles.find(v => v.id === id)
+      if (cached) return cached
+      // id = "<tipo>-<modelo>-<ano_id>": the model has few years, one page is enough
+      const [tipo, modelo] = id.split('-')
+      const { public: { apiBase } } = useRuntimeConfig()
+      const result = await $fetch<VehiclePage>('/veiculos', {
+        baseURL: apiBase,
+        query: { tipo, modelo, por_pagina: 100 }
+      })
+      return result.itens.find(v => v.id === id) ?? null
     }
   }
-})
\ No newline at end of file
+})
@@ -1,32 +1,39 @@
 export interface Vehicle {
-  marca_id: number;
+  id: string;
+  tipo_veiculo: number;
+  marca_id: string;
+  marca: string;
   modelo_id: number;
+  modelo: string;
   ano_id: number;
-  placa_referencia_id: number;
-  codigo_tec: string;
+  ano: number;
+  descricao_ano: string;
   combustivel: string;
+  codigo_fipe: string;
   preco: number;
+  mes_referencia_id: number;
 }
 
 export interface Brand {
-  codigo: number;
+  codigo: string;
   nome: string;
+  tipo_veiculo: number;
 }
 
 export interface Model {
   codigo: number;
   nome: string;
-  marca_id: number;
+  marca_id: string;
+  tipo_veiculo: number;
 }
 
-export interface Year {
-  codigo: number;
-  descricao: string;
-  modelo_id: number;
-  id: number;
+export interface VehiclePage {
+  mes_referencia_id: number | null;
+  total: number;
+  pagina: number;
+  por_pagina: number;
+  preco_min: number | null;
+  preco_max: number | null;
+  anos: number[];
+  itens: Vehicle[];
 }
-
-export interface ReferenceTable {
-  codigo: number;
-  mes: string;
-}
\ No newline at end of file
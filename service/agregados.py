@@ -0,0 +1,539 @@
+"""Estatísticas de preço por veículo, modelo e marca, mantidas enquanto os preços são gravados.
+
+Cada linha confirmada no banco (veiculos, veiculos_inalterados, e as de
+modelos e anos_modelo, que dizem a marca e o ano modelo) passa por
+``AgregadosPrecos.registrar_linhas``, que atualiza, a cada preço:
+
+- por veículo (ano_id): preço vigente, preço do mês anterior, variação mensal,
+  mínimo e máximo já vistos;
+- por modelo: mínimo, máximo e mediana entre os anos modelo, e a curva de
+  depreciação, um ajuste log-linear do preço pelo ano modelo
+  (``log(preco) = a + b * ano``) cujas somas são mantidas a cada troca de preço;
+- por marca: mínimo, máximo e mediana dos veículos e a variação mensal média.
+
+A troca de um preço no veículo e nas somas do ajuste é O(1); nos rollups de
+modelo e de marca é uma bisseção seguida de inserção e remoção em lista, O(n)
+no número de preços do rollup (deslocamento em memória contígua, rápido para os
+anos de um modelo e os veículos de uma marca, no máximo alguns milhares).
+
+As leituras (``veiculo``, ``modelo``, ``marca``) não dependem de quantos meses
+de histórico existem. ``reconstruir`` refaz tudo de uma exportação completa de
+veiculos com NumPy, sem laço Python por linha do histórico:
+
+    python agregados.py --exportacao veiculos.csv
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import time
+from array import array
+from bisect import bisect_left, insort
+
+try:
+    import numpy as np
+except ImportError:  # só a reconstrução e a leitura do arquivo precisam do NumPy
+    np = None
+
+from catalogo import ANO_ZERO_KM, ano_modelo, carregar_tabela, ler_paginas
+from delta import centavos
+
+# origem do eixo x do ajuste, para as somas não perderem precisão
+ANO_BASE = 2000
+
+# Onde o scraper grava os agregados e a API de consulta os lê
+ARQUIVO_AGREGADOS = os.getenv("AUTOFIPE_AGREGADOS_ARQUIVO") or os.path.join(
+    os.getenv("AUTOFIPE_DADOS", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dados")), "agregados.json")
+
+
+def _exigir_numpy():
+    if np is None:
+        raise RuntimeError("A reconstrução dos agregados precisa do NumPy: pip install numpy")
+
+
+def _reais(valor):
+    return None if valor is None else round(valor / 100, 2)
+
+
+class Rollup:
+    """Lista ordenada de preços (em centavos): mínimo, máximo e mediana em O(1), troca em O(n)"""
+
+    __slots__ = ('precos',)
+
+    def __init__(self, precos=None):
+        self.precos = precos if precos is not None else []
+
+    def __len__(self):
+        return len(self.precos)
+
+    def trocar(self, antigo, novo):
+        if antigo is not None:
+            del self.precos[bisect_left(self.precos, antigo)]
+        if novo is not None:
+            insort(self.precos, novo)
+
+    def resumo(self):
+        precos = self.precos
+        if not precos:
+            return {'quantidade': 0, 'minimo': None, 'maximo': None, 'mediana': None}
+        meio = len(precos) // 2
+        mediana = precos[meio] if len(precos) % 2 else (precos[meio - 1] + precos[meio]) / 2
+        return {'quantidade': len(precos), 'minimo': _reais(precos[0]), 'maximo': _reais(precos[-1]),
+                'mediana': _reais(mediana)}
+
+
+class EstatisticasVeiculo:
+    __slots__ = ('tipo', 'modelo_id', 'marca', 'ano', 'mes', 'preco', 'mes_anterior', 'preco_anterior',
+                 'minimo', 'maximo')
+
+    def __init__(self, tipo, modelo_id, marca=None, ano=None, mes=None, preco=None, mes_anterior=None,
+                 preco_anterior=None, minimo=None, maximo=None):
+        self.tipo = tipo
+        self.modelo_id = modelo_id
+        self.marca = marca
+        self.ano = ano
+        self.mes = mes
+        self.preco = preco
+        self.mes_anterior = mes_anterior
+        self.preco_anterior = preco_anterior
+        self.minimo = minimo
+        self.maximo = maximo
+
+    def variacao(self):
+        """Variação do preço vigente sobre o do mês anterior com preço (fração), ou None"""
+        if not self.preco_anterior:
+            return None
+        return (self.preco - self.preco_anterior) / self.preco_anterior
+
+    def ponto(self):
+        """(x, y) do veículo na curva de depreciação do modelo, ou None"""
+        if self.ano is None or self.ano == ANO_ZERO_KM or not self.preco:
+            return None
+        return self.ano - ANO_BASE, math.log(self.preco)
+
+
+class EstatisticasModelo:
+    __slots__ = ('ano_ids', 'rollup', 'n', 'sx', 'sy', 'sxx', 'sxy')
+
+    def __init__(self):
+        self.ano_ids = set()
+        self.rollup = Rollup()
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = 0.0
+
+    def trocar_ponto(self, antigo, novo):
+        for ponto, sinal in ((antigo, -1), (novo, 1)):
+            if ponto is not None:
+                x, y = ponto
+                self.n += sinal
+                self.sx += sinal * x
+                self.sy += sinal * y
+                self.sxx += sinal * x * x
+                self.sxy += sinal * x * y
+
+    def ajuste(self):
+        """(a, b) de ``log(preco) = a + b * (ano - ANO_BASE)``, ou None com menos de dois anos distintos"""
+        denominador = self.n * self.sxx - self.sx * self.sx
+        if self.n < 2 or denominador <= 1e-9 * max(1.0, self.n * self.sxx):
+            return None
+        b = (self.n * self.sxy - self.sx * self.sy) / denominador
+        return (self.sy - b * self.sx) / self.n, b
+
+
+class EstatisticasMarca:
+    __slots__ = ('rollup', 'soma_variacao', 'com_variacao')
+
+    def __init__(self):
+        self.rollup = Rollup()
+        self.soma_variacao = 0.0
+        self.com_variacao = 0
+
+    def trocar_variacao(self, antiga, nova):
+        if antiga is not None:
+            self.soma_variacao -= antiga
+            self.com_variacao -= 1
+        if nova is not None:
+            self.soma_variacao += nova
+            self.com_variacao += 1
+
+
+class AgregadosPrecos:
+    """Estatísticas de preço mantidas a cada linha gravada (veja o início do módulo).
+
+    Os modelos são identificados por ``(tipo_veiculo, codigo)`` e as marcas por
+    ``(tipo_veiculo, codigo da marca)``, como em modelos.marca_id; ``marca_do_modelo``
+    e ``ano_do_id`` vêm do catálogo (``preencher_catalogo``) e das linhas de modelos
+    e anos_modelo gravadas durante a coleta.
+    """
+
+    def __init__(self):
+        self.veiculos = {}
+        self.modelos = {}
+        self.marcas = {}
+        self.marca_do_modelo = {}
+        self.ano_do_id = {}
+        self.atualizacoes = 0
+
+    def __len__(self):
+        return len(self.veiculos)
+
+    # --- Atualização incremental ---------------------------------------------
+
+    def registrar_linhas(self, tabela, linhas):
+        """Chamado com as linhas de ``tabela`` que acabaram de ser gravadas"""
+        if tabela == 'veiculos':
+            for linha in linhas:
+                self.registrar_preco(linha.get('tipo_veiculo', 1), linha['modelo_id'], linha['ano_id'],
+                                     linha['mes_referencia_id'], centavos(linha['preco']))
+        elif tabela == 'veiculos_inalterados':
+            for linha in linhas:
+                mes = int(linha['mes_referencia_id'])
+                for ano_id in linha['ano_ids']:
+                    atual = self.veiculos.get(ano_id)
+                    # Inalterado: o preço do mês é o do último mês gravado antes dele
+                    if atual is not None and atual.mes < mes:
+                        self.registrar_preco(atual.tipo, atual.modelo_id, ano_id, mes, atual.preco)
+        elif tabela == 'modelos':
+            for linha in linhas:
+                chave = (linha.get('tipo_veiculo', 1), str(linha['codigo']))
+                if chave not in self.marca_do_modelo:
+                    self.marca_do_modelo[chave] = str(linha['marca_id'])
+                    self._associar_marca(chave)
+        elif tabela == 'anos_modelo':
+            # Só as linhas que voltam do banco têm id
+            for linha in linhas:
+                if 'id' in linha:
+                    self.ano_do_id[linha['id']] = ano_modelo(linha['codigo'])
+
+    def registrar_preco(self, tipo, modelo_id, ano_id, mes, preco):
+        mes = int(mes)
+        atual = self.veiculos.get(ano_id)
+        if atual is None:
+            atual = self.veiculos[ano_id] = EstatisticasVeiculo(int(tipo), str(modelo_id))
+            self.modelos.setdefault((atual.tipo, atual.modelo_id), EstatisticasModelo()).ano_ids.add(ano_id)
+        preco_antigo, ponto_antigo, variacao_antiga = atual.preco, atual.ponto(), atual.variacao()
+        # O ano modelo pode chegar depois do primeiro preço; até lá o veículo fica fora da curva
+        if atual.ano is None:
+            atual.ano = self.ano_do_id.get(ano_id)
+        marca = self._marca_de(atual)
+
+        if atual.mes is None or mes > atual.mes:
+            atual.mes_anterior, atual.preco_anterior = atual.mes, atual.preco
+            atual.mes, atual.preco = mes, preco
+        elif mes == atual.mes:
+            atual.preco = preco
+        elif atual.mes_anterior is None or mes >= atual.mes_anterior:
+            # Um mês antigo (ex.: coleta do histórico) só pode ser o anterior ao vigente
+            atual.mes_anterior, atual.preco_anterior = mes, preco
+        atual.minimo = preco if atual.minimo is None else min(atual.minimo, preco)
+        atual.maximo = preco if atual.maximo is None else max(atual.maximo, preco)
+        self.atualizacoes += 1
+
+        modelo = self.modelos[(atual.tipo, atual.modelo_id)]
+        if atual.preco != preco_antigo:
+            modelo.rollup.trocar(preco_antigo, atual.preco)
+            if marca is not None:
+                marca.rollup.trocar(preco_antigo, atual.preco)
+        modelo.trocar_ponto(ponto_antigo, atual.ponto())
+        if marca is not None:
+            marca.trocar_variacao(variacao_antiga, atual.variacao())
+
+    def _marca_de(self, veiculo):
+        if veiculo.marca is None:
+            codigo = self.marca_do_modelo.get((veiculo.tipo, veiculo.modelo_id))
+            if codigo is None:
+                return None
+            veiculo.marca = (veiculo.tipo, codigo)
+            # O veículo entra na marca com o que já tinha
+            marca = self.marcas.setdefault(veiculo.marca, EstatisticasMarca())
+            marca.rollup.trocar(None, veiculo.preco)
+            marca.trocar_variacao(None, veiculo.variacao())
+            return marca
+        return self.marcas[veiculo.marca]
+
+    def _associar_marca(self, chave_modelo):
+        modelo = self.modelos.get(chave_modelo)
+        for ano_id in (modelo.ano_ids if modelo is not None else ()):
+            self._marca_de(self.veiculos[ano_id])
+
+    # --- Leitura --------------------------------------------------------------
+
+    def veiculo(self, ano_id):
+        atual = self.veiculos.get(ano_id)
+        if atual is None:
+            return None
+        variacao = atual.variacao()
+        return {
+            'ano_id': ano_id, 'tipo_veiculo': atual.tipo, 'modelo_id': atual.modelo_id,
+            'marca_id': atual.marca[1] if atual.marca else None, 'ano': atual.ano,
+            'mes_referencia_id': atual.mes, 'preco': _reais(atual.preco),
+            'mes_anterior_id': atual.mes_anterior, 'preco_anterior': _reais(atual.preco_anterior),
+            'variacao_mensal': None if variacao is None else round(variacao, 6),
+            'preco_minimo': _reais(atual.minimo), 'preco_maximo': _reais(atual.maximo),
+        }
+
+    def modelo(self, tipo, modelo_id, curva=True):
+        """Resumo entre os anos modelo e a depreciação; ``curva`` inclui os pontos por ano (um por ano_id)"""
+        modelo = self.modelos.get((int(tipo), str(modelo_id)))
+        if modelo is None:
+            return None
+        ajuste = modelo.ajuste()
+        resultado = {
+            'tipo_veiculo': int(tipo), 'modelo_id': str(modelo_id),
+            'marca_id': self.marca_do_modelo.get((int(tipo), str(modelo_id))),
+            **modelo.rollup.resumo(),
+            # Fração do valor perdida a cada ano de idade, pelo ajuste log-linear
+            'depreciacao_anual': None if ajuste is None else round(1 - math.exp(-ajuste[1]), 6),
+        }
+        if curva:
+            pontos = sorted((self.veiculos[ano_id] for ano_id in modelo.ano_ids if self.veiculos[ano_id].ano),
+                            key=lambda v: v.ano)
+            resultado['curva'] = [{
+                'ano': v.ano, 'preco': _reais(v.preco),
+                'ajustado': (None if ajuste is None or v.ano == ANO_ZERO_KM
+                             else round(math.exp(ajuste[0] + ajuste[1] * (v.ano - ANO_BASE)) / 100, 2)),
+            } for v in pontos]
+        return resultado
+
+    def marca(self, tipo, marca_id):
+        marca = self.marcas.get((int(tipo), str(marca_id)))
+        if marca is None:
+            return None
+        return {
+            'tipo_veiculo': int(tipo), 'marca_id': str(marca_id), **marca.rollup.resumo(),
+            'variacao_mensal_media': (round(marca.soma_variacao / marca.com_variacao, 6)
+                                      if marca.com_variacao else None),
+        }
+
+    # --- Reconstrução e arquivo ----------------------------------------------
+
+    @classmethod
+    def reconstruir(cls, ano_ids, tipos, modelo_ids, meses, precos, inalterados=None,
+                    marca_do_modelo=None, ano_do_id=None):
+        """Recalcula tudo a partir do histórico completo de veiculos, em colunas.
+
+        ``precos`` em centavos; ``inalterados`` é um par opcional de colunas
+        ``(ano_ids, meses)`` com os veículos de veiculos_inalterados (modo delta),
+        que recebem o preço da última linha de veiculos anterior ao mês.
+        """
+        _exigir_numpy()
+        ano_ids, tipos, modelo_ids, meses, precos = (np.asarray(c, dtype=np.int64)
+                                                      for c in (ano_ids, tipos, modelo_ids, meses, precos))
+        chaves = (ano_ids << 20) | meses
+        ordem = np.argsort(chaves, kind='stable')
+        if inalterados is not None and len(inalterados[0]):
+            ano_i, mes_i = (np.asarray(c, dtype=np.int64) for c in inalterados)
+            ordenadas = chaves[ordem]
+            anterior = np.searchsorted(ordenadas, (ano_i << 20) | mes_i) - 1
+            validos = anterior >= 0
+            validos[validos] &= ano_ids[ordem[anterior[validos]]] == ano_i[validos]
+            origem = ordem[anterior[validos]]
+            ano_ids, meses = np.concatenate([ano_ids, ano_i[validos]]), np.concatenate([meses, mes_i[validos]])
+            tipos, modelo_ids, precos = (np.concatenate([c, c[origem]]) for c in (tipos, modelo_ids, precos))
+            chaves = (ano_ids << 20) | meses
+            ordem = np.argsort(chaves, kind='stable')
+        ano_ids, tipos, modelo_ids, meses, precos, chaves = (c[ordem] for c in
+                                                              (ano_ids, tipos, modelo_ids, meses, precos, chaves))
+        # Mesmo (ano_id, mês) mais de uma vez: vale a última linha
+        ultima = np.r_[chaves[1:] != chaves[:-1], True]
+        ano_ids, tipos, modelo_ids, meses, precos = (c[ultima] for c in (ano_ids, tipos, modelo_ids, meses, precos))
+        if not len(ano_ids):
+            return cls._montar({}, marca_do_modelo, ano_do_id)
+
+        inicios = np.flatnonzero(np.r_[True, ano_ids[1:] != ano_ids[:-1]])
+        fins = np.r_[inicios[1:], len(ano_ids)] - 1
+        tem_anterior = fins > inicios
+        anteriores = np.where(tem_anterior, fins - 1, fins)
+        return cls._montar({
+            'ano_id': ano_ids[fins], 'tipo': tipos[fins], 'modelo_id': modelo_ids[fins],
+            'mes': meses[fins], 'preco': precos[fins],
+            'mes_anterior': np.where(tem_anterior, meses[anteriores], -1),
+            'preco_anterior': np.where(tem_anterior, precos[anteriores], -1),
+            'minimo': np.minimum.reduceat(precos, inicios), 'maximo': np.maximum.reduceat(precos, inicios),
+        }, marca_do_modelo, ano_do_id)
+
+    @classmethod
+    def _montar(cls, colunas, marca_do_modelo=None, ano_do_id=None):
+        """Monta os agregados a partir de uma linha por veículo (-1 = sem mês anterior)"""
+        agregados = cls()
+        agregados.marca_do_modelo = dict(marca_do_modelo or {})
+        agregados.ano_do_id = dict(ano_do_id or {})
+        if not colunas or not len(colunas['ano_id']):
+            return agregados
+        c = {nome: np.asarray(valores, dtype=np.int64) for nome, valores in colunas.items()}
+        anos = np.array([agregados.ano_do_id.get(a) or -1 for a in c['ano_id'].tolist()], dtype=np.int64)
+        tem_anterior = c['preco_anterior'] > 0
+
+        # Modelos: grupos de (tipo, modelo_id)
+        chave_modelo = (c['tipo'] << 40) | c['modelo_id']
+        unicos, grupo = np.unique(chave_modelo, return_inverse=True)
+        chaves_modelos = [(int(k >> 40), str(int(k & ((1 << 40) - 1)))) for k in unicos.tolist()]
+        # Curva de depreciação de todos os modelos de uma vez: somas do ajuste por grupo
+        no_ajuste = (anos > 0) & (anos != ANO_ZERO_KM) & (c['preco'] > 0)
+        x = (anos - ANO_BASE).astype(np.float64)
+        y = np.log(np.where(no_ajuste, c['preco'], 1).astype(np.float64))
+        peso = no_ajuste.astype(np.float64)
+        somas = [np.bincount(grupo, weights=peso * v, minlength=len(unicos)) for v in (1.0, x, y, x * x, x * y)]
+
+        # Marcas: o grupo da marca de cada modelo (-1 sem marca conhecida)
+        codigos_marca = {}
+        marca_por_modelo = np.array([
+            codigos_marca.setdefault((tipo, agregados.marca_do_modelo[(tipo, modelo)]), len(codigos_marca))
+            if (tipo, modelo) in agregados.marca_do_modelo else -1
+            for tipo, modelo in chaves_modelos
+        ], dtype=np.int64)
+        grupo_marca = marca_por_modelo[grupo]
+        variacao = np.where(tem_anterior, (c['preco'] - c['preco_anterior']) / np.where(tem_anterior,
+                                                                                      c['preco_anterior'], 1), 0.0)
+        com_marca = grupo_marca >= 0
+        soma_variacao = np.bincount(grupo_marca[com_marca], weights=variacao[com_marca], minlength=len(codigos_marca))
+        com_variacao = np.bincount(grupo_marca[com_marca & tem_anterior], minlength=len(codigos_marca))
+
+        for indice, chave in enumerate(chaves_modelos):
+            modelo = agregados.modelos[chave] = EstatisticasModelo()
+            modelo.n = int(somas[0][indice])
+            modelo.sx, modelo.sy, modelo.sxx, modelo.sxy = (float(s[indice]) for s in somas[1:])
+        chaves_marcas = list(codigos_marca)
+        for (tipo, codigo), indice in codigos_marca.items():
+            marca = agregados.marcas[(tipo, codigo)] = EstatisticasMarca()
+            marca.soma_variacao, marca.com_variacao = float(soma_variacao[indice]), int(com_variacao[indice])
+        for precos, grupos, destino in ((c['preco'], grupo, [agregados.modelos[k] for k in chaves_modelos]),
+                                        (c['preco'][com_marca], grupo_marca[com_marca],
+                                         [agregados.marcas[k] for k in chaves_marcas])):
+            # Listas já ordenadas por grupo e preço, fatiadas sem laço por veículo
+            ordem = np.lexsort((precos, grupos))
+            ordenados = precos[ordem].tolist()
+            limites = np.searchsorted(grupos[ordem], np.arange(len(destino) + 1)).tolist()
+            for indice, estatisticas in enumerate(destino):
+                estatisticas.rollup = Rollup(ordenados[limites[indice]:limites[indice + 1]])
+
+        linhas = zip(*(c[nome].tolist() for nome in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco', 'mes_anterior',
+                                                     'preco_anterior', 'minimo', 'maximo')),
+                     anos.tolist(), grupo_marca.tolist())
+        for ano_id, tipo, modelo_id, mes, preco, mes_anterior, preco_anterior, minimo, maximo, ano, marca in linhas:
+            agregados.veiculos[ano_id] = EstatisticasVeiculo(
+                tipo, str(modelo_id), chaves_marcas[marca] if marca >= 0 else None, ano if ano > 0 else None,
+                mes, preco,
+                mes_anterior if preco_anterior > 0 else None, preco_anterior if preco_anterior > 0 else None,
+                minimo, maximo)
+            agregados.modelos[(tipo, str(modelo_id))].ano_ids.add(ano_id)
+        return agregados
+
+    def salvar(self, caminho):
+        """Grava uma linha por veículo (e o catálogo) em JSON; ``carregar`` remonta o resto"""
+        colunas = {nome: [] for nome in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco', 'mes_anterior',
+                                         'preco_anterior', 'minimo', 'maximo')}
+        for ano_id, v in self.veiculos.items():
+            for nome, valor in (('ano_id', ano_id), ('tipo', v.tipo), ('modelo_id', int(v.modelo_id)),
+                                ('mes', v.mes), ('preco', v.preco), ('mes_anterior', v.mes_anterior or -1),
+                                ('preco_anterior', v.preco_anterior or -1), ('minimo', v.minimo),
+                                ('maximo', v.maximo)):
+                colunas[nome].append(valor)
+        dados = {
+            'versao': 1,
+            'veiculos': colunas,
+            'modelos': [[tipo, modelo, marca] for (tipo, modelo), marca in self.marca_do_modelo.items()],
+            'anos': [[ano_id, ano] for ano_id, ano in self.ano_do_id.items() if ano is not None],
+        }
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        temporario = f"{caminho}.tmp"
+        with open(temporario, "w") as f:
+            json.dump(dados, f, separators=(",", ":"))
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def carregar(cls, caminho):
+        _exigir_numpy()
+        with open(caminho) as f:
+            dados = json.load(f)
+        return cls._montar(dados['veiculos'],
+                           {(tipo, modelo): marca for tipo, modelo, marca in dados['modelos']},
+                           {ano_id: ano for ano_id, ano in dados['anos']})
+
+
+async def preencher_catalogo(armazenamento, agregados, tamanho_pagina=1000):
+    """Preenche a marca de cada modelo e o ano modelo de cada ano_id a partir do banco"""
+    (modelos, _), (anos, _) = await asyncio.gather(
+        carregar_tabela(armazenamento, 'modelos', ('codigo', 'marca_id', 'tipo_veiculo'), 'codigo', tamanho_pagina),
+        carregar_tabela(armazenamento, 'anos_modelo', ('id', 'codigo'), 'id', tamanho_pagina),
+    )
+    agregados.registrar_linhas('modelos', modelos)
+    agregados.registrar_linhas('anos_modelo', anos)
+    return agregados
+
+
+async def ler_historico(armazenamento, tamanho_pagina=1000):
+    """Todo o histórico de veiculos e veiculos_inalterados, em colunas compactas"""
+    colunas = {nome: array('q') for nome in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco')}
+    async for pagina in ler_paginas(armazenamento, 'veiculos',
+                                    ('id', 'ano_id', 'tipo_veiculo', 'modelo_id', 'mes_referencia_id', 'preco'),
+                                    'id', tamanho_pagina):
+        for linha in pagina:
+            colunas['ano_id'].append(linha['ano_id'])
+            colunas['tipo'].append(linha.get('tipo_veiculo') or 1)
+            colunas['modelo_id'].append(int(linha['modelo_id']))
+            colunas['mes'].append(linha['mes_referencia_id'])
+            colunas['preco'].append(centavos(linha['preco']))
+    inalterados = (array('q'), array('q'))
+    async for pagina in ler_paginas(armazenamento, 'veiculos_inalterados', ('lote', 'mes_referencia_id', 'ano_ids'),
+                                    'lote', tamanho_pagina):
+        for linha in pagina:
+            inalterados[0].extend(linha['ano_ids'])
+            inalterados[1].extend([linha['mes_referencia_id']] * len(linha['ano_ids']))
+    return colunas, inalterados
+
+
+def ler_exportacao(caminho):
+    """Lê um CSV exportado de veiculos (colunas ano_id, modelo_id, mes_referencia_id, preco e tipo_veiculo)"""
+    colunas = {nome: array('q') for nome in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco')}
+    with open(caminho, newline="") as f:
+        for linha in csv.DictReader(f):
+            colunas['ano_id'].append(int(linha['ano_id']))
+            colunas['tipo'].append(int(linha.get('tipo_veiculo') or 1))
+            colunas['modelo_id'].append(int(linha['modelo_id']))
+            colunas['mes'].append(int(linha['mes_referencia_id']))
+            colunas['preco'].append(centavos(linha['preco']))
+    return colunas
+
+
+async def reconstruir_do_banco(armazenamento, exportacao=None, tamanho_pagina=1000):
+    """Reconstrói os agregados do histórico inteiro (do banco ou de um CSV exportado de veiculos)"""
+    inicio = time.perf_counter()
+    catalogo = await preencher_catalogo(armazenamento, AgregadosPrecos(), tamanho_pagina)
+    if exportacao:
+        colunas, inalterados = ler_exportacao(exportacao), None
+    else:
+        colunas, inalterados = await ler_historico(armazenamento, tamanho_pagina)
+    lido = time.perf_counter()
+    agregados = AgregadosPrecos.reconstruir(colunas['ano_id'], colunas['tipo'], colunas['modelo_id'],
+                                            colunas['mes'], colunas['preco'], inalterados,
+                                            catalogo.marca_do_modelo, catalogo.ano_do_id)
+    print(f"⏱️ Agregados: {len(colunas['ano_id'])} preços lidos em {lido - inicio:.2f}s, "
+          f"{len(agregados)} veículos e {len(agregados.modelos)} modelos calculados em "
+          f"{time.perf_counter() - lido:.2f}s")
+    return agregados
+
+
+def main():
+    from supabase import create_client
+    from armazenamento import ArmazenamentoAsync
+
+    parser = argparse.ArgumentParser(description="Reconstrói os agregados de preço a partir do histórico")
+    parser.add_argument("--exportacao", help="CSV exportado de veiculos (padrão: ler a tabela do banco)")
+    parser.add_argument("--saida", default=ARQUIVO_AGREGADOS)
+    args = parser.parse_args()
+
+    url, key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+    armazenamento = ArmazenamentoAsync(lambda: create_client(url, key))
+    try:
+        agregados = asyncio.run(reconstruir_do_banco(armazenamento, args.exportacao))
+        agregados.salvar(args.saida)
+        print(f"Agregados gravados em {args.saida}")
+    finally:
+        armazenamento.fechar()
+
+
+if __name__ == "__main__":
+    main()
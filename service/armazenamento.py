@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import rastreamento
+
+
+class ArmazenamentoAsync:
+    """Executa as chamadas síncronas do supabase-py fora do event loop.
+
+    As consultas rodam em um ``ThreadPoolExecutor`` dedicado; cada thread cria
+    (via ``fabrica_cliente``) e reutiliza o seu próprio cliente Supabase, ou seja,
+    o seu próprio pool de conexões HTTP. Assim a latência do banco se sobrepõe
+    à das requisições à FIPE em vez de travar todas elas.
+
+    Uso:
+        resposta = await armazenamento.executar(
+            lambda db: db.table('marcas').select('*').execute(),
+            tabela='marcas', operacao='select',
+        )
+
+    Com ``metricas``, o tempo de cada chamada ao banco (sem a espera por uma
+    thread livre) vai para ``banco_operacao_segundos{tabela, operacao}``. Com o
+    rastreamento ligado, cada chamada gera o span "banco" (com a espera por uma
+    thread) e, na linha da thread, "banco.execucao".
+    """
+
+    def __init__(self, fabrica_cliente, max_workers=4, metricas=None):
+        self.fabrica_cliente = fabrica_cliente
+        self.max_workers = max_workers
+        self.metricas = metricas
+        self.em_andamento = 0
+        self._local = threading.local()
+        self._executor = None
+        if metricas is not None:
+            metricas.medidor("banco_operacoes_em_andamento", "Chamadas ao banco enviadas e ainda não concluídas",
+                             funcao=lambda: self.em_andamento)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="supabase")
+        return self._executor
+
+    def cliente(self):
+        """Cliente Supabase da thread atual, criado na primeira utilização"""
+        cliente = getattr(self._local, "cliente", None)
+        if cliente is None:
+            cliente = self.fabrica_cliente()
+            self._local.cliente = cliente
+        return cliente
+
+    def _rodar(self, consulta, tabela, operacao):
+        inicio = time.perf_counter()
+        try:
+            resultado, erro = consulta(self.cliente()), None
+        except Exception as e:
+            resultado, erro = None, e
+        fim = time.perf_counter()
+        rastreamento.registrar("banco.execucao", inicio, fim, "banco", tabela=tabela, operacao=operacao)
+        return resultado, erro, fim - inicio
+
+    async def executar(self, consulta, tabela="-", operacao="-"):
+        loop = asyncio.get_running_loop()
+        self.em_andamento += 1
+        try:
+            with rastreamento.span("banco", "banco", tabela=tabela, operacao=operacao):
+                resultado, erro, duracao = await loop.run_in_executor(self.executor, self._rodar, consulta,
+                                                                      tabela, operacao)
+        finally:
+            self.em_andamento -= 1
+        if self.metricas is not None:
+            # Registrado no event loop, então as métricas não precisam de lock
+            self.metricas.histograma("banco_operacao_segundos", "Duração das chamadas ao banco",
+                                     tabela=tabela, operacao=operacao).observar(duracao)
+            if erro is not None:
+                self.metricas.contador("banco_erros_total", "Chamadas ao banco que falharam",
+                                       tabela=tabela, operacao=operacao).inc()
+        if erro is not None:
+            raise erro
+        return resultado
+
+    def fechar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
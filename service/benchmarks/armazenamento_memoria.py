@@ -0,0 +1,185 @@
+"""Substituto em memória do cliente Supabase para benchmarks.
+
+Implementa o subconjunto da API do supabase-py usado por ``service.py``
+(``table().select().eq().order().range().execute()``, ``upsert``, ``insert``,
+``delete`` e ``rpc``) sobre dicionários, contando cada ida ao "banco".
+Opcionalmente simula a latência de rede de cada chamada.
+"""
+import threading
+import time
+
+
+class Resposta:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class Consulta:
+    def __init__(self, banco, tabela):
+        self.banco = banco
+        self.tabela = tabela
+        self.operacao = "select"
+        self.colunas = None
+        self.filtros = []
+        self.ordem = None
+        self.intervalo = None
+        self.linhas = None
+        self.on_conflict = None
+        self.contagem = None
+
+    # --- construção ---------------------------------------------------------
+
+    def select(self, *colunas, count=None):
+        self.operacao = "select"
+        self.contagem = count
+        colunas = [c for parte in colunas for c in parte.split(",")]
+        self.colunas = None if colunas in ([], ["*"]) else [c.strip() for c in colunas]
+        return self
+
+    def eq(self, coluna, valor):
+        self.filtros.append(lambda linha: str(linha.get(coluna)) == str(valor))
+        return self
+
+    def in_(self, coluna, valores):
+        valores = {str(v) for v in valores}
+        self.filtros.append(lambda linha: str(linha.get(coluna)) in valores)
+        return self
+
+    def gte(self, coluna, valor):
+        self.filtros.append(lambda linha: linha.get(coluna) is not None and linha.get(coluna) >= valor)
+        return self
+
+    def lt(self, coluna, valor):
+        self.filtros.append(lambda linha: linha.get(coluna) is not None and linha.get(coluna) < valor)
+        return self
+
+    def order(self, coluna, desc=False):
+        self.ordem = (coluna, desc)
+        return self
+
+    def range(self, inicio, fim):
+        self.intervalo = (inicio, fim)
+        return self
+
+    def limit(self, quantidade):
+        self.intervalo = (0, quantidade - 1)
+        return self
+
+    def upsert(self, linhas, on_conflict=None, ignore_duplicates=False):
+        self.operacao = "upsert"
+        self.linhas = linhas if isinstance(linhas, list) else [linhas]
+        self.on_conflict = on_conflict
+        return self
+
+    def insert(self, linhas):
+        self.operacao = "insert"
+        self.linhas = linhas if isinstance(linhas, list) else [linhas]
+        return self
+
+    def update(self, valores):
+        self.operacao = "update"
+        self.linhas = [valores]
+        return self
+
+    def delete(self):
+        self.operacao = "delete"
+        return self
+
+    # --- execução -----------------------------------------------------------
+
+    def execute(self):
+        return self.banco._executar(self)
+
+
+class BancoMemoria:
+    def __init__(self, latencia_ms=0.0):
+        self.latencia_ms = latencia_ms
+        self.tabelas = {}
+        self.sequencias = {}
+        self.indices = {}
+        self.idas = 0
+        self.idas_por_operacao = {}
+        self.linhas_escritas = 0
+        self.rpcs = {}
+        self._lock = threading.Lock()
+
+    def _indice(self, tabela, colunas):
+        """Índice por chave de conflito, construído na primeira vez que é usado"""
+        indice = self.indices.get((tabela, colunas))
+        if indice is None:
+            indice = {tuple(str(l.get(c)) for c in colunas): l for l in self.tabelas.get(tabela, [])}
+            self.indices[(tabela, colunas)] = indice
+        return indice
+
+    def table(self, nome):
+        return Consulta(self, nome)
+
+    def rpc(self, nome, parametros=None):
+        banco = self
+
+        class ChamadaRpc:
+            def execute(self_rpc):
+                banco._contar("rpc")
+                funcao = banco.rpcs.get(nome)
+                return Resposta(funcao(banco, parametros or {}) if funcao else [])
+        return ChamadaRpc()
+
+    def _contar(self, operacao):
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+        with self._lock:
+            self.idas += 1
+            self.idas_por_operacao[operacao] = self.idas_por_operacao.get(operacao, 0) + 1
+
+    def _executar(self, consulta):
+        self._contar(f"{consulta.operacao}:{consulta.tabela}")
+        with self._lock:
+            linhas = self.tabelas.setdefault(consulta.tabela, [])
+            if consulta.operacao == "select":
+                resultado = [l for l in linhas if all(f(l) for f in consulta.filtros)]
+                total = len(resultado) if consulta.contagem else None
+                if consulta.ordem:
+                    coluna, desc = consulta.ordem
+                    resultado.sort(key=lambda l: (l.get(coluna) is None, l.get(coluna)), reverse=desc)
+                if consulta.intervalo:
+                    inicio, fim = consulta.intervalo
+                    resultado = resultado[inicio:fim + 1]
+                if consulta.colunas:
+                    resultado = [{c: l.get(c) for c in consulta.colunas} for l in resultado]
+                return Resposta([dict(l) for l in resultado], count=total)
+
+            if consulta.operacao in ("insert", "upsert"):
+                gravadas = []
+                colunas = tuple(consulta.on_conflict.split(",")) if consulta.on_conflict else None
+                indice = self._indice(consulta.tabela, colunas) if colunas else None
+                for nova in consulta.linhas:
+                    chave = tuple(str(nova.get(c)) for c in colunas) if colunas else None
+                    existente = indice.get(chave) if indice is not None else None
+                    if existente is not None and consulta.operacao == "upsert":
+                        existente.update(nova)
+                        gravadas.append(dict(existente))
+                    else:
+                        linha = dict(nova)
+                        if "id" not in linha:
+                            self.sequencias[consulta.tabela] = self.sequencias.get(consulta.tabela, 0) + 1
+                            linha["id"] = self.sequencias[consulta.tabela]
+                        linhas.append(linha)
+                        gravadas.append(dict(linha))
+                        if indice is not None:
+                            indice[chave] = linha
+                self.linhas_escritas += len(consulta.linhas)
+                return Resposta(gravadas)
+
+            if consulta.operacao == "update":
+                alteradas = [l for l in linhas if all(f(l) for f in consulta.filtros)]
+                for linha in alteradas:
+                    linha.update(consulta.linhas[0])
+                return Resposta([dict(l) for l in alteradas])
+
+            if consulta.operacao == "delete":
+                removidas = [l for l in linhas if all(f(l) for f in consulta.filtros)]
+                self.tabelas[consulta.tabela] = [l for l in linhas if l not in removidas]
+                self.indices = {k: v for k, v in self.indices.items() if k[0] != consulta.tabela}
+                return Resposta(removidas)
+        raise ValueError(f"Operação não suportada: {consulta.operacao}")
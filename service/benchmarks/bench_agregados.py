@@ -0,0 +1,111 @@
+"""Agregados de preço (agregados.py): atualização incremental, reconstrução e leitura.
+
+Gera um histórico sintético de ``--meses`` meses para ``--veiculos`` veículos e mede:
+a atualização incremental, linha a linha, como acontece durante a coleta; a
+reconstrução vetorizada com NumPy a partir do histórico inteiro; e a leitura das
+estatísticas de um modelo comparada com o cálculo a partir do histórico (o que a
+API teria de fazer sem os agregados). Os dois caminhos devem dar o mesmo resultado.
+
+Uso:
+    python benchmarks/bench_agregados.py --veiculos 50000 --meses 24
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agregados import AgregadosPrecos  # noqa: E402
+from catalogo import ANO_ZERO_KM  # noqa: E402
+
+
+def gerar_historico(veiculos, meses, aleatorio):
+    """Colunas de veiculos (ordenadas por mês, como chegam do scraper) e o catálogo"""
+    marca_do_modelo, ano_do_id, base = {}, {}, []
+    for ano_id in range(1, veiculos + 1):
+        modelo = 1000 + ano_id // 8
+        marca_do_modelo[(1, str(modelo))] = str(modelo // 50)
+        ano = aleatorio.choice([ANO_ZERO_KM] + list(range(2000, 2025)))
+        ano_do_id[ano_id] = ano
+        idade = 0 if ano == ANO_ZERO_KM else 2025 - ano
+        base.append((ano_id, modelo, aleatorio.lognormvariate(11.5, 0.6) * 0.9 ** idade))
+    colunas = {nome: [] for nome in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco')}
+    for mes in range(300 - meses, 300):
+        for ano_id, modelo, preco in base:
+            colunas['ano_id'].append(ano_id)
+            colunas['tipo'].append(1)
+            colunas['modelo_id'].append(modelo)
+            colunas['mes'].append(mes)
+            colunas['preco'].append(round(preco * (1 + 0.005 * (mes - 300)) * aleatorio.uniform(0.98, 1.02) * 100))
+    return colunas, marca_do_modelo, ano_do_id
+
+
+def do_historico(colunas, tipo, modelo_id):
+    """Resumo do modelo calculado varrendo o histórico, sem agregados"""
+    ultimos = {}
+    for ano_id, t, modelo, mes, preco in zip(*(colunas[n] for n in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco'))):
+        if t == tipo and modelo == modelo_id and mes >= ultimos.get(ano_id, (-1, 0))[0]:
+            ultimos[ano_id] = (mes, preco)
+    precos = sorted(preco for _, preco in ultimos.values())
+    return {'quantidade': len(precos), 'minimo': precos[0] / 100, 'maximo': precos[-1] / 100,
+            'mediana': round(statistics.median(precos) / 100, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--veiculos", type=int, default=50_000)
+    parser.add_argument("--meses", type=int, default=24)
+    parser.add_argument("--leituras", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    aleatorio = random.Random(args.seed)
+    colunas, marca_do_modelo, ano_do_id = gerar_historico(args.veiculos, args.meses, aleatorio)
+    linhas = len(colunas['ano_id'])
+
+    incremental = AgregadosPrecos()
+    incremental.marca_do_modelo, incremental.ano_do_id = dict(marca_do_modelo), dict(ano_do_id)
+    inicio = time.perf_counter()
+    for ano_id, tipo, modelo, mes, preco in zip(*(colunas[n] for n in ('ano_id', 'tipo', 'modelo_id', 'mes', 'preco'))):
+        incremental.registrar_preco(tipo, modelo, ano_id, mes, preco)
+    tempo_incremental = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    reconstruido = AgregadosPrecos.reconstruir(colunas['ano_id'], colunas['tipo'], colunas['modelo_id'],
+                                               colunas['mes'], colunas['preco'], None, marca_do_modelo, ano_do_id)
+    tempo_reconstrucao = time.perf_counter() - inicio
+
+    modelos = aleatorio.sample(sorted(incremental.modelos), min(args.leituras, len(incremental.modelos)))
+    inicio = time.perf_counter()
+    lidos = [incremental.modelo(tipo, modelo, curva=False) for tipo, modelo in modelos]
+    tempo_leitura = (time.perf_counter() - inicio) / len(modelos)
+    amostra = modelos[:max(1, min(20, len(modelos)))]
+    inicio = time.perf_counter()
+    varridos = [do_historico(colunas, tipo, int(modelo)) for tipo, modelo in amostra]
+    tempo_varredura = (time.perf_counter() - inicio) / len(amostra)
+
+    for (tipo, modelo), lido, varrido in zip(amostra, lidos, varridos):
+        outro = reconstruido.modelo(tipo, modelo, curva=False)
+        for chave, valor in varrido.items():
+            if not math.isclose(lido[chave], valor, abs_tol=0.011) or not math.isclose(outro[chave], valor,
+                                                                                       abs_tol=0.011):
+                raise SystemExit(f"modelo {modelo}: {chave} difere ({lido[chave]}, {outro[chave]}, {valor})")
+        if not math.isclose(lido['depreciacao_anual'] or 0, outro['depreciacao_anual'] or 0, abs_tol=1e-6):
+            raise SystemExit(f"modelo {modelo}: depreciação difere entre o incremental e a reconstrução")
+    taxas = [m['depreciacao_anual'] for m in lidos if m['depreciacao_anual'] is not None]
+
+    print(f"\n{args.veiculos} veículos x {args.meses} meses = {linhas} preços, {len(incremental.modelos)} modelos, "
+          f"{len(incremental.marcas)} marcas")
+    print(f"Incremental:  {tempo_incremental:.2f}s ({linhas / tempo_incremental:,.0f} preços/s)")
+    print(f"Reconstrução: {tempo_reconstrucao:.2f}s (NumPy, histórico inteiro)")
+    print(f"Leitura de um modelo: {tempo_leitura * 1e6:.1f} µs com agregados, "
+          f"{tempo_varredura * 1000:.1f} ms varrendo o histórico")
+    print(f"Depreciação anual mediana: {statistics.median(taxas):.1%} (gerada com 10%)")
+
+
+if __name__ == "__main__":
+    main()
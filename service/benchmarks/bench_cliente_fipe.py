@@ -0,0 +1,116 @@
+"""Compara o cliente HTTP compartilhado com uma sessão nova por requisição.
+
+Sobe o mock da FIPE localmente e dispara ``ConsultarValorComTodosParametros``
+com a mesma concorrência nos dois modos, reportando requisições/s e latência
+p50/p99.
+
+Uso:
+    python benchmarks/bench_cliente_fipe.py --requisicoes 2000 --concorrencia 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cliente_fipe import ClienteFipe  # noqa: E402
+from mock_fipe import MockFipe, iniciar_mock  # noqa: E402
+
+HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+PAYLOAD = {
+    "codigoTabelaReferencia": 300,
+    "codigoMarca": 1,
+    "codigoModelo": 10001,
+    "codigoTipoVeiculo": 1,
+    "anoModelo": 2020,
+    "codigoTipoCombustivel": 1,
+    "tipoConsulta": "tradicional",
+}
+ENDPOINT = "ConsultarValorComTodosParametros"
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+async def requisicao_sessao_por_chamada(base_url, _cliente):
+    # Comportamento antigo de requisitar_api: uma ClientSession por chamada
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base_url}/{ENDPOINT}", data=PAYLOAD, headers=HEADERS) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+async def requisicao_cliente_compartilhado(_base_url, cliente):
+    async with cliente.post(ENDPOINT, PAYLOAD) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def medir(nome, funcao, base_url, cliente, requisicoes, concorrencia):
+    latencias = []
+    fila = asyncio.Queue()
+    for _ in range(requisicoes):
+        fila.put_nowait(None)
+
+    async def worker():
+        while True:
+            try:
+                fila.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            inicio = time.perf_counter()
+            await funcao(base_url, cliente)
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+
+    return {
+        "modo": nome,
+        "req/s": requisicoes / duracao,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requisicoes", type=int, default=2000)
+    parser.add_argument("--concorrencia", type=int, default=20)
+    parser.add_argument("--latencia-ms", type=float, default=0.0,
+                        help="latência artificial do servidor mock")
+    args = parser.parse_args()
+
+    runner, base_url = await iniciar_mock(MockFipe(latencia_ms=args.latencia_ms))
+    try:
+        resultados = []
+        resultados.append(await medir(
+            "sessão por chamada", requisicao_sessao_por_chamada,
+            base_url, None, args.requisicoes, args.concorrencia,
+        ))
+        async with ClienteFipe(base_url, HEADERS, limite_conexoes=args.concorrencia,
+                               limite_por_host=args.concorrencia) as cliente:
+            resultados.append(await medir(
+                "cliente compartilhado", requisicao_cliente_compartilhado,
+                base_url, cliente, args.requisicoes, args.concorrencia,
+            ))
+    finally:
+        await runner.cleanup()
+
+    print(f"\n{args.requisicoes} requisições, concorrência {args.concorrencia}, "
+          f"latência do mock {args.latencia_ms} ms")
+    print(f"{'modo':<24}{'req/s':>10}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for r in resultados:
+        print(f"{r['modo']:<24}{r['req/s']:>10.1f}{r['p50_ms']:>12.2f}{r['p99_ms']:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
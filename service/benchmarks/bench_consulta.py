@@ -0,0 +1,145 @@
+"""Latência das consultas da API de leitura (consulta.py) contra uma varredura linear.
+
+Monta um ``IndiceConsulta`` com veículos sintéticos e mede, para uma mistura de
+consultas (busca por prefixo, marca, ano, faixa de preço, combinações), o tempo
+do índice e o de filtrar a lista inteira a cada consulta, como faz hoje o
+``filteredVehicles`` do frontend. Os dois caminhos devem devolver o mesmo total.
+
+Uso:
+    python benchmarks/bench_consulta.py --veiculos 100000 --consultas 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalogo import ANO_ZERO_KM  # noqa: E402
+from consulta import IndiceConsulta, normalizar, termos  # noqa: E402
+
+COMBUSTIVEIS = ["Gasolina", "Diesel", "Flex", "Álcool", "Elétrico"]
+PALAVRAS = ["Sedan", "Hatch", "Turbo", "Sport", "Comfort", "Highline", "Cabine", "Dupla", "Automático", "TSI"]
+
+
+def gerar_veiculos(quantidade, marcas, aleatorio):
+    veiculos = []
+    for indice in range(quantidade):
+        marca = aleatorio.randrange(marcas)
+        modelo = marca * 1000 + aleatorio.randrange(200)
+        ano = aleatorio.choice([ANO_ZERO_KM] + list(range(1995, 2025)))
+        combustivel = aleatorio.choice(COMBUSTIVEIS)
+        preco = round(aleatorio.lognormvariate(11, 0.8), 2)
+        veiculos.append({
+            'id': f"1-{modelo}-{indice}",
+            'tipo_veiculo': 1,
+            'marca_id': str(marca),
+            'marca': f"Marca{marca}",
+            'modelo_id': modelo,
+            'modelo': " ".join(aleatorio.sample(PALAVRAS, 3)) + f" {modelo % 97}",
+            'ano_id': indice,
+            'ano': ano,
+            'descricao_ano': f"{ano} {combustivel}",
+            'combustivel': combustivel,
+            'codigo_fipe': f"{modelo:06d}-1",
+            'preco': preco,
+            'centavos': round(preco * 100),
+            'mes_referencia_id': 300,
+        })
+    return veiculos
+
+
+def gerar_consultas(quantidade, marcas, aleatorio):
+    consultas = []
+    for _ in range(quantidade):
+        filtros = {}
+        if aleatorio.random() < 0.5:
+            filtros['busca'] = " ".join(p[:aleatorio.randint(2, 4)].lower()
+                                        for p in aleatorio.sample(PALAVRAS, aleatorio.randint(1, 2)))
+        if aleatorio.random() < 0.4:
+            filtros['marca'] = f"1:{aleatorio.randrange(marcas)}"
+        if aleatorio.random() < 0.3:
+            filtros['ano'] = aleatorio.randrange(1995, 2025)
+        if aleatorio.random() < 0.2:
+            filtros['combustivel'] = normalizar(aleatorio.choice(COMBUSTIVEIS))
+        if aleatorio.random() < 0.5:
+            minimo = aleatorio.randrange(10_000, 80_000)
+            filtros['preco_min'], filtros['preco_max'] = minimo * 100, (minimo + 30_000) * 100
+        consultas.append(filtros)
+    return consultas
+
+
+def varredura(veiculos, busca=None, marca=None, ano=None, combustivel=None, preco_min=None, preco_max=None,
+              pagina=1, por_pagina=24):
+    """Filtragem linear, como o getter do frontend, seguida da ordenação por preço"""
+    palavras = termos(busca or "")
+    resultado = []
+    for v in veiculos:
+        if marca is not None and f"{v['tipo_veiculo']}:{v['marca_id']}" != marca:
+            continue
+        if ano is not None and v['ano'] != ano:
+            continue
+        if combustivel is not None and normalizar(v['combustivel']) != combustivel:
+            continue
+        centavos = round(v['preco'] * 100)
+        if preco_min is not None and centavos < preco_min or preco_max is not None and centavos > preco_max:
+            continue
+        if palavras:
+            texto = termos(f"{v['marca']} {v['modelo']} {v['descricao_ano']} {v['combustivel']}")
+            if not all(any(t.startswith(p) for t in texto) for p in palavras):
+                continue
+        resultado.append(v)
+    resultado.sort(key=lambda v: v['preco'])
+    inicio = (pagina - 1) * por_pagina
+    return len(resultado), resultado[inicio:inicio + por_pagina]
+
+
+def medir(funcao, consultas):
+    tempos, totais = [], []
+    for filtros in consultas:
+        inicio = time.perf_counter()
+        totais.append(funcao(filtros))
+        tempos.append(time.perf_counter() - inicio)
+    tempos.sort()
+    return {
+        "p50_ms": statistics.median(tempos) * 1000,
+        "p95_ms": tempos[int(len(tempos) * 0.95) - 1] * 1000,
+        "total_s": sum(tempos),
+        "totais": totais,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--veiculos", type=int, default=100_000)
+    parser.add_argument("--marcas", type=int, default=80)
+    parser.add_argument("--consultas", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    aleatorio = random.Random(args.seed)
+    veiculos = gerar_veiculos(args.veiculos, args.marcas, aleatorio)
+    consultas = gerar_consultas(args.consultas, args.marcas, aleatorio)
+
+    inicio = time.perf_counter()
+    indice = IndiceConsulta([dict(v) for v in veiculos], 300)
+    construcao = time.perf_counter() - inicio
+
+    com_indice = medir(lambda f: indice.consultar(**f)['total'], consultas)
+    linear = medir(lambda f: varredura(veiculos, **f)[0], consultas)
+    if com_indice["totais"] != linear["totais"]:
+        divergentes = sum(a != b for a, b in zip(com_indice["totais"], linear["totais"]))
+        raise SystemExit(f"{divergentes} consultas com totais diferentes entre o índice e a varredura")
+
+    print(f"\n{args.veiculos} veículos, {args.consultas} consultas; índice construído em {construcao:.2f}s "
+          f"({len(indice.termos)} termos)")
+    print(f"{'':<12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'total (s)':>12}")
+    for nome, r in (("varredura", linear), ("índice", com_indice)):
+        print(f"{nome:<12}{r['p50_ms']:>12.3f}{r['p95_ms']:>12.3f}{r['total_s']:>12.3f}")
+    print(f"Aceleração (p50): {linear['p50_ms'] / com_indice['p50_ms']:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
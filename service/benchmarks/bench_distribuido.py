@@ -0,0 +1,138 @@
+"""Escalabilidade do modo distribuido com 1, 2, 4... trabalhadores.
+
+Sobe o mock da FIPE neste processo e N processos ``--modo distribuido``, cada
+um com o seu limitador (``--taxa`` req/s), o seu banco em memória e todos com o
+mesmo arquivo de reservas. Reporta itens/s por quantidade de trabalhadores e
+quantas consultas de preço foram repetidas (devem ser zero, exceto com
+``--derrubar-apos``, em que o bloco do trabalhador derrubado é refeito por outro
+depois que a reserva expira).
+
+Uso:
+    python benchmarks/bench_distribuido.py --trabalhadores 1,2,4 --taxa 20
+    python benchmarks/bench_distribuido.py --trabalhadores 3 --derrubar-apos 2 --ttl 3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(DIRETORIO), DIRETORIO]
+
+from mock_fipe import MockFipe, iniciar_mock  # noqa: E402
+
+ENDPOINT_PRECO = "ConsultarValorComTodosParametros"
+ENDPOINTS_CATALOGO = ("ConsultarMarcas", "ConsultarModelos")
+
+
+async def trabalhador(args):
+    """Um processo do modo distribuido, com o banco em memória"""
+    import service
+    from armazenamento import ArmazenamentoAsync
+    from armazenamento_memoria import BancoMemoria
+    from limitador import LimitadorAdaptativo
+
+    banco = BancoMemoria()
+    service.BASE_URL = args.url
+    service.armazenamento = ArmazenamentoAsync(lambda: banco, **service.CONFIG_ARMAZENAMENTO)
+    service.rate_limit = LimitadorAdaptativo(**{
+        **service.CONFIG_LIMITADOR, "taxa_inicial": args.taxa, "taxa_max": args.taxa, "arquivo_estado": None,
+    })
+    service.CONFIG_DISTRIBUIDO.update(blocos=args.blocos, ttl_reserva=args.ttl)
+    service.CONFIG_TIPOS['tipos'] = [1]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await service.rodar_scraping("distribuido")
+    service.armazenamento.fechar()
+    return {"precos": len(banco.tabelas.get("veiculos", []))}
+
+
+async def medir(args, quantidade, mock, url):
+    mock.chamadas.clear()
+    with tempfile.TemporaryDirectory(prefix="autofipe-dist-") as dados:
+        env_base = {
+            **os.environ,
+            "SUPABASE_URL": os.getenv("SUPABASE_URL", "http://127.0.0.1:1"),
+            "SUPABASE_KEY": os.getenv("SUPABASE_KEY", "benchmark"),
+            "AUTOFIPE_RESERVAS": os.path.join(dados, "reservas.sqlite3"),
+        }
+        inicio = time.perf_counter()
+        processos = []
+        for indice in range(quantidade):
+            env = {**env_base, "AUTOFIPE_DADOS": os.path.join(dados, f"t{indice}"),
+                   "AUTOFIPE_TRABALHADOR": f"bench-{indice}"}
+            processos.append(await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--interno", "--url", url,
+                "--taxa", str(args.taxa), "--blocos", str(args.blocos), "--ttl", str(args.ttl),
+                env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            ))
+        if args.derrubar_apos:
+            await asyncio.sleep(args.derrubar_apos)
+            processos[0].kill()
+        saidas = await asyncio.gather(*(p.communicate() for p in processos))
+        duracao = time.perf_counter() - inicio
+
+    precos = 0
+    for indice, (processo, (stdout, stderr)) in enumerate(zip(processos, saidas)):
+        if processo.returncode == 0:
+            precos += json.loads(stdout.decode().strip().splitlines()[-1])["precos"]
+        elif not (args.derrubar_apos and indice == 0):
+            raise RuntimeError(f"Trabalhador {indice} falhou:\n{stderr.decode()}")
+    esperado = args.marcas * args.modelos * args.anos
+    consultas = mock.chamadas.get(ENDPOINT_PRECO, 0)
+    return {
+        "trabalhadores": quantidade,
+        "duracao": duracao,
+        "itens_por_segundo": esperado / duracao,
+        "consultas_preco": consultas,
+        "repetidas": consultas - esperado,
+        "catalogo": sum(mock.chamadas.get(endpoint, 0) for endpoint in ENDPOINTS_CATALOGO),
+        "precos_gravados": precos,
+    }
+
+
+async def principal(args):
+    mock = MockFipe(args.marcas, args.modelos, args.anos, 1, args.latencia_ms)
+    runner, url = await iniciar_mock(mock)
+    try:
+        resultados = [await medir(args, int(n), mock, url) for n in args.trabalhadores.split(",")]
+    finally:
+        await runner.cleanup()
+
+    print(f"\n{args.marcas * args.modelos * args.anos} preços, {args.blocos} blocos, "
+          f"{args.taxa} req/s por trabalhador, latência {args.latencia_ms} ms")
+    print(f"{'trabalhadores':>14}{'duração (s)':>13}{'itens/s':>10}{'escala':>8}{'consultas':>11}{'repetidas':>11}"
+          f"{'catálogo':>10}")
+    base = resultados[0]["itens_por_segundo"] / resultados[0]["trabalhadores"]
+    for r in resultados:
+        print(f"{r['trabalhadores']:>14}{r['duracao']:>13.2f}{r['itens_por_segundo']:>10.1f}"
+              f"{r['itens_por_segundo'] / base:>7.2f}x{r['consultas_preco']:>11}{r['repetidas']:>11}"
+              f"{r['catalogo']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trabalhadores", default="1,2,4")
+    parser.add_argument("--marcas", type=int, default=6)
+    parser.add_argument("--modelos", type=int, default=8)
+    parser.add_argument("--anos", type=int, default=4)
+    parser.add_argument("--latencia-ms", type=float, default=10.0)
+    parser.add_argument("--taxa", type=float, default=20.0, help="limite de req/s de cada trabalhador")
+    parser.add_argument("--blocos", type=int, default=16)
+    parser.add_argument("--ttl", type=float, default=30.0, help="prazo das reservas (s)")
+    parser.add_argument("--derrubar-apos", type=float, help="mata o primeiro trabalhador após N segundos")
+    parser.add_argument("--interno", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.interno:
+        print(json.dumps(asyncio.run(trabalhador(args))))
+    else:
+        asyncio.run(principal(args))
+
+
+if __name__ == "__main__":
+    main()
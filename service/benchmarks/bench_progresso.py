@@ -0,0 +1,80 @@
+"""Mede o custo do relatório de progresso por item processado.
+
+Compara o ``update_progress`` antigo (limpa o console com ``os.system`` e
+reimprime o painel a cada item) com ``RelatorioProgresso``, que redesenha no
+máximo algumas vezes por segundo. A saída vai para /dev/null, então o tempo
+medido é só o custo de gerar o relatório.
+
+Uso:
+    python benchmarks/bench_progresso.py --itens 2000
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progresso import RelatorioProgresso  # noqa: E402
+
+
+class SaidaTerminal:
+    """/dev/null que se apresenta como terminal, para exercitar o redesenho ANSI"""
+
+    def __init__(self, destino):
+        self.destino = destino
+
+    def write(self, texto):
+        return self.destino.write(texto)
+
+    def flush(self):
+        self.destino.flush()
+
+    def isatty(self):
+        return True
+
+
+def progresso_antigo(itens, destino):
+    with contextlib.redirect_stdout(destino):
+        for i in range(1, itens + 1):
+            os.system('cls' if os.name == 'nt' else 'clear >/dev/null')
+            print("=== Processo de Scraping em Andamento ===")
+            print("Etapa atual: 5/5")
+            print(f"Processando: Marca {i} - Modelo {i} - Ano {i}")
+            print(f"Progresso: {i}/{itens}")
+            print("\nEstatísticas de requisições:")
+            print({"total_requests": i, "errors": 0})
+
+
+def progresso_novo(itens, destino):
+    relatorio = RelatorioProgresso("Etapa 5/5: preços", total=itens, saida=SaidaTerminal(destino),
+                                   fonte_extras=lambda: {"Requisições": itens})
+    for i in range(1, itens + 1):
+        relatorio.atualizar(i, 0, detalhe=f"Marca {i} - Modelo {i} - Ano {i}")
+    relatorio.finalizar()
+    return relatorio.desenhos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--itens", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as destino:
+        inicio = time.perf_counter()
+        progresso_antigo(args.itens, destino)
+        antigo = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        desenhos = progresso_novo(args.itens, destino)
+        novo = time.perf_counter() - inicio
+
+    print(f"\n{args.itens} itens")
+    print(f"{'modo':<24}{'total (s)':>12}{'µs/item':>12}{'redesenhos':>12}")
+    print(f"{'limpa console por item':<24}{antigo:>12.3f}{antigo / args.itens * 1e6:>12.1f}{args.itens:>12}")
+    print(f"{'RelatorioProgresso':<24}{novo:>12.3f}{novo / args.itens * 1e6:>12.1f}{desenhos:>12}")
+
+
+if __name__ == "__main__":
+    main()
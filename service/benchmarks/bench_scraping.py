@@ -0,0 +1,289 @@
+"""Benchmark de ponta a ponta de ``rodar_scraping`` sem rede externa.
+
+Roda o scraper completo contra o mock local da FIPE (latência, jitter, taxa de
+429 e tamanho do catálogo configuráveis) e contra ``BancoMemoria`` no lugar do
+Supabase (com latência opcional por chamada). Cada repetição roda em um
+processo novo, com diretório de dados temporário, então não há cache, journal
+ou taxa aprendida de uma execução para outra e o pico de memória é o do
+próprio processo.
+
+Reporta, por repetição e a mediana:
+- itens/s: preços gravados por segundo de execução
+- chamadas à API por preço gravado
+- idas ao banco por linha gravada
+- pico de memória (RSS máximo do processo)
+- linhas gravadas em veiculos
+
+Com ``--delta``, o mês anterior é coletado antes (fora da medição) e a
+repetição mede só o mês atual no modo delta; ``--fracao-alterada`` define
+quantos preços do mock mudam de um mês para o outro.
+
+``--taxa-erro`` e ``--taxa-lenta`` degradam o mock (respostas 503 e respostas
+lentas); "perdidos" é quanto faltou para o total de preços do catálogo e deve
+continuar zero.
+
+Com ``--snapshot parquet`` (ou ``arrow``) o scraper grava também o dataset local
+de destinos.py; "snapshot" é quantos preços foram lidos de volta dele e deve
+bater com os do banco.
+
+Uso:
+    python benchmarks/bench_scraping.py --marcas 5 --modelos 10 --anos 5 --latencia-ms 20
+    python benchmarks/bench_scraping.py --repeticoes 3 --saida atual.json --comparar base.json
+    python benchmarks/bench_scraping.py --delta --fracao-alterada 0.1
+    python benchmarks/bench_scraping.py --taxa-429 0.05 --taxa-erro 0.05 --taxa-lenta 0.02
+    python benchmarks/bench_scraping.py --snapshot parquet
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(DIRETORIO), DIRETORIO]
+
+# (chave, rótulo, maior é melhor)
+COLUNAS = [
+    ("itens_por_segundo", "itens/s", True),
+    ("chamadas_api_por_preco", "API/preço", False),
+    ("idas_banco_por_linha", "banco/linha", False),
+    ("pico_memoria_mib", "pico MiB", False),
+    ("linhas_veiculos", "veiculos", False),
+    ("duracao_segundos", "duração (s)", False),
+]
+
+
+def instalar_rpcs(banco):
+    """As funções do Postgres usadas por verificar_completude_dados, sobre as tabelas em memória"""
+
+    def get_table_stats(banco, _):
+        return [{
+            "marcas_count": len(banco.tabelas.get("marcas", [])),
+            "modelos_count": len(banco.tabelas.get("modelos", [])),
+            "anos_count": len(banco.tabelas.get("anos_modelo", [])),
+        }]
+
+    def check_marcas_sem_modelos(banco, _):
+        com_modelos = {(m["tipo_veiculo"], str(m["marca_id"])) for m in banco.tabelas.get("modelos", [])}
+        return [{"nome": m["nome"]} for m in banco.tabelas.get("marcas", [])
+                if (m["tipo_veiculo"], str(m["codigo"])) not in com_modelos]
+
+    def check_modelos_sem_anos(banco, _):
+        com_anos = {(a["tipo_veiculo"], str(a["modelo_id"])) for a in banco.tabelas.get("anos_modelo", [])}
+        return [{"marca_nome": m["marca_id"], "modelo_nome": m["nome"]}
+                for m in banco.tabelas.get("modelos", []) if (m["tipo_veiculo"], str(m["codigo"])) not in com_anos]
+
+    banco.rpcs.update({
+        "get_table_stats": get_table_stats,
+        "check_marcas_sem_modelos": check_marcas_sem_modelos,
+        "check_modelos_sem_anos": check_modelos_sem_anos,
+    })
+
+
+async def executar_uma_vez(args):
+    # O service lê o diretório de dados na importação
+    os.environ["AUTOFIPE_DADOS"] = args.dados
+    import service
+    from armazenamento import ArmazenamentoAsync
+    from armazenamento_memoria import BancoMemoria
+    from destinos import ler_snapshot
+    from limitador import LimitadorAdaptativo
+    from mock_fipe import MockFipe, iniciar_mock
+
+    meses_mock = max(args.meses, 2) if args.delta else args.meses
+    mock = MockFipe(args.marcas, args.modelos, args.anos, meses_mock,
+                    args.latencia_ms, args.jitter_ms, args.taxa_429, seed=args.seed,
+                    fracao_alterada=args.fracao_alterada, taxa_erro=args.taxa_erro,
+                    taxa_lenta=args.taxa_lenta, latencia_lenta_ms=args.latencia_lenta_ms)
+    banco = BancoMemoria(latencia_ms=args.latencia_banco_ms)
+    instalar_rpcs(banco)
+
+    runner, base_url = await iniciar_mock(mock)
+    service.BASE_URL = base_url
+    service.CONFIG_TIPOS['tipos'] = [int(tipo) for tipo in args.tipos.split(",")]
+    service.CONFIG_RESILIENCIA['espera_reprocessamento'] = args.espera_reprocessamento
+    service.CONFIG_SNAPSHOT['formato'] = args.snapshot
+    service.armazenamento = ArmazenamentoAsync(lambda: banco, metricas=service.metricas,
+                                               **service.CONFIG_ARMAZENAMENTO)
+    service.rate_limit = LimitadorAdaptativo(**{
+        **service.CONFIG_LIMITADOR, "taxa_inicial": args.taxa, "taxa_max": max(args.taxa, 1) * 2,
+        "arquivo_estado": None,
+    })
+
+    saida = io.StringIO()
+    veiculos_antes = 0
+    if args.delta:
+        # O mês anterior completo, fora da medição
+        anterior = mock.tabelas()[1]["Codigo"]
+        with contextlib.redirect_stdout(saida):
+            await service.rodar_scraping("historico", desde=anterior, ate=anterior)
+        veiculos_antes = len(banco.tabelas.get("veiculos", []))
+        banco.idas = 0
+        banco.idas_por_operacao.clear()
+        mock.chamadas.clear()
+        service.CONFIG_DELTA['ativo'] = True
+
+    inicio = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(saida):
+            if args.modo == "pipeline":
+                await service.rodar_scraping("pipeline")
+            elif args.modo == "historico":
+                await service.rodar_scraping("historico", meses=args.meses)
+            else:
+                # No modo etapas cada execução roda a etapa que verificar_completude_dados escolher
+                for _ in range(5):
+                    await service.rodar_scraping("etapas")
+                    if banco.tabelas.get("veiculos"):
+                        break
+    finally:
+        duracao = time.perf_counter() - inicio
+        await runner.cleanup()
+        service.armazenamento.fechar()
+
+    linhas_veiculos = len(banco.tabelas.get("veiculos", [])) - veiculos_antes
+    inalterados = sum(len(linha["ano_ids"]) for linha in banco.tabelas.get("veiculos_inalterados", []))
+    precos = linhas_veiculos + inalterados
+    meses_medidos = 1
+    if args.modo == "historico":
+        # Com --delta, o mês anterior foi coletado antes da medição e é pulado nela
+        meses_medidos = args.meses - (1 if args.delta and args.meses >= 2 else 0)
+    esperado = args.marcas * args.modelos * args.anos * len(service.CONFIG_TIPOS['tipos']) * meses_medidos
+    chamadas = sum(mock.chamadas.values())
+    snapshot = len(ler_snapshot(service.CONFIG_SNAPSHOT['diretorio'])) if args.snapshot else None
+    linhas = sum(len(linhas) for linhas in banco.tabelas.values())
+    return {
+        "precos": precos,
+        "linhas_veiculos": linhas_veiculos,
+        "inalterados": inalterados,
+        "perdidos": esperado - precos,
+        "snapshot": snapshot,
+        "duracao_segundos": duracao,
+        "itens_por_segundo": precos / duracao if duracao else 0.0,
+        "chamadas_api": chamadas,
+        "chamadas_api_por_preco": chamadas / precos if precos else None,
+        "respostas_429": mock.respostas_429,
+        "respostas_erro": mock.respostas_erro,
+        "respostas_lentas": mock.respostas_lentas,
+        "idas_banco": banco.idas,
+        "linhas_banco": linhas,
+        "idas_banco_por_linha": banco.idas / linhas if linhas else None,
+        "idas_por_operacao": banco.idas_por_operacao,
+        # ru_maxrss vem em KiB no Linux e em bytes no macOS
+        "pico_memoria_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                            / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    }
+
+
+def rodar_repeticao(argv):
+    """Roda uma repetição em um processo novo e devolve o resultado em JSON"""
+    with tempfile.TemporaryDirectory(prefix="autofipe-bench-") as dados:
+        processo = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *argv, "--interno", "--dados", dados],
+            capture_output=True, text=True,
+            env={**os.environ, "SUPABASE_URL": os.getenv("SUPABASE_URL", "http://127.0.0.1:1"),
+                 "SUPABASE_KEY": os.getenv("SUPABASE_KEY", "benchmark")},
+        )
+    if processo.returncode != 0:
+        raise RuntimeError(f"Repetição falhou:\n{processo.stderr}")
+    return json.loads(processo.stdout.strip().splitlines()[-1])
+
+
+def mediana(resultados, chave):
+    valores = [r[chave] for r in resultados if r[chave] is not None]
+    return statistics.median(valores) if valores else None
+
+
+def imprimir(resultados, resumo, base=None):
+    print(f"\n{'':<12}" + "".join(f"{rotulo:>14}" for _, rotulo, _ in COLUNAS))
+    for i, r in enumerate(resultados, 1):
+        print(f"{'#' + str(i):<12}" + "".join(f"{r[chave] or 0:>14.3f}" for chave, _, _ in COLUNAS))
+    print(f"{'mediana':<12}" + "".join(f"{resumo[chave] or 0:>14.3f}" for chave, _, _ in COLUNAS))
+    if base:
+        variacoes = []
+        for chave, _, maior_melhor in COLUNAS:
+            if not base.get(chave) or resumo[chave] is None:
+                variacoes.append(f"{'--':>14}")
+                continue
+            delta = (resumo[chave] - base[chave]) / base[chave] * 100
+            pior = delta < 0 if maior_melhor else delta > 0
+            variacoes.append(f"{delta:>+12.1f}%{'!' if pior and abs(delta) >= 5 else ' '}")
+        print(f"{'vs. base':<12}" + "".join(variacoes))
+        print("(! = piora de 5% ou mais)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modo", choices=["pipeline", "historico", "etapas"], default="pipeline")
+    parser.add_argument("--marcas", type=int, default=5)
+    parser.add_argument("--modelos", type=int, default=10)
+    parser.add_argument("--anos", type=int, default=5)
+    parser.add_argument("--meses", type=int, default=1, help="tabelas de referência do mock (e coletadas no modo historico)")
+    parser.add_argument("--tipos", default="1", help="tipos de veículo coletados (o mock repete o catálogo em cada um)")
+    parser.add_argument("--latencia-ms", type=float, default=10.0, help="latência do mock da FIPE")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="fração de respostas 429 do mock")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas 503 do mock")
+    parser.add_argument("--taxa-lenta", type=float, default=0.0, help="fração de respostas lentas do mock")
+    parser.add_argument("--latencia-lenta-ms", type=float, default=2000.0, help="atraso das respostas lentas")
+    parser.add_argument("--espera-reprocessamento", type=float, default=1.0,
+                        help="espera antes de cada rodada de reprocessamento das falhas (s)")
+    parser.add_argument("--latencia-banco-ms", type=float, default=0.0, help="latência de cada ida ao banco")
+    parser.add_argument("--taxa", type=float, default=200.0, help="taxa inicial do limitador (req/s)")
+    parser.add_argument("--delta", action="store_true", help="mede o mês atual no modo delta")
+    parser.add_argument("--fracao-alterada", type=float, default=1.0,
+                        help="fração dos preços do mock que muda de um mês para o outro")
+    parser.add_argument("--snapshot", choices=["parquet", "arrow"], help="grava também o dataset local dos preços")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--saida", help="salva os resultados em JSON")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior (--saida) para comparar")
+    parser.add_argument("--interno", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--dados", help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.interno:
+        print(json.dumps(asyncio.run(executar_uma_vez(args))))
+        return
+
+    argv = [a for a in sys.argv[1:] if a not in ("--saida", args.saida, "--comparar", args.comparar)]
+    resultados = []
+    for i in range(args.repeticoes):
+        print(f"Repetição {i + 1}/{args.repeticoes}...", flush=True)
+        resultados.append(rodar_repeticao(argv))
+    resumo = {chave: mediana(resultados, chave) for chave, _, _ in COLUNAS}
+
+    print(f"\nModo {args.modo}: {args.marcas} marcas x {args.modelos} modelos x {args.anos} anos x "
+          f"{args.meses} meses x tipos {args.tipos}, latência FIPE {args.latencia_ms} ms, 429 {args.taxa_429:.0%}, "
+          f"503 {args.taxa_erro:.0%}, lentas {args.taxa_lenta:.0%}, "
+          f"latência banco {args.latencia_banco_ms} ms")
+    ultimo = resultados[-1]
+    print(f"Preços coletados: {ultimo['precos']} ({ultimo['linhas_veiculos']} linhas em veiculos, "
+          f"{ultimo['inalterados']} inalterados), chamadas à API: {ultimo['chamadas_api']} "
+          f"({ultimo['respostas_429']} respostas 429, {ultimo['respostas_erro']} 503, "
+          f"{ultimo['respostas_lentas']} lentas), idas ao banco: {ultimo['idas_banco']}")
+    print(f"Preços perdidos: {ultimo['perdidos']}")
+    if ultimo['snapshot'] is not None:
+        print(f"Preços no snapshot {args.snapshot}: {ultimo['snapshot']}")
+    print(f"Idas ao banco por operação: {ultimo['idas_por_operacao']}")
+
+    base = None
+    if args.comparar:
+        with open(args.comparar) as f:
+            base = json.load(f)["mediana"]
+    imprimir(resultados, resumo, base)
+
+    if args.saida:
+        with open(args.saida, "w") as f:
+            json.dump({"parametros": vars(args), "repeticoes": resultados, "mediana": resumo}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
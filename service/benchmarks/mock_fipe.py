@@ -0,0 +1,174 @@
+"""Servidor local que imita a API da FIPE para benchmarks.
+
+Gera um catálogo sintético e determinístico (marcas -> modelos -> anos) e
+responde aos mesmos endpoints usados por ``service.py``, com latência e taxa
+de 429 configuráveis. ``taxa_erro`` é a fração de respostas 503 e
+``taxa_lenta`` a das respostas que demoram ``latencia_lenta_ms`` (cauda de
+latência). ``fracao_alterada`` é a fração dos preços que muda de
+uma tabela de referência para a seguinte (1.0 = todos).
+
+Uso avulso:
+    python benchmarks/mock_fipe.py --porta 8089 --latencia-ms 20
+"""
+import argparse
+import asyncio
+import random
+import zlib
+
+from aiohttp import web
+
+
+class MockFipe:
+    def __init__(self, marcas=5, modelos_por_marca=10, anos_por_modelo=5, meses=3,
+                 latencia_ms=0.0, jitter_ms=0.0, taxa_429=0.0, seed=42, fracao_alterada=1.0,
+                 taxa_erro=0.0, taxa_lenta=0.0, latencia_lenta_ms=2000.0):
+        self.marcas = marcas
+        self.modelos_por_marca = modelos_por_marca
+        self.anos_por_modelo = anos_por_modelo
+        self.meses = meses
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.taxa_429 = taxa_429
+        self.taxa_erro = taxa_erro
+        self.taxa_lenta = taxa_lenta
+        self.latencia_lenta_ms = latencia_lenta_ms
+        # Cada preço muda a cada "periodo" tabelas, com uma fase própria
+        self.periodo = max(1, round(1 / fracao_alterada)) if fracao_alterada > 0 else None
+        self.random = random.Random(seed)
+        self.chamadas = {}
+        self.respostas_429 = 0
+        self.respostas_erro = 0
+        self.respostas_lentas = 0
+
+    # --- Catálogo sintético -------------------------------------------------
+
+    def tabelas(self):
+        # Códigos decrescentes: o primeiro é a tabela mais recente, como na FIPE
+        return [{"Codigo": 300 - i, "Mes": f"mes{i:02d}/2024 "} for i in range(self.meses)]
+
+    def lista_marcas(self):
+        return [{"Label": f"Marca {m}", "Value": str(m)} for m in range(1, self.marcas + 1)]
+
+    def codigo_modelo(self, marca, indice):
+        return int(marca) * 10000 + indice
+
+    def lista_modelos(self, marca):
+        return [
+            {"Label": f"Modelo {marca}-{i}", "Value": self.codigo_modelo(marca, i)}
+            for i in range(1, self.modelos_por_marca + 1)
+        ]
+
+    def lista_anos(self, modelo):
+        return [
+            {"Label": f"{2024 - i} Gasolina", "Value": f"{2024 - i}-1"}
+            for i in range(self.anos_por_modelo)
+        ]
+
+    def valor(self, tabela, marca, modelo, ano, combustivel, tipo=1):
+        base = (int(modelo) % 997) * 100 + (int(ano) - 1990) * 1000
+        variacao = 0
+        if self.periodo:
+            fase = zlib.crc32(f"{modelo}:{ano}".encode()) % self.periodo
+            variacao = (int(tabela) + fase) // self.periodo
+        centavos = base * 100 + variacao * 7
+        reais, cents = divmod(centavos, 100)
+        valor = f"R$ {reais:,}".replace(",", ".") + f",{cents:02d}"
+        return {
+            "Valor": valor,
+            "Marca": f"Marca {marca}",
+            "Modelo": f"Modelo {modelo}",
+            "AnoModelo": int(ano),
+            "Combustivel": "Gasolina",
+            "CodigoFipe": f"{int(modelo):06d}-{int(ano) % 10}",
+            "MesReferencia": f"tabela {tabela}",
+            "TipoVeiculo": int(tipo),
+            "SiglaCombustivel": "G",
+        }
+
+    # --- HTTP ---------------------------------------------------------------
+
+    async def _simular_rede(self, endpoint):
+        self.chamadas[endpoint] = self.chamadas.get(endpoint, 0) + 1
+        atraso = self.latencia_ms
+        if self.jitter_ms:
+            atraso += self.random.uniform(0, self.jitter_ms)
+        if self.taxa_lenta and self.random.random() < self.taxa_lenta:
+            self.respostas_lentas += 1
+            atraso += self.latencia_lenta_ms
+        if atraso > 0:
+            await asyncio.sleep(atraso / 1000)
+        if self.taxa_429 and self.random.random() < self.taxa_429:
+            self.respostas_429 += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if self.taxa_erro and self.random.random() < self.taxa_erro:
+            self.respostas_erro += 1
+            return web.Response(status=503)
+        return None
+
+    async def handler(self, request):
+        endpoint = request.match_info["endpoint"]
+        form = await request.post()
+        bloqueio = await self._simular_rede(endpoint)
+        if bloqueio is not None:
+            return bloqueio
+
+        if endpoint == "ConsultarTabelaDeReferencia":
+            return web.json_response(self.tabelas())
+        if endpoint == "ConsultarMarcas":
+            return web.json_response(self.lista_marcas())
+        if endpoint == "ConsultarModelos":
+            return web.json_response({"Modelos": self.lista_modelos(form["codigoMarca"]), "Anos": []})
+        if endpoint == "ConsultarAnoModelo":
+            return web.json_response(self.lista_anos(form["codigoModelo"]))
+        if endpoint == "ConsultarValorComTodosParametros":
+            return web.json_response(self.valor(
+                form["codigoTabelaReferencia"],
+                form["codigoMarca"],
+                form["codigoModelo"],
+                form["anoModelo"],
+                form["codigoTipoCombustivel"],
+                form.get("codigoTipoVeiculo", 1),
+            ))
+        return web.json_response({"codigo": "0", "erro": "endpoint desconhecido"}, status=404)
+
+    def criar_app(self):
+        app = web.Application()
+        app.router.add_post("/api/veiculos/{endpoint}", self.handler)
+        return app
+
+
+async def iniciar_mock(mock, host="127.0.0.1", porta=0):
+    """Sobe o servidor e retorna (runner, base_url). Feche com ``await runner.cleanup()``."""
+    runner = web.AppRunner(mock.criar_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, porta)
+    await site.start()
+    porta_real = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{porta_real}/api/veiculos"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor mock da API da FIPE")
+    parser.add_argument("--porta", type=int, default=8089)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    parser.add_argument("--taxa-lenta", type=float, default=0.0)
+    parser.add_argument("--latencia-lenta-ms", type=float, default=2000.0)
+    parser.add_argument("--marcas", type=int, default=5)
+    parser.add_argument("--modelos", type=int, default=10)
+    parser.add_argument("--anos", type=int, default=5)
+    parser.add_argument("--meses", type=int, default=3)
+    args = parser.parse_args()
+
+    mock = MockFipe(args.marcas, args.modelos, args.anos, args.meses,
+                    args.latencia_ms, args.jitter_ms, args.taxa_429,
+                    taxa_erro=args.taxa_erro, taxa_lenta=args.taxa_lenta,
+                    latencia_lenta_ms=args.latencia_lenta_ms)
+    print(f"Mock FIPE em http://127.0.0.1:{args.porta}/api/veiculos")
+    web.run_app(mock.criar_app(), host="127.0.0.1", port=args.porta, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
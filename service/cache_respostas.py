@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+class CacheRespostas:
+    """Cache persistente (SQLite) das respostas de catálogo da API da FIPE.
+
+    A chave é o endpoint mais o payload normalizado; o escopo é o
+    ``codigoTabelaReferencia``, de modo que uma tabela nova nunca reaproveita
+    dados de outra e um escopo inteiro pode ser invalidado de uma vez.
+
+    Entradas expiram após ``ttls[endpoint]`` segundos (ou ``ttl_padrao``) e,
+    acima de ``max_entradas``, as menos acessadas recentemente são removidas.
+    ``obter_ou_buscar`` também faz single-flight: requisições idênticas
+    simultâneas esperam a mesma chamada de rede.
+    """
+
+    def __init__(self, caminho, endpoints, ttl_padrao=30 * 24 * 3600, ttls=None,
+                 max_entradas=200_000, ignorar=False):
+        self.caminho = caminho
+        self.endpoints = set(endpoints)
+        self.ttl_padrao = ttl_padrao
+        self.ttls = ttls or {}
+        self.max_entradas = max_entradas
+        self.ignorar = ignorar
+        self.acertos = 0
+        self.faltas = 0
+        self.coalescidas = 0
+        self._conexao = None
+        self._em_voo = {}
+        self._gravacoes = 0
+
+    def _abrir(self):
+        if self._conexao is None:
+            os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+            self._conexao = sqlite3.connect(self.caminho)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao.executescript("""
+                CREATE TABLE IF NOT EXISTS respostas (
+                    chave TEXT PRIMARY KEY,
+                    escopo TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    corpo TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    acessado_em REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS respostas_escopo ON respostas (escopo);
+                CREATE INDEX IF NOT EXISTS respostas_acessado_em ON respostas (acessado_em);
+            """)
+        return self._conexao
+
+    def fechar(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+
+    def cacheavel(self, endpoint):
+        return not self.ignorar and endpoint in self.endpoints
+
+    @staticmethod
+    def escopo(payload):
+        return str(payload.get("codigoTabelaReferencia", ""))
+
+    @staticmethod
+    def chave(endpoint, payload):
+        normalizado = json.dumps({k: str(v) for k, v in payload.items()}, sort_keys=True)
+        return hashlib.sha1(f"{endpoint}|{normalizado}".encode()).hexdigest()
+
+    def obter(self, endpoint, payload):
+        conexao = self._abrir()
+        chave = self.chave(endpoint, payload)
+        linha = conexao.execute("SELECT corpo, criado_em FROM respostas WHERE chave = ?", (chave,)).fetchone()
+        if linha is None:
+            return None
+        corpo, criado_em = linha
+        agora = time.time()
+        if agora - criado_em > self.ttls.get(endpoint, self.ttl_padrao):
+            conexao.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+            conexao.commit()
+            return None
+        conexao.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?", (agora, chave))
+        conexao.commit()
+        return json.loads(corpo)
+
+    def guardar(self, endpoint, payload, valor):
+        conexao = self._abrir()
+        agora = time.time()
+        conexao.execute(
+            "INSERT OR REPLACE INTO respostas (chave, escopo, endpoint, corpo, criado_em, acessado_em) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self.chave(endpoint, payload), self.escopo(payload), endpoint, json.dumps(valor), agora, agora),
+        )
+        conexao.commit()
+        self._gravacoes += 1
+        if self._gravacoes % 1000 == 0:
+            self.remover_excedentes()
+
+    def remover_excedentes(self):
+        conexao = self._abrir()
+        (total,) = conexao.execute("SELECT COUNT(*) FROM respostas").fetchone()
+        excesso = total - self.max_entradas
+        if excesso > 0:
+            conexao.execute(
+                "DELETE FROM respostas WHERE chave IN "
+                "(SELECT chave FROM respostas ORDER BY acessado_em LIMIT ?)",
+                (excesso,),
+            )
+            conexao.commit()
+        return max(excesso, 0)
+
+    def invalidar_escopo(self, escopo):
+        conexao = self._abrir()
+        conexao.execute("DELETE FROM respostas WHERE escopo = ?", (str(escopo),))
+        conexao.commit()
+
+    async def obter_ou_buscar(self, endpoint, payload, buscar):
+        """Devolve a resposta em cache ou chama ``buscar()`` uma única vez por chave.
+
+        Quem chega enquanto a busca está em andamento espera por ela. Se a
+        tarefa que buscava for cancelada, as que esperavam não são: tentam de
+        novo e uma delas passa a buscar.
+        """
+        chave = self.chave(endpoint, payload)
+        while True:
+            valor = self.obter(endpoint, payload)
+            if valor is not None:
+                self.acertos += 1
+                return valor
+
+            em_voo = self._em_voo.get(chave)
+            if em_voo is None:
+                break
+            self.coalescidas += 1
+            try:
+                return await asyncio.shield(em_voo)
+            except asyncio.CancelledError:
+                if not em_voo.cancelled():
+                    raise  # esta tarefa é que foi cancelada
+
+        self.faltas += 1
+        futuro = asyncio.get_running_loop().create_future()
+        self._em_voo[chave] = futuro
+        try:
+            valor = await buscar()
+            if valor is not None:
+                self.guardar(endpoint, payload, valor)
+            futuro.set_result(valor)
+            return valor
+        except Exception as e:
+            futuro.set_exception(e)
+            # Evita o aviso de exceção nunca recuperada quando ninguém mais esperava
+            futuro.exception()
+            raise
+        except BaseException:
+            # Cancelamento desta tarefa: não é repassado a quem esperava, que tenta de novo
+            futuro.cancel()
+            raise
+        finally:
+            del self._em_voo[chave]
+
+    def get_stats(self):
+        return {
+            "acertos": self.acertos,
+            "faltas": self.faltas,
+            "coalescidas": self.coalescidas,
+        }
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+# codigo de ano da FIPE para veículos zero km
+ANO_ZERO_KM = 32000
+
+
+class Catalogo:
+    """Marcas, modelos e anos carregados do banco, com índices em memória.
+
+    ``modelos_por_marca`` e ``anos_por_modelo`` permitem gerar as combinações
+    da etapa 5 com um join local, sem uma consulta por marca ou por modelo.
+    As chaves dos índices são sempre strings ``"tipo:codigo"``, já que o banco
+    pode devolver os códigos como texto ou número e o mesmo código pode existir
+    em mais de um tipo de veículo.
+    """
+
+    def __init__(self, marcas, modelos, anos):
+        self.marcas = [
+            {"Value": m['codigo'], "Label": m['nome'], "tipo_veiculo": m.get('tipo_veiculo', 1)} for m in marcas
+        ]
+        self.modelos_por_marca = {}
+        for modelo in modelos:
+            tipo = modelo.get('tipo_veiculo', 1)
+            self.modelos_por_marca.setdefault(_chave(tipo, modelo['marca_id']), []).append(
+                {"Value": modelo['codigo'], "Label": modelo['nome'], "tipo_veiculo": tipo}
+            )
+        self.anos_por_modelo = {}
+        for ano in anos:
+            self.anos_por_modelo.setdefault(_chave(ano.get('tipo_veiculo', 1), ano['modelo_id']), []).append(
+                {"id": ano['id'], "codigo": ano['codigo'], "Label": ano['descricao']}
+            )
+
+    def modelos_de(self, marca_codigo, tipo_veiculo=1):
+        return self.modelos_por_marca.get(_chave(tipo_veiculo, marca_codigo), [])
+
+    def anos_de(self, modelo_codigo, tipo_veiculo=1):
+        return self.anos_por_modelo.get(_chave(tipo_veiculo, modelo_codigo), [])
+
+    @property
+    def total_modelos(self):
+        return sum(len(modelos) for modelos in self.modelos_por_marca.values())
+
+    @property
+    def total_anos(self):
+        return sum(len(anos) for anos in self.anos_por_modelo.values())
+
+
+def _chave(tipo_veiculo, codigo):
+    return f"{tipo_veiculo}:{codigo}"
+
+
+def ano_modelo(codigo):
+    """Ano modelo de um codigo de ano da FIPE ("2020-1" -> 2020, zero km -> ANO_ZERO_KM), ou None"""
+    try:
+        return int(str(codigo).split("-")[0])
+    except ValueError:
+        return None
+
+
+async def ler_paginas(armazenamento, tabela, colunas, ordem, tamanho_pagina=1000, filtro=None):
+    """Gera as páginas de ``tamanho_pagina`` linhas de uma tabela, uma consulta por página.
+
+    ``filtro(consulta)`` (opcional) acrescenta condições à consulta, ex.:
+    ``lambda c: c.gte('mes_referencia_id', 290)``.
+    """
+    inicio = 0
+    while True:
+        fim = inicio + tamanho_pagina - 1
+
+        def consultar(db):
+            consulta = db.table(tabela).select(*colunas)
+            if filtro is not None:
+                consulta = filtro(consulta)
+            return consulta.order(ordem).range(inicio, fim).execute()
+
+        response = await armazenamento.executar(consultar, tabela=tabela, operacao="select_pagina")
+        pagina = response.data or []
+        yield pagina
+        if len(pagina) < tamanho_pagina:
+            return
+        inicio += tamanho_pagina
+
+
+async def carregar_tabela(armazenamento, tabela, colunas, ordem, tamanho_pagina=1000):
+    """Lê uma tabela inteira em páginas de ``tamanho_pagina`` linhas.
+
+    Retorna (linhas, número de consultas feitas).
+    """
+    linhas = []
+    consultas = 0
+    async for pagina in ler_paginas(armazenamento, tabela, colunas, ordem, tamanho_pagina):
+        consultas += 1
+        linhas.extend(pagina)
+    return linhas, consultas
+
+
+async def carregar_catalogo(armazenamento, tamanho_pagina=1000):
+    """Carrega marcas, modelos e anos em poucas consultas paginadas (em paralelo).
+
+    Imprime o tempo gasto e compara com o número de consultas que o antigo
+    carregamento (uma por marca e uma por modelo) precisaria.
+    """
+    inicio = time.perf_counter()
+    (marcas, c_marcas), (modelos, c_modelos), (anos, c_anos) = await asyncio.gather(
+        carregar_tabela(armazenamento, 'marcas', ('codigo', 'nome', 'tipo_veiculo'), 'codigo', tamanho_pagina),
+        carregar_tabela(armazenamento, 'modelos', ('codigo', 'nome', 'marca_id', 'tipo_veiculo'), 'codigo',
+                        tamanho_pagina),
+        carregar_tabela(armazenamento, 'anos_modelo', ('id', 'codigo', 'descricao', 'modelo_id', 'tipo_veiculo'),
+                        'id', tamanho_pagina),
+    )
+    catalogo = Catalogo(marcas, modelos, anos)
+    duracao = time.perf_counter() - inicio
+
+    consultas = c_marcas + c_modelos + c_anos
+    consultas_legado = 1 + len(catalogo.marcas) + catalogo.total_modelos
+    # Estimativa do carregamento antigo: as mesmas consultas, só que sequenciais
+    tempo_por_consulta = duracao / consultas if consultas else 0
+    print(f"\n⏱️ Catálogo carregado em {duracao:.2f}s com {consultas} consultas "
+          f"({len(catalogo.marcas)} marcas, {catalogo.total_modelos} modelos, {catalogo.total_anos} anos)")
+    print(f"   Antes: {consultas_legado} consultas sequenciais "
+          f"(~{consultas_legado * tempo_por_consulta:.1f}s estimados)")
+    return catalogo
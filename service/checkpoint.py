@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import time
+
+
+class JournalCheckpoint:
+    """Diário local (SQLite em modo WAL) do trabalho concluído em cada etapa.
+
+    Cada unidade de trabalho é identificada por ``(etapa, chave)``. As chaves
+    concluídas ficam também em um ``set`` em memória, então ``concluido()`` é
+    O(1) e uma execução reiniciada pula o que já terminou sem consultar o
+    Supabase. ``em_andamento`` registra o que estava em voo e ``falhas`` o que
+    falhou; ambos são refeitos na próxima execução.
+
+    As escritas são agrupadas em transações (a cada ``lote_commit`` marcações
+    ou ``intervalo_commit`` segundos). O WAL garante que um ``kill -9`` perca no
+    máximo a última transação, nunca corrompa o arquivo.
+    """
+
+    def __init__(self, caminho, lote_commit=200, intervalo_commit=2.0):
+        self.caminho = caminho
+        self.lote_commit = lote_commit
+        self.intervalo_commit = intervalo_commit
+        self._conexao = None
+        self._concluidos = {}
+        self._pendentes_commit = 0
+        self._ultimo_commit = time.monotonic()
+
+    def abrir(self):
+        if self._conexao is not None:
+            return self
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        self._conexao = sqlite3.connect(self.caminho, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA synchronous=NORMAL")
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS concluidos (
+                etapa INTEGER NOT NULL,
+                chave TEXT NOT NULL,
+                concluido_em REAL NOT NULL,
+                PRIMARY KEY (etapa, chave)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS em_andamento (
+                etapa INTEGER NOT NULL,
+                chave TEXT NOT NULL,
+                iniciado_em REAL NOT NULL,
+                PRIMARY KEY (etapa, chave)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS falhas (
+                etapa INTEGER NOT NULL,
+                chave TEXT NOT NULL,
+                tentativas INTEGER NOT NULL DEFAULT 1,
+                erro TEXT,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (etapa, chave)
+            ) WITHOUT ROWID;
+        """)
+        self._conexao.execute("BEGIN")
+        return self
+
+    def fechar(self):
+        if self._conexao is None:
+            return
+        self._conexao.execute("COMMIT")
+        self._conexao.close()
+        self._conexao = None
+
+    def __enter__(self):
+        return self.abrir()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fechar()
+
+    def _talvez_commit(self):
+        self._pendentes_commit += 1
+        agora = time.monotonic()
+        if (self._pendentes_commit >= self.lote_commit
+                or agora - self._ultimo_commit >= self.intervalo_commit):
+            self.commit()
+
+    def commit(self):
+        self._conexao.execute("COMMIT")
+        self._conexao.execute("BEGIN")
+        self._pendentes_commit = 0
+        self._ultimo_commit = time.monotonic()
+
+    def _carregar(self, etapa):
+        if etapa not in self._concluidos:
+            cursor = self._conexao.execute("SELECT chave FROM concluidos WHERE etapa = ?", (etapa,))
+            self._concluidos[etapa] = {chave for (chave,) in cursor}
+        return self._concluidos[etapa]
+
+    def concluido(self, etapa, chave):
+        return chave in self._carregar(etapa)
+
+    def total_concluidos(self, etapa):
+        return len(self._carregar(etapa))
+
+    def iniciar(self, etapa, chave):
+        self._conexao.execute(
+            "INSERT OR REPLACE INTO em_andamento (etapa, chave, iniciado_em) VALUES (?, ?, ?)",
+            (etapa, chave, time.time()),
+        )
+        self._talvez_commit()
+
+    def marcar_concluido(self, etapa, chave):
+        self._carregar(etapa).add(chave)
+        self._conexao.execute(
+            "INSERT OR IGNORE INTO concluidos (etapa, chave, concluido_em) VALUES (?, ?, ?)",
+            (etapa, chave, time.time()),
+        )
+        self._conexao.execute("DELETE FROM em_andamento WHERE etapa = ? AND chave = ?", (etapa, chave))
+        self._conexao.execute("DELETE FROM falhas WHERE etapa = ? AND chave = ?", (etapa, chave))
+        self._talvez_commit()
+
+    def marcar_falha(self, etapa, chave, erro=None):
+        self._conexao.execute(
+            """INSERT INTO falhas (etapa, chave, erro, atualizado_em) VALUES (?, ?, ?, ?)
+               ON CONFLICT (etapa, chave) DO UPDATE SET
+                   tentativas = tentativas + 1, erro = excluded.erro, atualizado_em = excluded.atualizado_em""",
+            (etapa, chave, erro, time.time()),
+        )
+        self._conexao.execute("DELETE FROM em_andamento WHERE etapa = ? AND chave = ?", (etapa, chave))
+        self._talvez_commit()
+
+    def em_andamento(self, etapa):
+        """Itens que estavam em voo quando a última execução parou"""
+        cursor = self._conexao.execute("SELECT chave FROM em_andamento WHERE etapa = ?", (etapa,))
+        return [chave for (chave,) in cursor]
+
+    def falhas(self, etapa):
+        cursor = self._conexao.execute(
+            "SELECT chave, tentativas, erro FROM falhas WHERE etapa = ? ORDER BY atualizado_em", (etapa,)
+        )
+        return cursor.fetchall()
+
+    def limpar(self, etapa):
+        for tabela in ("concluidos", "em_andamento", "falhas"):
+            self._conexao.execute(f"DELETE FROM {tabela} WHERE etapa = ?", (etapa,))
+        self._concluidos.pop(etapa, None)
+        self.commit()
@@ -0,0 +1,59 @@
+import aiohttp
+
+
+class ClienteFipe:
+    """Cliente HTTP de longa duração para a API da FIPE.
+
+    Mantém uma única ``aiohttp.ClientSession`` com pool de conexões keep-alive,
+    cache de DNS e timeouts, evitando um novo handshake TCP/TLS a cada consulta.
+    Deve ser aberto uma vez (``async with ClienteFipe(...) as cliente``) e
+    reutilizado por todas as chamadas da execução.
+    """
+
+    def __init__(self, base_url, headers=None, limite_conexoes=20, limite_por_host=10,
+                 ttl_dns=300, keepalive=30, timeout_total=30, timeout_conexao=10):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.limite_conexoes = limite_conexoes
+        self.limite_por_host = limite_por_host
+        self.ttl_dns = ttl_dns
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout_total, connect=timeout_conexao)
+        self.session = None
+
+    @property
+    def aberto(self):
+        return self.session is not None and not self.session.closed
+
+    async def abrir(self):
+        if self.aberto:
+            return self
+        connector = aiohttp.TCPConnector(
+            limit=self.limite_conexoes,
+            limit_per_host=self.limite_por_host,
+            ttl_dns_cache=self.ttl_dns,
+            keepalive_timeout=self.keepalive,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=self.timeout,
+        )
+        return self
+
+    async def fechar(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.abrir()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.fechar()
+
+    def post(self, endpoint, payload, **kwargs):
+        """Retorna o context manager de ``session.post`` para o endpoint informado."""
+        if not self.aberto:
+            raise RuntimeError("ClienteFipe não está aberto. Use 'async with ClienteFipe(...)'.")
+        return self.session.post(f"{self.base_url}/{endpoint}", data=payload, **kwargs)
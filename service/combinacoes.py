@@ -0,0 +1,79 @@
+class ItemPreco:
+    """Uma consulta de preço da etapa 5.
+
+    Guarda apenas referências para as entradas do catálogo (compartilhadas por
+    todos os itens), sem copiar dicionários, e usa ``__slots__`` para não ter
+    ``__dict__`` por instância.
+    """
+
+    __slots__ = ('mes', 'marca', 'modelo', 'ano')
+
+    def __init__(self, mes, marca, modelo, ano):
+        self.mes = mes
+        self.marca = marca
+        self.modelo = modelo
+        self.ano = ano
+
+    @property
+    def tipo_veiculo(self):
+        return self.marca.get('tipo_veiculo', 1)
+
+    def __repr__(self):
+        return (f"ItemPreco(mes={self.mes['Value']}, marca={self.marca['Value']}, "
+                f"modelo={self.modelo['Value']}, ano={self.ano['codigo']})")
+
+
+def _sem_limite(lista, tipo):
+    return lista
+
+
+def _ordenar(lista, pontuar):
+    # sorted com reverse=True é estável: empates mantêm a ordem da API
+    return sorted(lista, key=pontuar, reverse=True) if pontuar is not None else lista
+
+
+def _marcas(catalogo, limitar, prioridade):
+    return limitar(_ordenar(catalogo.marcas, prioridade and prioridade.marca), 'marcas')
+
+
+def _modelos(catalogo, marca, limitar, prioridade):
+    modelos = catalogo.modelos_de(marca["Value"], marca.get("tipo_veiculo", 1))
+    return limitar(_ordenar(modelos, prioridade and prioridade.modelo), 'modelos')
+
+
+def _anos(catalogo, modelo, limitar, prioridade):
+    anos = catalogo.anos_de(modelo["Value"], modelo.get("tipo_veiculo", 1))
+    pontuar = (lambda ano: prioridade.ano(modelo, ano)) if prioridade is not None else None
+    return limitar(_ordenar(anos, pontuar), 'anos')
+
+
+def gerar_combinacoes(catalogo, meses, limitar=_sem_limite, pular=None, prioridade=None):
+    """Gera os itens (mês, marca, modelo, ano) sob demanda, na ordem marca/modelo/mês/ano.
+
+    ``limitar(lista, tipo)`` é aplicado a marcas, modelos e anos (ex.: aplicar_limite
+    no modo amostragem). ``pular(mes, modelo, ano)`` descarta itens já concluídos.
+    Com ``prioridade`` (ver prioridade.py), marcas, modelos e anos saem da maior
+    pontuação para a menor, antes do limite, em vez da ordem da API.
+    Nada é materializado: cada item é criado quando o pool o pede.
+    """
+    for marca in _marcas(catalogo, limitar, prioridade):
+        for modelo in _modelos(catalogo, marca, limitar, prioridade):
+            anos = _anos(catalogo, modelo, limitar, prioridade)
+            for mes in meses:
+                for ano in anos:
+                    if pular is None or not pular(mes, modelo, ano):
+                        yield ItemPreco(mes, marca, modelo, ano)
+
+
+def contar_combinacoes(catalogo, meses, limitar=_sem_limite, pular=None, prioridade=None):
+    """Total de itens que ``gerar_combinacoes`` vai produzir, sem criá-los"""
+    total = 0
+    for marca in _marcas(catalogo, limitar, prioridade):
+        for modelo in _modelos(catalogo, marca, limitar, prioridade):
+            anos = _anos(catalogo, modelo, limitar, prioridade)
+            if pular is None:
+                total += len(anos) * len(meses)
+                continue
+            for mes in meses:
+                total += sum(1 for ano in anos if not pular(mes, modelo, ano))
+    return total
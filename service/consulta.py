@@ -0,0 +1,525 @@
+"""API de leitura dos preços coletados, para o frontend.
+
+Carrega o catálogo e o preço vigente de cada veículo em índices em memória e
+responde a consultas filtradas e paginadas sem varrer a tabela veiculos:
+
+    python consulta.py --porta 8090
+    curl 'http://127.0.0.1:8090/veiculos?marca=59&busca=gol&preco_max=50000&pagina=2'
+
+Os índices são recriados (e o cache de respostas descartado) quando um mês de
+referência novo aparece no banco ou quando o mês atual ganha linhas (o scraper
+ainda o está gravando). As estatísticas de /estatisticas/* vêm do
+arquivo de agregados que o scraper mantém (veja agregados.py), relido quando muda.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from heapq import merge
+
+from aiohttp import web
+
+from agregados import ARQUIVO_AGREGADOS, AgregadosPrecos
+from catalogo import ano_modelo, carregar_tabela, ler_paginas
+
+logger = logging.getLogger("autofipe.consulta")
+
+# porta: porta HTTP da API; meses_precos: janela (em meses) em que se procura o
+# último preço de cada veículo (no modo delta um preço inalterado não ganha linha
+# nova); intervalo_verificacao: segundos entre as consultas ao banco atrás de um
+# mês novo; tamanho_cache: respostas guardadas no LRU
+CONFIG_CONSULTA = {
+    'porta': int(os.getenv("AUTOFIPE_CONSULTA_PORTA", "8090")),
+    'meses_precos': 12,
+    'intervalo_verificacao': 60,
+    'tamanho_cache': 2048,
+    'por_pagina': 24,
+    'max_por_pagina': 100,
+    'arquivo_agregados': ARQUIVO_AGREGADOS,
+}
+
+_VAZIO = array('l')
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos, para a busca por nome"""
+    return unicodedata.normalize("NFKD", str(texto)).encode("ascii", "ignore").decode().lower()
+
+
+def termos(texto):
+    return re.findall(r"[a-z0-9]+", normalizar(texto))
+
+
+def chave_tipo(tipo, codigo):
+    """Chave de marca ou modelo nos índices: ``"tipo:codigo"``"""
+    return f"{tipo}:{codigo}"
+
+
+def _contem(lista, valor):
+    indice = bisect_left(lista, valor)
+    return indice < len(lista) and lista[indice] == valor
+
+
+class IndiceConsulta:
+    """Veículos com preço de um mês de referência, ordenados por preço, com índices invertidos.
+
+    A posição de cada veículo é a sua ordem de preço, então:
+
+    - uma faixa de preço é um intervalo contíguo de posições (bisseção em ``precos``);
+    - ``por_marca``, ``por_modelo``, ``por_ano``, ``por_combustivel`` e ``por_tipo``
+      mapeiam cada valor para as posições dos seus veículos, em ordem crescente
+      (marcas e modelos pela chave ``"tipo:codigo"``: o mesmo código existe em
+      mais de um tipo de veículo);
+    - ``termos`` guarda, em ordem alfabética, cada palavra dos nomes de marca e
+      modelo, do ano e do combustível com as posições em que aparece; uma busca
+      por prefixo é uma bisseção seguida das palavras vizinhas.
+
+    Uma consulta começa pela lista mais curta entre as dos filtros usados,
+    recortada à faixa de preço, e confere as demais por bisseção. O resultado já
+    sai ordenado por preço; o menor e o maior preço são o primeiro e o último.
+    """
+
+    def __init__(self, veiculos, mes_referencia=None):
+        self.mes_referencia = mes_referencia
+        self.itens = sorted(veiculos, key=lambda v: (v['centavos'], v['id']))
+        self.precos = array('q', (item.pop('centavos') for item in self.itens))
+        self.por_tipo = {}
+        self.por_marca = {}
+        self.por_modelo = {}
+        self.por_ano = {}
+        self.por_combustivel = {}
+        palavras = {}
+        for posicao, item in enumerate(self.itens):
+            self.por_tipo.setdefault(item['tipo_veiculo'], array('l')).append(posicao)
+            self.por_marca.setdefault(chave_tipo(item['tipo_veiculo'], item['marca_id']), array('l')).append(posicao)
+            self.por_modelo.setdefault(chave_tipo(item['tipo_veiculo'], item['modelo_id']), array('l')).append(posicao)
+            if item['ano'] is not None:
+                self.por_ano.setdefault(item['ano'], array('l')).append(posicao)
+            self.por_combustivel.setdefault(normalizar(item['combustivel']), array('l')).append(posicao)
+            for termo in set(termos(f"{item['marca']} {item['modelo']} {item['descricao_ano']} {item['combustivel']}")):
+                palavras.setdefault(termo, array('l')).append(posicao)
+        self.termos = sorted(palavras)
+        self.posicoes_termos = [palavras[termo] for termo in self.termos]
+
+    def __len__(self):
+        return len(self.itens)
+
+    def prefixo(self, prefixo):
+        """Posições (ordenadas) dos veículos com alguma palavra começando por ``prefixo``"""
+        inicio = bisect_left(self.termos, prefixo)
+        fim = bisect_left(self.termos, prefixo + "\uffff", inicio)
+        if fim - inicio == 1:
+            return self.posicoes_termos[inicio]
+        if fim == inicio:
+            return _VAZIO
+        posicoes = array('l')
+        anterior = -1
+        for posicao in merge(*self.posicoes_termos[inicio:fim]):
+            if posicao != anterior:
+                posicoes.append(posicao)
+                anterior = posicao
+        return posicoes
+
+    def _posicoes(self, tipo=None, marca=None, modelo=None, ano=None, combustivel=None, busca=None,
+                  preco_min=None, preco_max=None):
+        inicio = bisect_left(self.precos, preco_min) if preco_min is not None else 0
+        fim = bisect_right(self.precos, preco_max) if preco_max is not None else len(self.precos)
+        listas = []
+        for indice, valor in ((self.por_tipo, tipo), (self.por_marca, marca), (self.por_modelo, modelo),
+                              (self.por_ano, ano), (self.por_combustivel, combustivel)):
+            if valor is not None:
+                listas.append(indice.get(valor, _VAZIO))
+        for palavra in termos(busca or ""):
+            listas.append(self.prefixo(palavra))
+        if not listas:
+            return range(inicio, fim)
+        fatias = sorted((lista[bisect_left(lista, inicio):bisect_left(lista, fim)] for lista in listas), key=len)
+        menor, demais = fatias[0], fatias[1:]
+        if not demais:
+            return menor
+        return [posicao for posicao in menor if all(_contem(lista, posicao) for lista in demais)]
+
+    def consultar(self, pagina=1, por_pagina=24, decrescente=False, **filtros):
+        """Uma página dos veículos que passam nos filtros, mais o total e a faixa de preço deles.
+
+        Filtros: ``tipo``, ``marca`` e ``modelo`` (``"tipo:codigo"``), ``ano`` (ano modelo; 32000 é
+        zero km), ``combustivel``, ``busca`` (prefixos de palavras, todas
+        precisam casar) e ``preco_min``/``preco_max`` em centavos.
+        """
+        posicoes = self._posicoes(**filtros)
+        total = len(posicoes)
+        if decrescente:
+            posicoes = posicoes[::-1]
+        inicio = (pagina - 1) * por_pagina
+        return {
+            'mes_referencia_id': self.mes_referencia,
+            'total': total,
+            'pagina': pagina,
+            'por_pagina': por_pagina,
+            'preco_min': self.precos[min(posicoes[0], posicoes[-1])] / 100 if total else None,
+            'preco_max': self.precos[max(posicoes[0], posicoes[-1])] / 100 if total else None,
+            'itens': [self.itens[posicao] for posicao in posicoes[inicio:inicio + por_pagina]],
+        }
+
+    def anos(self, **filtros):
+        """Anos modelo presentes entre os veículos filtrados, do mais novo para o mais antigo"""
+        if all(valor is None for valor in filtros.values()):
+            return sorted(self.por_ano, reverse=True)
+        anos = {self.itens[posicao]['ano'] for posicao in self._posicoes(**filtros)}
+        return sorted(anos - {None}, reverse=True)
+
+
+class CacheLRU:
+    """Respostas prontas (já em JSON), das menos para as mais recentemente usadas"""
+
+    def __init__(self, maximo=2048):
+        self.maximo = maximo
+        self.itens = OrderedDict()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave, calcular):
+        if chave in self.itens:
+            self.itens.move_to_end(chave)
+            self.acertos += 1
+            return self.itens[chave]
+        self.faltas += 1
+        valor = calcular()
+        self.itens[chave] = valor
+        if len(self.itens) > self.maximo:
+            self.itens.popitem(last=False)
+        return valor
+
+    def limpar(self):
+        self.itens.clear()
+
+
+async def ultimo_mes(armazenamento):
+    """Maior mes_referencia_id com preços gravados (em veiculos ou, no modo delta, em veiculos_inalterados)"""
+    meses = []
+    for tabela in ('veiculos', 'veiculos_inalterados'):
+        response = await armazenamento.executar(
+            lambda db, tabela=tabela: db.table(tabela).select('mes_referencia_id')
+            .order('mes_referencia_id', desc=True).limit(1).execute(),
+            tabela=tabela, operacao="select_ultimo_mes",
+        )
+        meses += [linha['mes_referencia_id'] for linha in response.data or []]
+    return max(meses, default=None)
+
+
+async def linhas_do_mes(armazenamento, mes):
+    """Linhas de ``mes`` em veiculos e veiculos_inalterados; muda enquanto o scraper grava o mês"""
+    total = 0
+    for tabela in ('veiculos', 'veiculos_inalterados'):
+        response = await armazenamento.executar(
+            lambda db, tabela=tabela: db.table(tabela).select('mes_referencia_id', count='exact')
+            .eq('mes_referencia_id', mes).limit(1).execute(),
+            tabela=tabela, operacao="select_contagem",
+        )
+        total += response.count or 0
+    return total
+
+
+async def carregar_indice(armazenamento, mes=None, meses=12, tamanho_pagina=1000):
+    """Monta o ``IndiceConsulta`` com o preço vigente de cada veículo em ``mes`` (padrão: o mais recente).
+
+    O preço vigente é o da linha mais recente do veículo até ``mes``, dentro
+    de uma janela de ``meses`` meses: no modo delta os preços inalterados não
+    ganham linha nova em veiculos.
+    """
+    inicio = time.perf_counter()
+    mes = mes if mes is not None else await ultimo_mes(armazenamento)
+    if mes is None:
+        return IndiceConsulta([], None)
+    (marcas, _), (modelos, _), (anos, _) = await asyncio.gather(
+        carregar_tabela(armazenamento, 'marcas', ('codigo', 'nome', 'tipo_veiculo'), 'codigo', tamanho_pagina),
+        carregar_tabela(armazenamento, 'modelos', ('codigo', 'nome', 'marca_id', 'tipo_veiculo'), 'codigo',
+                        tamanho_pagina),
+        carregar_tabela(armazenamento, 'anos_modelo', ('id', 'codigo', 'descricao', 'modelo_id', 'tipo_veiculo'),
+                        'id', tamanho_pagina),
+    )
+    nomes_marcas = {(m.get('tipo_veiculo', 1), str(m['codigo'])): m['nome'] for m in marcas}
+    modelos = {(m.get('tipo_veiculo', 1), str(m['codigo'])): m for m in modelos}
+    anos = {a['id']: a for a in anos}
+
+    ultimos = {}
+    paginas = ler_paginas(
+        armazenamento, 'veiculos',
+        ('id', 'modelo_id', 'ano_id', 'mes_referencia_id', 'codigo_fipe', 'combustivel', 'preco', 'tipo_veiculo'),
+        'id', tamanho_pagina,
+        filtro=lambda c: c.gte('mes_referencia_id', int(mes) - meses + 1).lt('mes_referencia_id', int(mes) + 1),
+    )
+    async for pagina in paginas:
+        for linha in pagina:
+            anterior = ultimos.get(linha['ano_id'])
+            if anterior is None or linha['mes_referencia_id'] >= anterior['mes_referencia_id']:
+                ultimos[linha['ano_id']] = linha
+
+    veiculos = []
+    for linha in ultimos.values():
+        tipo = linha.get('tipo_veiculo', 1)
+        modelo = modelos.get((tipo, str(linha['modelo_id'])))
+        ano = anos.get(linha['ano_id'])
+        if modelo is None or ano is None:
+            continue
+        veiculos.append({
+            'id': f"{tipo}-{linha['modelo_id']}-{linha['ano_id']}",
+            'tipo_veiculo': tipo,
+            'marca_id': modelo['marca_id'],
+            'marca': nomes_marcas.get((tipo, str(modelo['marca_id'])), ""),
+            'modelo_id': linha['modelo_id'],
+            'modelo': modelo['nome'],
+            'ano_id': linha['ano_id'],
+            'ano': ano_modelo(ano['codigo']),
+            'descricao_ano': ano['descricao'],
+            'combustivel': linha['combustivel'],
+            'codigo_fipe': linha['codigo_fipe'],
+            'preco': float(linha['preco']),
+            'centavos': round(float(linha['preco']) * 100),
+            'mes_referencia_id': linha['mes_referencia_id'],
+        })
+    indice = IndiceConsulta(veiculos, mes)
+    print(f"⏱️ Índice de consulta do mês {mes}: {len(indice)} veículos, {len(indice.termos)} termos "
+          f"({time.perf_counter() - inicio:.2f}s)")
+    return indice
+
+
+class ServicoConsulta:
+    """Índice atual, cache de respostas e a verificação periódica de um mês novo"""
+
+    def __init__(self, armazenamento, meses_precos=12, intervalo_verificacao=60, tamanho_cache=2048,
+                 por_pagina=24, max_por_pagina=100, arquivo_agregados=None):
+        self.armazenamento = armazenamento
+        self.meses_precos = meses_precos
+        self.intervalo_verificacao = intervalo_verificacao
+        self.por_pagina = por_pagina
+        self.max_por_pagina = max_por_pagina
+        self.cache = CacheLRU(tamanho_cache)
+        self.indice = IndiceConsulta([], None)
+        self.linhas_indice = None
+        self.arquivo_agregados = arquivo_agregados
+        self.agregados = None
+        self._versao_agregados = None
+        self._trava = asyncio.Lock()
+
+    async def atualizar(self, forcar=False):
+        """Recria o índice se há um mês mais novo no banco ou o atual mudou; devolve True se recriou"""
+        async with self._trava:
+            await self._recarregar_agregados()
+            mes = await ultimo_mes(self.armazenamento)
+            if mes is None:
+                return False
+            # Contadas antes da carga: linhas gravadas durante ela forçam uma nova na próxima verificação
+            linhas = await linhas_do_mes(self.armazenamento, mes)
+            if mes == self.indice.mes_referencia and linhas == self.linhas_indice and not forcar:
+                return False
+            indice = await carregar_indice(self.armazenamento, mes, self.meses_precos)
+            # Troca o índice e descarta as respostas anteriores juntos, sem await entre eles
+            self.indice = indice
+            self.linhas_indice = linhas
+            self.cache.limpar()
+            return True
+
+    async def _recarregar_agregados(self):
+        if not self.arquivo_agregados or not os.path.exists(self.arquivo_agregados):
+            return
+        versao = os.stat(self.arquivo_agregados).st_mtime_ns
+        if versao == self._versao_agregados:
+            return
+        try:
+            self.agregados = await asyncio.to_thread(AgregadosPrecos.carregar, self.arquivo_agregados)
+            self._versao_agregados = versao
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            logger.warning("falha_carregar_agregados arquivo=%s erro=%s", self.arquivo_agregados, e)
+
+    async def verificar_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.intervalo_verificacao)
+            try:
+                await self.atualizar()
+            except Exception as e:
+                logger.warning("falha_atualizar_indice erro=%s", e)
+
+    # --- HTTP ---------------------------------------------------------------
+
+    @staticmethod
+    def _json(texto):
+        return web.Response(text=texto, content_type="application/json")
+
+    @staticmethod
+    def _codigo(valor, tipo):
+        """``"tipo:codigo"`` de uma marca ou modelo; um código sozinho usa ``tipo`` (padrão 1, carros)"""
+        if not valor:
+            return None
+        if ":" in valor:
+            tipo_valor, codigo = valor.split(":", 1)
+            return chave_tipo(int(tipo_valor), codigo)
+        return chave_tipo(tipo if tipo is not None else 1, valor)
+
+    def _filtros(self, query):
+        def inteiro(nome):
+            valor = query.get(nome)
+            return int(valor) if valor not in (None, "") else None
+
+        def centavos(nome):
+            valor = query.get(nome)
+            return round(float(valor) * 100) if valor not in (None, "") else None
+
+        tipo = inteiro('tipo')
+        return {
+            'tipo': tipo,
+            'marca': self._codigo(query.get('marca'), tipo),
+            'modelo': self._codigo(query.get('modelo'), tipo),
+            'ano': inteiro('ano'),
+            'combustivel': normalizar(query['combustivel']) if query.get('combustivel') else None,
+            'busca': query.get('busca', "").strip() or None,
+            'preco_min': centavos('preco_min'),
+            'preco_max': centavos('preco_max'),
+        }
+
+    async def _veiculos(self, request):
+        try:
+            filtros = self._filtros(request.query)
+            pagina = max(1, int(request.query.get('pagina', 1)))
+            por_pagina = min(self.max_por_pagina, max(1, int(request.query.get('por_pagina', self.por_pagina))))
+        except ValueError as e:
+            return web.json_response({'erro': f"parâmetro inválido: {e}"}, status=400)
+        decrescente = request.query.get('ordem') == '-preco'
+        indice = self.indice
+        chave = ('veiculos', indice.mes_referencia, tuple(filtros.values()), pagina, por_pagina, decrescente)
+        return self._json(self.cache.obter(chave, lambda: json.dumps({
+            **indice.consultar(pagina, por_pagina, decrescente, **filtros),
+            'anos': indice.anos(**{**filtros, 'ano': None}),
+        }, ensure_ascii=False)))
+
+    async def _marcas(self, request):
+        indice = self.indice
+        tipo = request.query.get('tipo')
+        chave = ('marcas', indice.mes_referencia, tipo)
+
+        def calcular():
+            marcas = {}
+            for posicoes in indice.por_marca.values():
+                for posicao in posicoes:
+                    item = indice.itens[posicao]
+                    if tipo is None or str(item['tipo_veiculo']) == tipo:
+                        marcas[(item['tipo_veiculo'], str(item['marca_id']))] = {
+                            'codigo': item['marca_id'], 'nome': item['marca'], 'tipo_veiculo': item['tipo_veiculo'],
+                        }
+            return json.dumps(sorted(marcas.values(), key=lambda m: normalizar(m['nome'])), ensure_ascii=False)
+        return self._json(self.cache.obter(chave, calcular))
+
+    async def _modelos(self, request):
+        indice = self.indice
+        try:
+            tipo = request.query.get('tipo')
+            marca = self._codigo(request.query.get('marca'), int(tipo) if tipo else None)
+        except ValueError as e:
+            return web.json_response({'erro': f"parâmetro inválido: {e}"}, status=400)
+        chave = ('modelos', indice.mes_referencia, marca)
+
+        def calcular():
+            modelos = {}
+            for posicao in (indice.por_marca.get(marca, _VAZIO) if marca else range(len(indice))):
+                item = indice.itens[posicao]
+                modelos[(item['tipo_veiculo'], item['modelo_id'])] = {
+                    'codigo': item['modelo_id'], 'nome': item['modelo'], 'marca_id': item['marca_id'],
+                    'tipo_veiculo': item['tipo_veiculo'],
+                }
+            return json.dumps(sorted(modelos.values(), key=lambda m: normalizar(m['nome'])), ensure_ascii=False)
+        return self._json(self.cache.obter(chave, calcular))
+
+    async def _estatisticas(self, request):
+        if self.agregados is None:
+            return web.json_response({'erro': "agregados indisponíveis"}, status=503)
+        query, nivel = request.query, request.match_info['nivel']
+        try:
+            if nivel == 'veiculo':
+                resultado = self.agregados.veiculo(int(query['ano_id']))
+            elif nivel == 'modelo':
+                resultado = self.agregados.modelo(int(query.get('tipo', 1)), query['modelo'])
+            else:
+                resultado = self.agregados.marca(int(query.get('tipo', 1)), query['marca'])
+        except (KeyError, ValueError) as e:
+            return web.json_response({'erro': f"parâmetro inválido: {e}"}, status=400)
+        if resultado is None:
+            return web.json_response({'erro': "sem preços"}, status=404)
+        return web.json_response(resultado)
+
+    async def _saude(self, request):
+        return web.json_response({
+            'mes_referencia_id': self.indice.mes_referencia,
+            'veiculos': len(self.indice),
+            'agregados': len(self.agregados) if self.agregados is not None else None,
+            'cache': {'respostas': len(self.cache.itens), 'acertos': self.cache.acertos,
+                      'faltas': self.cache.faltas},
+        })
+
+    async def _atualizar(self, request):
+        recriado = await self.atualizar(forcar=request.query.get('forcar') == '1')
+        return web.json_response({'recriado': recriado, 'mes_referencia_id': self.indice.mes_referencia})
+
+    @web.middleware
+    async def _cors(self, request, handler):
+        resposta = await handler(request)
+        resposta.headers['Access-Control-Allow-Origin'] = '*'
+        return resposta
+
+    def criar_app(self):
+        app = web.Application(middlewares=[self._cors])
+        app.router.add_get("/veiculos", self._veiculos)
+        app.router.add_get("/marcas", self._marcas)
+        app.router.add_get("/modelos", self._modelos)
+        app.router.add_get(r"/estatisticas/{nivel:veiculo|modelo|marca}", self._estatisticas)
+        app.router.add_get("/saude", self._saude)
+        app.router.add_post("/atualizar", self._atualizar)
+        return app
+
+
+async def servir(armazenamento, porta, host="0.0.0.0"):
+    servico = ServicoConsulta(armazenamento, **{chave: valor for chave, valor in CONFIG_CONSULTA.items()
+                                                if chave != 'porta'})
+    await servico.atualizar()
+    runner = web.AppRunner(servico.criar_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, porta).start()
+    print(f"API de consulta em http://{host}:{porta} (mês {servico.indice.mes_referencia})")
+    try:
+        await servico.verificar_periodicamente()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    from supabase import create_client
+    from armazenamento import ArmazenamentoAsync
+
+    parser = argparse.ArgumentParser(description="API de leitura dos preços da FIPE")
+    parser.add_argument("--porta", type=int, default=CONFIG_CONSULTA['porta'])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--intervalo", type=int, default=CONFIG_CONSULTA['intervalo_verificacao'],
+                        help="segundos entre as verificações de um mês novo no banco")
+    args = parser.parse_args()
+    CONFIG_CONSULTA['intervalo_verificacao'] = args.intervalo
+    logging.basicConfig(level=os.getenv("AUTOFIPE_LOG", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    url, key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+    armazenamento = ArmazenamentoAsync(lambda: create_client(url, key))
+    try:
+        asyncio.run(servir(armazenamento, args.porta, args.host))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        armazenamento.fechar()
+
+
+if __name__ == "__main__":
+    main()
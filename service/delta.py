@@ -0,0 +1,116 @@
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+
+from catalogo import ler_paginas
+
+
+def centavos(preco):
+    return round(float(preco) * 100)
+
+
+def _chave(modelo_id, ano_id):
+    return (int(modelo_id) << 32) | int(ano_id)
+
+
+class IndicePrecos:
+    """Último preço conhecido (em centavos) de cada (modelo_id, ano_id).
+
+    Guardado em dois arrays ordenados de inteiros de 64 bits (16 bytes por
+    veículo, em vez das centenas de um dict de tuplas); a busca é uma bisseção.
+    """
+
+    def __init__(self, precos=None):
+        itens = sorted((precos or {}).items())
+        self.chaves = array('q', (chave for chave, _ in itens))
+        self.centavos = array('q', (valor for _, valor in itens))
+
+    def __len__(self):
+        return len(self.chaves)
+
+    def obter(self, modelo_id, ano_id):
+        chave = _chave(modelo_id, ano_id)
+        indice = bisect_left(self.chaves, chave)
+        if indice < len(self.chaves) and self.chaves[indice] == chave:
+            return self.centavos[indice]
+        return None
+
+
+async def carregar_indice_precos(armazenamento, mes_atual, meses=12, tamanho_pagina=1000):
+    """Monta o ``IndicePrecos`` com os preços dos ``meses`` anteriores a ``mes_atual``.
+
+    No modo delta cada mês só tem as linhas que mudaram, então o preço vigente
+    de um veículo é o da linha mais recente dele, que pode ser de vários meses
+    atrás. Um veículo sem linha na janela é tratado como novo (e gravado inteiro).
+    """
+    inicio = time.perf_counter()
+    ultimos = {}
+    consultas = 0
+    paginas = ler_paginas(
+        armazenamento, 'veiculos', ('id', 'modelo_id', 'ano_id', 'mes_referencia_id', 'preco'), 'id', tamanho_pagina,
+        filtro=lambda c: c.gte('mes_referencia_id', int(mes_atual) - meses).lt('mes_referencia_id', int(mes_atual)),
+    )
+    async for pagina in paginas:
+        consultas += 1
+        for linha in pagina:
+            chave = _chave(linha['modelo_id'], linha['ano_id'])
+            mes = linha['mes_referencia_id']
+            anterior = ultimos.get(chave)
+            if anterior is None or mes >= anterior[0]:
+                ultimos[chave] = (mes, centavos(linha['preco']))
+    indice = IndicePrecos({chave: valor for chave, (_, valor) in ultimos.items()})
+    print(f"⏱️ Índice de preços anteriores: {len(indice)} veículos em {consultas} consultas "
+          f"({time.perf_counter() - inicio:.2f}s)")
+    return indice
+
+
+class RegistroDelta:
+    """Compara cada preço coletado com o ``IndicePrecos`` do mês anterior.
+
+    ``classificar`` diz se o preço é novo, alterado ou inalterado. Os novos e
+    alterados são gravados inteiros em veiculos; os inalterados viram só o
+    ``ano_id`` dentro de uma linha de veiculos_inalterados, que agrupa até
+    ``tamanho_lote`` veículos do mesmo mês. ``linha_inalterado`` devolve a
+    linha do lote com o ano_id acrescentado; regravar o lote (pela mesma chave
+    ``(mes_referencia_id, lote)``) só aumenta a lista, então cada item pode ser
+    confirmado no journal assim que a linha que o contém for gravada.
+    """
+
+    def __init__(self, indice, tamanho_lote=500, metricas=None):
+        self.indice = indice
+        self.tamanho_lote = tamanho_lote
+        self.metricas = metricas
+        self.contagem = {"novo": 0, "alterado": 0, "inalterado": 0}
+        self._lotes = {}
+
+    def classificar(self, dados):
+        anterior = self.indice.obter(dados['modelo_id'], dados['ano_id'])
+        if anterior is None:
+            resultado = "novo"
+        elif anterior != centavos(dados['preco']):
+            resultado = "alterado"
+        else:
+            resultado = "inalterado"
+        self.contagem[resultado] += 1
+        if self.metricas is not None:
+            self.metricas.contador("delta_precos_total", "Preços comparados com o mês anterior",
+                                   resultado=resultado).inc()
+        return resultado
+
+    def linha_inalterado(self, dados):
+        mes = int(dados['mes_referencia_id'])
+        lote = self._lotes.get(mes)
+        if lote is None or len(lote['ano_ids']) >= self.tamanho_lote:
+            lote = self._lotes[mes] = {'mes_referencia_id': mes, 'lote': uuid.uuid4().hex, 'ano_ids': []}
+        lote['ano_ids'].append(int(dados['ano_id']))
+        # Cópia: a linha pode estar a caminho do banco enquanto o lote cresce
+        return {**lote, 'ano_ids': list(lote['ano_ids'])}
+
+    def resumo(self):
+        total = sum(self.contagem.values())
+        gravados = self.contagem["novo"] + self.contagem["alterado"]
+        evitadas = f"{self.contagem['inalterado'] / total:.0%}" if total else "--"
+        return (f"Delta: {self.contagem['novo']} novos, {self.contagem['alterado']} alterados, "
+                f"{self.contagem['inalterado']} inalterados ({gravados} linhas em veiculos, "
+                f"{evitadas} evitadas)")
@@ -0,0 +1,309 @@
+"""Destinos dos preços coletados.
+
+``obter_valor_veiculo`` entrega cada preço, como um registro, a todos os
+destinos abertos. O de sempre (``DestinoSupabase``, em service.py) grava em
+veiculos pelo gravador em lote; ``DestinoColunar`` grava um dataset local em
+colunas, particionado por mês de referência, para análises e backfills que
+não precisam do banco:
+
+    .dados/snapshot/mes_referencia_id=300/parte-<inicio>-<pid>-<n>.parquet
+
+Campos do registro: tipo_veiculo, marca_id, marca, modelo_id, modelo, ano_id,
+ano_modelo, combustivel, codigo_fipe, mes_referencia_id, preco (reais, float)
+e centavos (int, lido direto do texto "R$ 12.345,67" da FIPE).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # dependência opcional: só o destino colunar precisa dela
+    pa = None
+
+logger = logging.getLogger("autofipe.destinos")
+
+FORMATOS = {'parquet': ".parquet", 'arrow': ".arrow"}
+
+
+def centavos_do_valor(valor):
+    """'R$ 12.345,67' -> 1234567, sem passar por float"""
+    inteiros, _, decimais = str(valor).replace("R$", "").strip().partition(",")
+    return int(re.sub(r"\D", "", inteiros) or 0) * 100 + int((decimais + "00")[:2])
+
+
+def _exigir_pyarrow():
+    if pa is None:
+        raise RuntimeError("O destino colunar precisa do pyarrow: pip install pyarrow")
+
+
+class Destino:
+    """Interface de um destino de preços; ``gravar`` devolve False se o registro foi descartado"""
+
+    async def abrir(self):
+        return self
+
+    async def gravar(self, registro, marcador=None):
+        raise NotImplementedError
+
+    def confirmar(self, marcador):
+        """As linhas de ``marcador`` foram gravadas no banco (chamado pelo ``ao_confirmar`` do gravador)"""
+
+    async def descarregar(self):
+        """Fim de uma tabela de referência: grava o que estiver pendente"""
+
+    async def fechar(self):
+        await self.descarregar()
+
+    async def __aenter__(self):
+        return await self.abrir()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.fechar()
+
+
+# Colunas do dataset: (nome, tipo Arrow, dicionário). marca, modelo, combustivel e
+# codigo_fipe se repetem muito e vão codificados em dicionário; o mês fica no caminho.
+COLUNAS = (
+    ('tipo_veiculo', 'int8', False),
+    ('marca_id', 'int32', False),
+    ('marca', 'string', True),
+    ('modelo_id', 'int32', False),
+    ('modelo', 'string', True),
+    ('ano_id', 'int64', False),
+    ('ano_modelo', 'int16', False),
+    ('combustivel', 'string', True),
+    ('codigo_fipe', 'string', True),
+    ('centavos', 'int64', False),
+)
+
+
+def esquema():
+    _exigir_pyarrow()
+    return pa.schema([(nome, pa.dictionary(pa.int32(), pa.string()) if dicionario else getattr(pa, tipo)())
+                      for nome, tipo, dicionario in COLUNAS])
+
+
+class _Particao:
+    """Arquivo de um mês: acumula até ``tamanho_grupo`` linhas e grava um row group/lote.
+
+    ``adicionar`` e ``retirar`` rodam no event loop e só mexem em listas;
+    ``gravar`` e ``fechar`` (conversão para Arrow, compressão e escrita) rodam
+    na thread de escrita do ``DestinoColunar``, uma de cada vez.
+
+    Os dicionários só crescem dentro do arquivo, então cada lote reaproveita os
+    códigos dos anteriores (no formato arrow, o lote leva só os valores novos).
+    """
+
+    def __init__(self, caminho, formato, tamanho_grupo):
+        self.caminho = caminho
+        self.temporario = f"{caminho}.tmp"
+        self.formato = formato
+        self.tamanho_grupo = tamanho_grupo
+        self.esquema = esquema()
+        self.colunas = {nome: [] for nome, _, _ in COLUNAS}
+        self.dicionarios = {nome: {} for nome, _, dicionario in COLUNAS if dicionario}
+        self.linhas = 0
+        self.pendentes = 0
+        self.escritor = None
+        self._arquivo = None
+
+    def adicionar(self, registro):
+        """Acrescenta o registro; devolve um lote para ``gravar`` quando o grupo enche"""
+        for nome, _, dicionario in COLUNAS:
+            valor = registro.get(nome)
+            if dicionario:
+                codigos = self.dicionarios[nome]
+                valor = codigos.setdefault(valor, len(codigos)) if valor is not None else None
+            self.colunas[nome].append(valor)
+        self.pendentes += 1
+        if self.pendentes >= self.tamanho_grupo:
+            return self.retirar()
+        return None
+
+    def retirar(self):
+        """As linhas acumuladas e os dicionários até aqui, deixando listas novas no lugar"""
+        lote = (self.colunas, {nome: list(codigos) for nome, codigos in self.dicionarios.items()}, self.pendentes)
+        self.colunas = {nome: [] for nome, _, _ in COLUNAS}
+        self.pendentes = 0
+        return lote
+
+    def _abrir(self):
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        if self.formato == 'parquet':
+            self.escritor = pq.ParquetWriter(self.temporario, self.esquema, compression="zstd")
+        else:
+            self._arquivo = pa.OSFile(self.temporario, "wb")
+            self.escritor = ipc.new_file(self._arquivo, self.esquema,
+                                         options=ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    def gravar(self, lote):
+        colunas, dicionarios, quantidade = lote
+        if not quantidade:
+            return
+        if self.escritor is None:
+            self._abrir()
+        arrays = []
+        for campo in self.esquema:
+            valores = colunas[campo.name]
+            if campo.name in dicionarios:
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(valores, pa.int32()),
+                                                             pa.array(dicionarios[campo.name], pa.string())))
+            else:
+                arrays.append(pa.array(valores, campo.type))
+        self.escritor.write_batch(pa.record_batch(arrays, schema=self.esquema))
+        self.linhas += quantidade
+
+    def fechar(self, lote):
+        self.gravar(lote)
+        if self.escritor is None:
+            return
+        self.escritor.close()
+        if self._arquivo is not None:
+            self._arquivo.close()
+        # Só o arquivo completo (com rodapé) ganha o nome final
+        os.replace(self.temporario, self.caminho)
+
+
+class DestinoColunar(Destino):
+    """Dataset local em Parquet ou Arrow (IPC), uma partição por mes_referencia_id.
+
+    Um preço com ``marcador`` só entra no dataset quando ``confirmar(marcador)``
+    avisa que as linhas dele estão no banco: um preço que não chegou ao banco
+    (e será coletado de novo) não aparece duas vezes no snapshot. Sem
+    marcador, entra na hora.
+
+    Cada execução abre um arquivo novo por mês, grava em lotes de até
+    ``tamanho_grupo`` linhas (o mês nunca fica inteiro na memória) e o renomeia
+    de ``.tmp`` para o nome final ao fechar. A codificação e a compressão rodam
+    em uma thread de escrita, fora do event loop. Os preços de um arquivo que
+    não chegou a ser fechado (queda do processo) ficam de fora do dataset.
+    """
+
+    def __init__(self, diretorio, formato="parquet", tamanho_grupo=10_000):
+        _exigir_pyarrow()
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato desconhecido: {formato} (use {', '.join(FORMATOS)})")
+        self.diretorio = diretorio
+        self.formato = formato
+        self.tamanho_grupo = tamanho_grupo
+        self.particoes = {}
+        self.arquivos = 0
+        self.aguardando = {}
+        self._escrita = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
+        self._erro = None
+
+    def caminho(self, mes):
+        self.arquivos += 1
+        nome = f"parte-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self.arquivos}{FORMATOS[self.formato]}"
+        return os.path.join(self.diretorio, f"mes_referencia_id={mes}", nome)
+
+    async def gravar(self, registro, marcador=None):
+        if self._erro is not None:
+            raise self._erro
+        if marcador is None:
+            self._adicionar(registro)
+        else:
+            # Uma nova tentativa do mesmo marcador substitui a anterior
+            self.aguardando[marcador] = registro
+        return True
+
+    def confirmar(self, marcador):
+        registro = self.aguardando.pop(marcador, None)
+        if registro is not None:
+            self._adicionar(registro)
+
+    def _adicionar(self, registro):
+        mes = int(registro['mes_referencia_id'])
+        particao = self.particoes.get(mes)
+        if particao is None:
+            particao = self.particoes[mes] = _Particao(self.caminho(mes), self.formato, self.tamanho_grupo)
+        lote = particao.adicionar(registro)
+        if lote is not None:
+            self._escrita.submit(particao.gravar, lote).add_done_callback(self._ao_escrever)
+
+    def _ao_escrever(self, futuro):
+        if futuro.exception() is not None and self._erro is None:
+            self._erro = futuro.exception()
+
+    async def descarregar(self):
+        """Fecha os arquivos abertos; gravações seguintes abrem arquivos novos"""
+        particoes, self.particoes = self.particoes, {}
+        loop = asyncio.get_running_loop()
+        for particao in particoes.values():
+            await loop.run_in_executor(self._escrita, particao.fechar, particao.retirar())
+        if self._erro is not None:
+            erro, self._erro = self._erro, None
+            raise erro
+        if particoes:
+            print(f"Snapshot {self.formato}: {sum(p.linhas for p in particoes.values())} preços em "
+                  f"{len(particoes)} meses ({self.diretorio})")
+
+    async def fechar(self):
+        try:
+            await self.descarregar()
+        finally:
+            self._escrita.shutdown(wait=False)
+        if self.aguardando:
+            logger.warning("snapshot_sem_confirmacao precos=%d", len(self.aguardando))
+
+
+def meses_disponiveis(diretorio):
+    if not os.path.isdir(diretorio):
+        return []
+    return sorted(int(nome.split("=", 1)[1]) for nome in os.listdir(diretorio)
+                  if nome.startswith("mes_referencia_id="))
+
+
+def ler_snapshot(diretorio, meses=None, colunas=None):
+    """Lê o dataset como uma ``pyarrow.Table``, com os arquivos mapeados em memória.
+
+    No formato arrow a leitura não copia os dados (as colunas apontam para o
+    mapeamento); no parquet o arquivo é mapeado e decodificado. ``meses``
+    restringe as partições e ``colunas`` as colunas lidas; a coluna
+    mes_referencia_id vem do nome da partição.
+    """
+    _exigir_pyarrow()
+    tabelas = []
+    for mes in meses if meses is not None else meses_disponiveis(diretorio):
+        pasta = os.path.join(diretorio, f"mes_referencia_id={mes}")
+        if not os.path.isdir(pasta):
+            continue
+        for nome in sorted(os.listdir(pasta)):
+            caminho = os.path.join(pasta, nome)
+            if nome.endswith(FORMATOS['arrow']):
+                tabela = ipc.open_file(pa.memory_map(caminho)).read_all()
+                if colunas is not None:
+                    tabela = tabela.select(colunas)
+            elif nome.endswith(FORMATOS['parquet']):
+                tabela = pq.read_table(caminho, columns=colunas, memory_map=True)
+            else:
+                continue
+            tabelas.append(tabela.append_column('mes_referencia_id', pa.array([mes] * len(tabela), pa.int32())))
+    if not tabelas:
+        return esquema().append(pa.field('mes_referencia_id', pa.int32())).empty_table()
+    return pa.concat_tables(tabelas, promote_options="permissive")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumo do dataset local de preços")
+    parser.add_argument("diretorio", nargs="?", default=os.path.join(".dados", "snapshot"))
+    parser.add_argument("--mes", type=int, action="append", help="só estes meses (pode repetir)")
+    args = parser.parse_args()
+    inicio = time.perf_counter()
+    tabela = ler_snapshot(args.diretorio, args.mes)
+    print(f"{len(tabela)} preços, {tabela.nbytes / 1e6:.1f} MB em memória "
+          f"(lidos em {time.perf_counter() - inicio:.2f}s)")
+    for contagem in sorted(tabela.column('mes_referencia_id').value_counts().to_pylist(),
+                           key=lambda c: c['values']):
+        print(f"  mês {contagem['values']}: {contagem['counts']} preços")
+
+
+if __name__ == "__main__":
+    main()
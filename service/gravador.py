@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import json
+import os
+import time
+
+from metricas import LIMITES_LOTE
+
+logger = logging.getLogger("autofipe.gravador")
+
+# Colunas usadas como on_conflict em cada tabela. O banco precisa de uma
+# restrição UNIQUE sobre exatamente essas colunas (veja o readme). Os códigos da
+# FIPE só são únicos dentro de um tipo de veículo, então o tipo faz parte da chave;
+# em veiculos, ano_id (id de anos_modelo) já identifica o tipo.
+CHAVES_CONFLITO = {
+    'tabela_referencia': 'codigo',
+    'marcas': 'tipo_veiculo,codigo',
+    'modelos': 'tipo_veiculo,codigo',
+    'anos_modelo': 'tipo_veiculo,modelo_id,codigo',
+    'veiculos': 'modelo_id,ano_id,mes_referencia_id',
+    'veiculos_inalterados': 'mes_referencia_id,lote',
+}
+
+
+class GravadorLote:
+    """Acumula linhas por tabela e grava cada lote em um único upsert multi-linha.
+
+    As gravações passam pelo ``ArmazenamentoAsync`` e não bloqueiam o event loop.
+
+    Um lote é gravado quando a tabela atinge ``tamanho_lote`` linhas ou a cada
+    ``intervalo`` segundos, o que vier primeiro. Lotes que falham são tentados
+    de novo até ``max_tentativas`` vezes; se ainda assim falharem, voltam para o
+    buffer e entram no próximo envio, que ``adicionar`` só dispara depois de
+    mais ``tamanho_lote`` linhas (o envio periódico continua tentando), para que
+    cada linha nova não repita as tentativas com espera. ``fechar()`` garante o
+    envio final e, se o banco continuar indisponível, salva o que sobrou em
+    ``arquivo_falhas``; ``abrir()`` reenvia o que estiver nesse arquivo.
+
+    Linhas com a mesma chave de conflito dentro do buffer são consolidadas
+    (a última vence), já que o Postgres rejeita um upsert que toca a mesma
+    linha duas vezes.
+
+    Cada linha pode carregar um ``marcador`` (ex.: a unidade de trabalho do
+    journal). Depois de ``selar(marcador)``, ``ao_confirmar(marcador)`` é chamado
+    assim que todas as linhas daquele marcador estiverem gravadas no banco.
+    ``ao_gravar(tabela, linhas)``, se informado, recebe as linhas de cada lote gravado.
+
+    Com ``metricas``, registra o tamanho de cada lote, lotes gravados/falhos e
+    as linhas pendentes por tabela.
+    """
+
+    def __init__(self, armazenamento, tamanho_lote=500, intervalo=5.0, max_tentativas=3,
+                 atraso_tentativa=1.0, arquivo_falhas=None, chaves_conflito=None, ao_confirmar=None,
+                 ao_gravar=None, metricas=None):
+        self.armazenamento = armazenamento
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.max_tentativas = max_tentativas
+        self.atraso_tentativa = atraso_tentativa
+        self.arquivo_falhas = arquivo_falhas
+        self.chaves_conflito = chaves_conflito or CHAVES_CONFLITO
+        self.buffers = {}
+        self.linhas_gravadas = {}
+        self.lotes_gravados = 0
+        self.lotes_falhos = 0
+        self.ao_confirmar = ao_confirmar
+        self.ao_gravar = ao_gravar
+        self.metricas = metricas
+        self._linhas_por_marcador = {}
+        self._selados = set()
+        self._locks = {}
+        self._limites = {}
+        self._tarefa_periodica = None
+
+    async def abrir(self):
+        if self._tarefa_periodica is None:
+            await self.reprocessar_falhas()
+            self._tarefa_periodica = asyncio.create_task(self._loop_periodico())
+        return self
+
+    async def reprocessar_falhas(self):
+        """Reenvia as linhas salvas em ``arquivo_falhas`` por execuções anteriores; devolve quantas eram.
+
+        O arquivo é renomeado para ``.reprocessando`` antes da leitura e só é
+        apagado depois que todas as linhas foram gravadas. O que o banco ainda
+        recusar fica no buffer (e volta para ``arquivo_falhas`` ao fechar); como
+        os envios são upserts, ler as mesmas linhas de novo numa próxima
+        execução não duplica nada.
+        """
+        if not self.arquivo_falhas:
+            return 0
+        reprocessando = f"{self.arquivo_falhas}.reprocessando"
+        if os.path.exists(self.arquivo_falhas):
+            if os.path.exists(reprocessando):
+                # Sobra de uma execução que parou no meio do reenvio: junta os dois
+                with open(self.arquivo_falhas) as origem, open(reprocessando, "a") as destino:
+                    destino.write(origem.read())
+                os.remove(self.arquivo_falhas)
+            else:
+                os.replace(self.arquivo_falhas, reprocessando)
+        if not os.path.exists(reprocessando):
+            return 0
+        total = 0
+        with open(reprocessando) as f:
+            for texto in f:
+                if not texto.strip():
+                    continue
+                registro = json.loads(texto)
+                buffer = self._buffer(registro["tabela"])
+                for linha in registro["linhas"]:
+                    chave = self._chave(registro["tabela"], linha)
+                    buffer[chave] = (linha, buffer[chave][1] if chave in buffer else [])
+                    total += 1
+        print(f"Reenviando {total} linhas de {self.arquivo_falhas}")
+        await self.descarregar()
+        if self.pendentes() == 0:
+            os.remove(reprocessando)
+        return total
+
+    async def fechar(self):
+        if self._tarefa_periodica is not None:
+            self._tarefa_periodica.cancel()
+            await asyncio.gather(self._tarefa_periodica, return_exceptions=True)
+            self._tarefa_periodica = None
+        await self.descarregar()
+        restantes = {
+            tabela: [linha for linha, _ in buffer.values()]
+            for tabela, buffer in self.buffers.items() if buffer
+        }
+        if restantes:
+            self._salvar_falhas(restantes)
+
+    async def __aenter__(self):
+        return await self.abrir()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.fechar()
+
+    def _chave(self, tabela, linha):
+        colunas = self.chaves_conflito[tabela].split(",")
+        return tuple(linha[coluna] for coluna in colunas)
+
+    def pendentes(self, tabela=None):
+        if tabela is not None:
+            return len(self.buffers.get(tabela, {}))
+        return sum(len(buffer) for buffer in self.buffers.values())
+
+    def _buffer(self, tabela):
+        if tabela not in self.buffers and self.metricas is not None:
+            self.metricas.medidor("gravador_linhas_pendentes", "Linhas aguardando o próximo lote",
+                                  funcao=lambda: self.pendentes(tabela), tabela=tabela)
+        return self.buffers.setdefault(tabela, {})
+
+    async def adicionar(self, tabela, linha, marcador=None):
+        buffer = self._buffer(tabela)
+        chave = self._chave(tabela, linha)
+        marcadores = buffer[chave][1] if chave in buffer else []
+        if marcador is not None:
+            marcadores.append(marcador)
+            self._linhas_por_marcador[marcador] = self._linhas_por_marcador.get(marcador, 0) + 1
+        buffer[chave] = (linha, marcadores)
+        lock = self._locks.get(tabela)
+        # Com um envio em andamento, as linhas novas entram nele
+        if len(buffer) >= self._limites.get(tabela, self.tamanho_lote) and not (lock and lock.locked()):
+            await self.descarregar(tabela)
+
+    def selar(self, marcador):
+        """Indica que não haverá mais linhas para ``marcador``"""
+        if self._linhas_por_marcador.get(marcador, 0) == 0:
+            self._linhas_por_marcador.pop(marcador, None)
+            self._confirmar(marcador)
+        else:
+            self._selados.add(marcador)
+
+    def _confirmar(self, marcador):
+        if self.ao_confirmar:
+            self.ao_confirmar(marcador)
+
+    def _linhas_gravadas(self, entradas):
+        for _, marcadores in entradas:
+            for marcador in marcadores:
+                restantes = self._linhas_por_marcador[marcador] - 1
+                if restantes:
+                    self._linhas_por_marcador[marcador] = restantes
+                    continue
+                del self._linhas_por_marcador[marcador]
+                if marcador in self._selados:
+                    self._selados.discard(marcador)
+                    self._confirmar(marcador)
+
+    async def descarregar(self, tabela=None):
+        tabelas = [tabela] if tabela is not None else list(self.buffers)
+        for nome in tabelas:
+            lock = self._locks.setdefault(nome, asyncio.Lock())
+            async with lock:
+                while self.buffers.get(nome):
+                    buffer = self.buffers[nome]
+                    chaves = list(buffer)[:self.tamanho_lote]
+                    lote = {chave: buffer.pop(chave) for chave in chaves}
+                    linhas = [linha for linha, _ in lote.values()]
+                    if await self._gravar_lote(nome, linhas):
+                        if self.ao_gravar:
+                            self.ao_gravar(nome, linhas)
+                        self._linhas_gravadas(lote.values())
+                    else:
+                        # Devolve ao buffer sem perder versões mais novas nem marcadores
+                        for chave, (linha, marcadores) in lote.items():
+                            if chave in buffer:
+                                buffer[chave][1].extend(marcadores)
+                            else:
+                                buffer[chave] = (linha, marcadores)
+                        self._limites[nome] = len(buffer) + self.tamanho_lote
+                        break
+                else:
+                    self._limites.pop(nome, None)
+
+    async def _gravar_lote(self, tabela, linhas):
+        for tentativa in range(self.max_tentativas):
+            try:
+                await self.armazenamento.executar(
+                    lambda db: db.table(tabela).upsert(linhas, on_conflict=self.chaves_conflito[tabela]).execute(),
+                    tabela=tabela, operacao="upsert_lote",
+                )
+                self.lotes_gravados += 1
+                self.linhas_gravadas[tabela] = self.linhas_gravadas.get(tabela, 0) + len(linhas)
+                self._registrar_lote(tabela, len(linhas), "gravado")
+                return True
+            except Exception as e:
+                logger.warning("erro_lote tabela=%s linhas=%d erro=%s tentativa=%d/%d",
+                               tabela, len(linhas), e, tentativa + 1, self.max_tentativas)
+                if tentativa < self.max_tentativas - 1:
+                    await asyncio.sleep(self.atraso_tentativa * 2 ** tentativa)
+        self.lotes_falhos += 1
+        self._registrar_lote(tabela, len(linhas), "falhou")
+        return False
+
+    def _registrar_lote(self, tabela, linhas, resultado):
+        if self.metricas is None:
+            return
+        self.metricas.contador("gravador_lotes_total", "Lotes enviados ao banco",
+                               tabela=tabela, resultado=resultado).inc()
+        if resultado == "gravado":
+            self.metricas.histograma("gravador_lote_linhas", "Linhas por lote gravado",
+                                     limites=LIMITES_LOTE, tabela=tabela).observar(linhas)
+
+    async def _loop_periodico(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            await self.descarregar()
+
+    def _salvar_falhas(self, restantes):
+        total = sum(len(linhas) for linhas in restantes.values())
+        if not self.arquivo_falhas:
+            print(f"⚠️ {total} linhas não puderam ser gravadas e serão descartadas.")
+            return
+        os.makedirs(os.path.dirname(self.arquivo_falhas) or ".", exist_ok=True)
+        with open(self.arquivo_falhas, "a") as f:
+            for tabela, linhas in restantes.items():
+                f.write(json.dumps({"tabela": tabela, "linhas": linhas, "em": time.time()}) + "\n")
+        print(f"⚠️ {total} linhas não puderam ser gravadas; salvas em {self.arquivo_falhas}")
@@ -0,0 +1,105 @@
+import time
+
+
+def selecionar_tabelas(tabelas, desde=None, ate=None, quantidade=None):
+    """Filtra as tabelas de referência da FIPE (mais recente primeiro).
+
+    ``desde``/``ate`` são códigos de ``codigoTabelaReferencia`` (inclusivos);
+    ``quantidade`` limita às N mais recentes dentro do intervalo.
+    """
+    selecionadas = [
+        tabela for tabela in sorted(tabelas, key=lambda t: int(t['Codigo']), reverse=True)
+        if (desde is None or int(tabela['Codigo']) >= int(desde))
+        and (ate is None or int(tabela['Codigo']) <= int(ate))
+    ]
+    return selecionadas[:quantidade] if quantidade else selecionadas
+
+
+def intercalar(listas):
+    """Round-robin entre ``listas``: a1, b1, c1, a2, b2, ...
+
+    Usado para alimentar o pipeline com as marcas de todos os meses alternadas,
+    de modo que nenhum mês monopolize as filas (e o limitador) até terminar.
+    """
+    iteradores = [iter(lista) for lista in listas]
+    while iteradores:
+        ativos = []
+        for iterador in iteradores:
+            try:
+                yield next(iterador)
+            except StopIteration:
+                continue
+            ativos.append(iterador)
+        iteradores = ativos
+
+
+def _chave(mes):
+    return str(mes['Value']), mes.get('tipo_veiculo', 1)
+
+
+class ProgressoMes:
+    __slots__ = ('codigo', 'rotulo', 'concluidos', 'falhas', 'pulados', 'inicio', 'fim')
+
+    def __init__(self, codigo, rotulo):
+        self.codigo = codigo
+        self.rotulo = rotulo
+        self.concluidos = 0
+        self.falhas = 0
+        self.pulados = 0
+        self.inicio = None
+        self.fim = None
+
+    @property
+    def itens_por_segundo(self):
+        if self.inicio is None or self.fim is None or self.fim <= self.inicio:
+            return 0.0
+        return self.concluidos / (self.fim - self.inicio)
+
+
+class ProgressoPorMes:
+    """Preços concluídos, falhas e itens/s de cada tabela de referência (e tipo de veículo)"""
+
+    def __init__(self, meses):
+        self.meses = {_chave(mes): ProgressoMes(mes['Value'], mes['Label']) for mes in meses}
+
+    def __getitem__(self, mes):
+        return self.meses[_chave(mes)]
+
+    def registrar(self, mes, sucesso=True):
+        progresso = self[mes]
+        agora = time.monotonic()
+        if progresso.inicio is None:
+            progresso.inicio = agora
+        progresso.fim = agora
+        if sucesso:
+            progresso.concluidos += 1
+        else:
+            progresso.falhas += 1
+
+    def falha(self, mes):
+        """Falha antes dos preços (modelos/anos): o mês não pode ser dado como completo"""
+        self[mes].falhas += 1
+
+    def reprocessar(self, mes):
+        """Desfaz uma falha do mês antes de reprocessar o item que falhou"""
+        self[mes].falhas -= 1
+
+    def pular(self, mes, quantidade=1):
+        self[mes].pulados += quantidade
+
+    def completo(self, mes):
+        return self[mes].falhas == 0
+
+    def resumo_curto(self, limite=4):
+        """Os meses com atividade mais recente, para o painel de progresso"""
+        ativos = sorted((p for p in self.meses.values() if p.fim is not None), key=lambda p: p.fim, reverse=True)
+        partes = [f"{p.rotulo} {p.concluidos} ({p.itens_por_segundo:.1f}/s)" for p in ativos[:limite]]
+        if len(ativos) > limite:
+            partes.append(f"+{len(ativos) - limite} meses")
+        return " | ".join(partes) or "--"
+
+    def linhas(self):
+        yield f"{'mês':<28}{'código':>8}{'preços':>10}{'pulados':>10}{'falhas':>9}{'itens/s':>10}"
+        for p in self.meses.values():
+            yield (f"{p.rotulo:<28}{p.codigo:>8}{p.concluidos:>10}{p.pulados:>10}"
+                   f"{p.falhas:>9}{p.itens_por_segundo:>10.2f}")
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+
+
+class LimitadorAdaptativo:
+    """Token bucket com controle AIMD guiado pelas respostas da API.
+
+    Cada sucesso aumenta a taxa aditivamente (cerca de ``aumento`` req/s a cada
+    segundo de tráfego bem-sucedido); cada 429 a reduz multiplicativamente por
+    ``fator_reducao`` e, se houver ``Retry-After``, pausa todas as requisições
+    até o prazo indicado. A taxa aprendida é salva em ``arquivo_estado`` para que
+    a próxima execução comece perto do teto real da API.
+
+    Pode ser usado no lugar do ``AsyncLimiter``: ``async with limitador: ...``.
+    """
+
+    def __init__(self, taxa_inicial=0.5, taxa_min=0.1, taxa_max=20.0, aumento=0.05,
+                 fator_reducao=0.5, janela_reducao=2.0, arquivo_estado=None,
+                 margem_retomada=0.9):
+        self.taxa_min = taxa_min
+        self.taxa_max = taxa_max
+        self.aumento = aumento
+        self.fator_reducao = fator_reducao
+        self.janela_reducao = janela_reducao
+        self.arquivo_estado = arquivo_estado
+
+        taxa_salva = self._carregar_taxa()
+        if taxa_salva is not None:
+            taxa_inicial = taxa_salva * margem_retomada
+        self.taxa = self._limitar(taxa_inicial)
+
+        self.tokens = 1.0
+        self.ultima_recarga = time.monotonic()
+        self.pausado_ate = 0.0
+        self.ultima_reducao = 0.0
+        self.reducoes = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def taxa_atual(self):
+        return self.taxa
+
+    def _limitar(self, taxa):
+        return max(self.taxa_min, min(self.taxa_max, taxa))
+
+    def _recarregar(self, agora):
+        capacidade = max(1.0, self.taxa)
+        self.tokens = min(capacidade, self.tokens + (agora - self.ultima_recarga) * self.taxa)
+        self.ultima_recarga = agora
+
+    async def adquirir(self):
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                if agora < self.pausado_ate:
+                    await asyncio.sleep(self.pausado_ate - agora)
+                    continue
+                self._recarregar(agora)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.taxa)
+
+    async def __aenter__(self):
+        await self.adquirir()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def registrar_sucesso(self):
+        self.taxa = self._limitar(self.taxa + self.aumento / max(self.taxa, 1.0))
+
+    def registrar_throttle(self, retry_after=None):
+        """Reduz a taxa após um 429. Retorna o tempo de pausa aplicado (segundos)."""
+        agora = time.monotonic()
+        # Uma rajada de 429 das requisições já em voo conta como um único sinal
+        if agora - self.ultima_reducao >= self.janela_reducao:
+            self.taxa = self._limitar(self.taxa * self.fator_reducao)
+            self.ultima_reducao = agora
+            self.reducoes += 1
+            self.tokens = 0.0
+            self.salvar()
+
+        pausa = interpretar_retry_after(retry_after)
+        if pausa is None:
+            pausa = 1 / self.taxa
+        self.pausado_ate = max(self.pausado_ate, agora + pausa)
+        return pausa
+
+    def _carregar_taxa(self):
+        if not self.arquivo_estado or not os.path.exists(self.arquivo_estado):
+            return None
+        try:
+            with open(self.arquivo_estado) as f:
+                return float(json.load(f)["taxa"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Estado do limitador ignorado ({self.arquivo_estado}): {e}")
+            return None
+
+    def salvar(self):
+        if not self.arquivo_estado:
+            return
+        os.makedirs(os.path.dirname(self.arquivo_estado) or ".", exist_ok=True)
+        temporario = f"{self.arquivo_estado}.tmp"
+        with open(temporario, "w") as f:
+            json.dump({"taxa": self.taxa, "atualizado_em": time.time()}, f)
+        os.replace(temporario, self.arquivo_estado)
+
+
+def interpretar_retry_after(valor):
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
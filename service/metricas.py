@@ -0,0 +1,236 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+from aiohttp import web
+
+# Limites (em segundos) dos histogramas de latência
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Limites (em linhas) do histograma de tamanho de lote
+LIMITES_LOTE = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _rotulos(rotulos):
+    return tuple(sorted((chave, str(valor)) for chave, valor in rotulos.items()))
+
+
+def _formatar_rotulos(rotulos, extra=()):
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{chave}="{valor}"' for chave, valor in pares) + "}"
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    def __init__(self):
+        self.valor = 0
+
+    def inc(self, quantidade=1):
+        self.valor += quantidade
+
+
+class Medidor:
+    """Valor instantâneo. ``funcao`` (opcional) é lida só na exportação."""
+
+    def __init__(self, funcao=None):
+        self.valor = 0
+        self.funcao = funcao
+
+    def definir(self, valor):
+        self.valor = valor
+
+    def ler(self):
+        return self.funcao() if self.funcao else self.valor
+
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = tuple(limites)
+        self.contagens = [0] * (len(self.limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def quantil(self, q):
+        """Estimativa do quantil ``q`` por interpolação linear dentro do balde"""
+        if not self.total:
+            return None
+        alvo = q * self.total
+        acumulado = 0
+        for indice, contagem in enumerate(self.contagens):
+            if acumulado + contagem >= alvo and contagem:
+                inferior = self.limites[indice - 1] if indice else 0.0
+                superior = self.limites[indice] if indice < len(self.limites) else self.maximo
+                estimativa = inferior + (superior - inferior) * (alvo - acumulado) / contagem
+                return min(estimativa, self.maximo)
+            acumulado += contagem
+        return self.maximo
+
+    def resumo(self):
+        return {
+            "contagem": self.total,
+            "soma": round(self.soma, 6),
+            "media": round(self.soma / self.total, 6) if self.total else None,
+            "p50": self.quantil(0.5),
+            "p95": self.quantil(0.95),
+            "p99": self.quantil(0.99),
+            "max": self.maximo,
+        }
+
+
+class Metricas:
+    """Registro de contadores, medidores e histogramas com rótulos.
+
+    Cada métrica é identificada pelo nome e pelos rótulos, ex.:
+
+        metricas.contador("fipe_requisicoes_total", endpoint="ConsultarMarcas").inc()
+        metricas.histograma("fipe_requisicao_segundos", endpoint=...).observar(0.12)
+        metricas.medidor("estagio_fila", funcao=fila.qsize, estagio="precos")
+
+    Atualizar uma métrica já criada é só uma soma em memória; o texto do
+    Prometheus e o resumo em JSON são montados apenas quando pedidos.
+    """
+
+    TIPOS = {Contador: "counter", Medidor: "gauge", Histograma: "histogram"}
+
+    def __init__(self):
+        self.inicio = time.time()
+        self._familias = {}
+        self._descricoes = {}
+        self._lock = threading.Lock()
+
+    def _obter(self, classe, nome, descricao, rotulos, criar):
+        familia = self._familias.get(nome)
+        chave = _rotulos(rotulos)
+        if familia is not None:
+            metrica = familia.get(chave)
+            if metrica is not None:
+                return metrica
+        with self._lock:
+            familia = self._familias.setdefault(nome, {})
+            if descricao:
+                self._descricoes[nome] = descricao
+            metrica = familia.get(chave)
+            if metrica is None:
+                metrica = familia[chave] = criar()
+            if not isinstance(metrica, classe):
+                raise TypeError(f"Métrica {nome} já registrada como {type(metrica).__name__}")
+            return metrica
+
+    def contador(self, nome, descricao="", **rotulos):
+        return self._obter(Contador, nome, descricao, rotulos, Contador)
+
+    def medidor(self, nome, descricao="", funcao=None, **rotulos):
+        medidor = self._obter(Medidor, nome, descricao, rotulos, lambda: Medidor(funcao))
+        if funcao is not None:
+            medidor.funcao = funcao
+        return medidor
+
+    def histograma(self, nome, descricao="", limites=LIMITES_LATENCIA, **rotulos):
+        return self._obter(Histograma, nome, descricao, rotulos, lambda: Histograma(limites))
+
+    def total(self, nome, **filtro):
+        """Soma de um contador em todos os rótulos que casam com ``filtro``"""
+        filtro = set(_rotulos(filtro))
+        return sum(
+            metrica.valor for chave, metrica in self._familias.get(nome, {}).items()
+            if filtro <= set(chave)
+        )
+
+    def _itens(self):
+        with self._lock:
+            return [(nome, dict(familia)) for nome, familia in sorted(self._familias.items())]
+
+    def texto_prometheus(self):
+        linhas = []
+        for nome, familia in self._itens():
+            tipo = self.TIPOS[type(next(iter(familia.values())))]
+            if nome in self._descricoes:
+                linhas.append(f"# HELP {nome} {self._descricoes[nome]}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for rotulos, metrica in sorted(familia.items()):
+                if isinstance(metrica, Histograma):
+                    acumulado = 0
+                    for limite, contagem in zip(metrica.limites + (math.inf,), metrica.contagens):
+                        acumulado += contagem
+                        linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, [('le', _numero(limite))])} {acumulado}")
+                    linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {_numero(metrica.soma)}")
+                    linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {metrica.total}")
+                else:
+                    valor = metrica.ler() if isinstance(metrica, Medidor) else metrica.valor
+                    linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_numero(valor)}")
+        return "\n".join(linhas) + "\n"
+
+    def resumo(self):
+        resultado = {"duracao_segundos": round(time.time() - self.inicio, 3), "metricas": {}}
+        for nome, familia in self._itens():
+            series = []
+            for rotulos, metrica in sorted(familia.items()):
+                if isinstance(metrica, Histograma):
+                    valor = metrica.resumo()
+                elif isinstance(metrica, Medidor):
+                    valor = metrica.ler()
+                else:
+                    valor = metrica.valor
+                series.append({"rotulos": dict(rotulos), "valor": valor})
+            resultado["metricas"][nome] = series
+        return resultado
+
+    def salvar_resumo(self, caminho):
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with open(caminho, "w") as f:
+            json.dump(self.resumo(), f, indent=2, ensure_ascii=False)
+
+
+class ServidorMetricas:
+    """Servidor HTTP local que expõe ``/metrics`` (texto do Prometheus) e ``/metricas.json``"""
+
+    def __init__(self, metricas, porta, host="127.0.0.1"):
+        self.metricas = metricas
+        self.porta = porta
+        self.host = host
+        self._runner = None
+
+    async def _prometheus(self, request):
+        return web.Response(text=self.metricas.texto_prometheus(),
+                            content_type="text/plain", charset="utf-8")
+
+    async def _json(self, request):
+        return web.json_response(self.metricas.resumo())
+
+    async def abrir(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._prometheus)
+        app.router.add_get("/metricas.json", self._json)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.porta)
+        await site.start()
+        return self
+
+    async def fechar(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.abrir()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.fechar()
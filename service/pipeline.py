@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import deque
+
+from pool_trabalho import registrar_medidores
+
+logger = logging.getLogger("autofipe.pipeline")
+
+_FIM = object()
+
+
+class FilaPrioridade(asyncio.Queue):
+    """``asyncio.Queue`` limitada que entrega primeiro o item de maior ``pontuar(item)``.
+
+    Os itens ficam em um heap; empates saem na ordem de chegada e os sinais de
+    fim do pipeline saem depois de todos os itens.
+    """
+
+    def __init__(self, pontuar, maxsize=0):
+        self.pontuar = pontuar
+        self._sequencia = itertools.count()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = []
+
+    def _put(self, item):
+        prioridade = math.inf if item is _FIM else -self.pontuar(item)
+        heapq.heappush(self._queue, (prioridade, next(self._sequencia), item))
+
+    def _get(self):
+        return heapq.heappop(self._queue)[2]
+
+
+class FilaPonderada:
+    """Fila com uma subfila por ``chave(item)``, atendidas por round-robin ponderado.
+
+    Quando há itens de várias chaves, cada uma recebe uma fatia dos ``get()``
+    proporcional ao seu peso (round-robin ponderado suave, sem rajadas de uma
+    chave só); uma chave sem itens não segura as demais. Cada subfila tem o
+    seu próprio limite, então uma chave com muito trabalho não impede as
+    outras de entrar. Os sinais de fim do pipeline só saem depois de todos os itens.
+    Com ``prioridade``, cada subfila é uma ``FilaPrioridade``.
+    """
+
+    def __init__(self, chave, pesos=None, tamanho_por_chave=100, peso_padrao=1, prioridade=None):
+        self.chave = chave
+        self.pesos = pesos or {}
+        self.tamanho_por_chave = tamanho_por_chave
+        self.peso_padrao = peso_padrao
+        self.prioridade = prioridade
+        self._subfilas = {}
+        self._creditos = {}
+        self._fins = deque()
+        self._disponiveis = asyncio.Semaphore(0)
+
+    def _subfila(self, chave):
+        subfila = self._subfilas.get(chave)
+        if subfila is None:
+            if self.prioridade is not None:
+                subfila = FilaPrioridade(self.prioridade, self.tamanho_por_chave)
+            else:
+                subfila = asyncio.Queue(maxsize=self.tamanho_por_chave)
+            self._subfilas[chave] = subfila
+            self._creditos[chave] = 0
+        return subfila
+
+    async def put(self, item):
+        if item is _FIM:
+            self._fins.append(item)
+        else:
+            await self._subfila(self.chave(item)).put(item)
+        self._disponiveis.release()
+
+    def _escolher(self):
+        total = 0
+        escolhida = None
+        for chave, subfila in self._subfilas.items():
+            if subfila.empty():
+                continue
+            peso = self.pesos.get(chave, self.peso_padrao)
+            self._creditos[chave] += peso
+            total += peso
+            if escolhida is None or self._creditos[chave] > self._creditos[escolhida]:
+                escolhida = chave
+        if escolhida is not None:
+            self._creditos[escolhida] -= total
+        return escolhida
+
+    async def get(self):
+        await self._disponiveis.acquire()
+        chave = self._escolher()
+        if chave is None:
+            return self._fins.popleft()
+        return self._subfilas[chave].get_nowait()
+
+    def qsize(self):
+        return sum(subfila.qsize() for subfila in self._subfilas.values()) + len(self._fins)
+
+    def tamanhos(self):
+        return {chave: subfila.qsize() for chave, subfila in self._subfilas.items()}
+
+
+class Estagio:
+    """Um estágio do pipeline: ``concorrencia`` workers aplicando ``processar``.
+
+    ``processar(item)`` é uma corrotina que devolve um iterável de itens para o
+    próximo estágio (ou ``None``). Exceções contam como falha do item e não
+    interrompem o estágio.
+
+    Com ``chave_fila``, a fila do estágio é uma ``FilaPonderada`` com ``pesos``
+    por chave em vez de FIFO; com ``prioridade(item)``, os itens na fila (de
+    cada chave) saem da maior pontuação para a menor.
+    """
+
+    def __init__(self, nome, processar, concorrencia=1, tamanho_fila=100, chave_fila=None, pesos=None,
+                 prioridade=None):
+        self.nome = nome
+        self.processar = processar
+        self.concorrencia = concorrencia
+        tamanho = max(tamanho_fila, concorrencia)
+        if chave_fila is not None:
+            self.fila = FilaPonderada(chave_fila, pesos, tamanho, prioridade=prioridade)
+        elif prioridade is not None:
+            self.fila = FilaPrioridade(prioridade, tamanho)
+        else:
+            self.fila = asyncio.Queue(maxsize=tamanho)
+        self.processados = 0
+        self.falhas = 0
+        self.emitidos = 0
+        self.ativo = 0
+
+    def resumo(self, com_nome=True):
+        texto = (f"{self.processados} processados, {self.falhas} falhas, "
+                 f"{self.fila.qsize()} na fila, {self.ativo} em andamento")
+        return f"{self.nome}: {texto}" if com_nome else texto
+
+
+async def executar_pipeline(entradas, estagios, ao_concluir=None, metricas=None, ao_falhar=None):
+    """Liga os estágios por filas limitadas e processa ``entradas`` em uma única passada.
+
+    Cada item produzido por um estágio entra imediatamente na fila do próximo,
+    então os primeiros itens chegam ao último estágio enquanto os primeiros
+    ainda estão sendo expandidos. As filas limitadas aplicam contrapressão: um
+    estágio rápido espera o seguinte em vez de acumular itens em memória.
+    ``ao_concluir(estagio, item)`` é chamado após cada item processado e
+    ``ao_falhar(estagio, item, erro)`` após cada falha, antes dele.
+
+    Em cancelamento, todos os workers são cancelados e o cancelamento é propagado.
+    Com ``metricas``, cada estágio expõe a profundidade da sua fila e contadores.
+    """
+    inicio = time.monotonic()
+    if metricas is not None:
+        for estagio in estagios:
+            registrar_medidores(metricas, estagio.nome, fila=estagio.fila.qsize,
+                                em_andamento=lambda e=estagio: e.ativo,
+                                processados=lambda e=estagio: e.processados,
+                                falhas=lambda e=estagio: e.falhas)
+
+    async def alimentar():
+        for item in entradas:
+            await estagios[0].fila.put(item)
+        for _ in range(estagios[0].concorrencia):
+            await estagios[0].fila.put(_FIM)
+
+    async def worker(indice, estagio):
+        proximo = estagios[indice + 1] if indice + 1 < len(estagios) else None
+        while True:
+            item = await estagio.fila.get()
+            if item is _FIM:
+                return
+            estagio.ativo += 1
+            try:
+                saidas = await estagio.processar(item)
+                if proximo is not None and saidas:
+                    for saida in saidas:
+                        await proximo.fila.put(saida)
+                        estagio.emitidos += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                estagio.falhas += 1
+                logger.warning("erro_estagio estagio=%s erro=%s", estagio.nome, e)
+                if ao_falhar:
+                    ao_falhar(estagio, item, e)
+            finally:
+                estagio.ativo -= 1
+            estagio.processados += 1
+            if ao_concluir:
+                ao_concluir(estagio, item)
+
+    async def executar_estagio(indice, estagio):
+        await asyncio.gather(*(worker(indice, estagio) for _ in range(estagio.concorrencia)))
+        # Todos os workers deste estágio terminaram: encerra o próximo
+        if indice + 1 < len(estagios):
+            proximo = estagios[indice + 1]
+            for _ in range(proximo.concorrencia):
+                await proximo.fila.put(_FIM)
+
+    tarefas = [asyncio.create_task(alimentar())]
+    tarefas += [asyncio.create_task(executar_estagio(i, e)) for i, e in enumerate(estagios)]
+    try:
+        await asyncio.gather(*tarefas)
+    except BaseException:
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        raise
+    return time.monotonic() - inicio
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("autofipe.pool")
+
+
+class ProgressoOrdenado:
+    """Contabiliza itens concluídos fora de ordem.
+
+    ``concluidos`` conta tudo o que terminou; ``marca_agua`` é o maior índice
+    ``k`` tal que todos os itens ``1..k`` já terminaram, o que permite saber até
+    onde a execução está garantidamente completa mesmo com vários workers.
+    """
+
+    def __init__(self, total=None):
+        self.total = total
+        self.concluidos = 0
+        self.falhas = 0
+        self.marca_agua = 0
+        self._pendentes = set()
+        self.inicio = time.monotonic()
+
+    def registrar(self, indice, sucesso=True):
+        self.concluidos += 1
+        if not sucesso:
+            self.falhas += 1
+        if indice == self.marca_agua + 1:
+            self.marca_agua = indice
+            while self.marca_agua + 1 in self._pendentes:
+                self.marca_agua += 1
+                self._pendentes.discard(self.marca_agua)
+        else:
+            self._pendentes.add(indice)
+
+    @property
+    def itens_por_segundo(self):
+        duracao = time.monotonic() - self.inicio
+        return self.concluidos / duracao if duracao > 0 else 0.0
+
+
+async def executar_pool(itens, processar, concorrencia=8, total=None,
+                        ao_concluir=None, tamanho_fila=None, tempo_drenagem=10,
+                        metricas=None, nome="pool"):
+    """Processa ``itens`` com ``concorrencia`` workers lendo de uma ``asyncio.Queue``.
+
+    A fila é limitada, então ``itens`` pode ser um gerador: o produtor só avança
+    conforme os workers consomem. ``processar(item)`` deve ser uma corrotina; um
+    retorno falso ou uma exceção conta como falha sem derrubar o pool.
+    ``ao_concluir(indice, item, progresso)`` é chamado após cada item.
+
+    Em cancelamento (Ctrl-C), o produtor para, os itens ainda na fila são
+    descartados e os que estão em andamento têm ``tempo_drenagem`` segundos para
+    terminar antes de serem cancelados. O cancelamento é então propagado.
+
+    Com ``metricas``, expõe a profundidade da fila e os contadores do pool com o
+    rótulo ``estagio=nome``.
+    """
+    progresso = ProgressoOrdenado(total)
+    # Espaço para ao menos um sinal de fim por worker
+    fila = asyncio.Queue(maxsize=max(tamanho_fila or concorrencia * 4, concorrencia))
+    em_andamento = set()
+    if metricas is not None:
+        registrar_medidores(metricas, nome, fila=fila.qsize, em_andamento=lambda: len(em_andamento),
+                            processados=lambda: progresso.concluidos, falhas=lambda: progresso.falhas)
+
+    async def produtor():
+        for indice, item in enumerate(itens, 1):
+            await fila.put((indice, item))
+        for _ in range(concorrencia):
+            await fila.put(None)
+
+    async def worker():
+        while True:
+            entrada = await fila.get()
+            try:
+                if entrada is None:
+                    return
+                indice, item = entrada
+                em_andamento.add(indice)
+                try:
+                    sucesso = await processar(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("erro_item indice=%d erro=%s", indice, e)
+                    sucesso = False
+                finally:
+                    em_andamento.discard(indice)
+                progresso.registrar(indice, bool(sucesso))
+                if ao_concluir:
+                    ao_concluir(indice, item, progresso)
+            finally:
+                fila.task_done()
+
+    tarefa_produtor = asyncio.create_task(produtor())
+    workers = [asyncio.create_task(worker()) for _ in range(concorrencia)]
+    try:
+        # asyncio.wait (e não gather) para que um cancelamento não derrube os workers de imediato
+        await asyncio.wait([tarefa_produtor, *workers], return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        tarefa_produtor.cancel()
+        descartados = _drenar_fila(fila)
+        print(f"\n⏹️ Cancelamento solicitado: {descartados} itens descartados da fila, "
+              f"aguardando {len(em_andamento)} em andamento...")
+        # Sinaliza fim para os workers que ficarem ociosos
+        for _ in workers:
+            fila.put_nowait(None)
+        _, pendentes = await asyncio.wait(workers, timeout=tempo_drenagem)
+        for tarefa in pendentes:
+            tarefa.cancel()
+        await asyncio.gather(tarefa_produtor, *workers, return_exceptions=True)
+        print(f"Pool encerrado: {progresso.concluidos} concluídos, "
+              f"completo até o item {progresso.marca_agua}.")
+        raise
+
+    if tarefa_produtor.done() and tarefa_produtor.exception():
+        # Erro ao gerar itens: encerra os workers e propaga
+        for tarefa in workers:
+            tarefa.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise tarefa_produtor.exception()
+    return progresso
+
+
+def registrar_medidores(metricas, estagio, fila, em_andamento, processados, falhas):
+    """Medidores de um estágio/pool, lidos só quando as métricas são exportadas"""
+    metricas.medidor("estagio_fila", "Itens aguardando na fila do estágio", funcao=fila, estagio=estagio)
+    metricas.medidor("estagio_em_andamento", "Itens sendo processados", funcao=em_andamento, estagio=estagio)
+    metricas.medidor("estagio_processados", "Itens processados", funcao=processados, estagio=estagio)
+    metricas.medidor("estagio_falhas", "Itens com falha", funcao=falhas, estagio=estagio)
+
+
+def _drenar_fila(fila):
+    descartados = 0
+    while True:
+        try:
+            fila.get_nowait()
+        except asyncio.QueueEmpty:
+            return descartados
+        fila.task_done()
+        descartados += 1
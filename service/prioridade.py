@@ -0,0 +1,131 @@
+import json
+import math
+import time
+
+from catalogo import ANO_ZERO_KM, ano_modelo, ler_paginas
+
+
+class Prioridade:
+    """Pontuação de marcas, modelos e anos; quanto maior, mais cedo o item é coletado.
+
+    Uma fonte de pontuação implementa os níveis que conhece e herda 0 nos
+    demais. ``preco(item)`` pontua um ``ItemPreco`` a partir do modelo e do ano.
+    """
+
+    def marca(self, marca):
+        return 0.0
+
+    def modelo(self, modelo):
+        return 0.0
+
+    def ano(self, modelo, ano):
+        return 0.0
+
+    def preco(self, item):
+        return self.modelo(item.modelo) + self.ano(item.modelo, item.ano)
+
+
+def _chave(item):
+    return f"{item.get('tipo_veiculo', 1)}:{item['Value']}"
+
+
+class Popularidade(Prioridade):
+    """Popularidade lida de um arquivo JSON, ex. consultas dos usuários por marca e modelo::
+
+        {"marcas": {"1:59": 5400}, "modelos": {"1:5585": 900, "2:7710": 40}}
+
+    As chaves são ``tipo_veiculo:codigo``; a pontuação é ``log1p`` da contagem,
+    para que poucos modelos muito consultados não anulem os outros critérios.
+    """
+
+    def __init__(self, marcas=None, modelos=None):
+        self.marcas = {chave: math.log1p(valor) for chave, valor in (marcas or {}).items()}
+        self.modelos = {chave: math.log1p(valor) for chave, valor in (modelos or {}).items()}
+
+    @classmethod
+    def de_arquivo(cls, caminho):
+        with open(caminho) as f:
+            dados = json.load(f)
+        return cls(dados.get("marcas"), dados.get("modelos"))
+
+    def marca(self, marca):
+        return self.marcas.get(_chave(marca), 0.0)
+
+    def modelo(self, modelo):
+        return self.modelos.get(_chave(modelo), 0.0)
+
+
+class RecenciaAno(Prioridade):
+    """Anos modelo mais novos primeiro: 0 para ``ano_inicial``, 1 para o ano atual e zero km"""
+
+    def __init__(self, ano_inicial=1990, ano_atual=None):
+        self.ano_inicial = ano_inicial
+        self.ano_atual = ano_atual or time.localtime().tm_year
+
+    def ano(self, modelo, ano):
+        valor = ano_modelo(ano['codigo'])
+        if valor is None:
+            return 0.0
+        if valor == ANO_ZERO_KM:
+            return 1.0
+        return max(0.0, min(1.0, (valor - self.ano_inicial) / (self.ano_atual - self.ano_inicial)))
+
+
+class Desatualizacao(Prioridade):
+    """Preços há mais tempo sem atualização primeiro: meses desde o último preço, até ``limite``, de 0 a 1.
+
+    ``ultimos`` mapeia o id de anos_modelo para o último mes_referencia_id com
+    preço; um ano sem preço na janela conta como o mais desatualizado.
+    """
+
+    def __init__(self, ultimos, mes_atual, limite=12):
+        self.ultimos = ultimos
+        self.mes_atual = int(mes_atual)
+        self.limite = limite
+
+    def ano(self, modelo, ano):
+        ultimo = self.ultimos.get(ano.get('id'))
+        if ultimo is None:
+            return 1.0
+        return min(self.mes_atual - ultimo, self.limite) / self.limite
+
+
+async def carregar_desatualizacao(armazenamento, mes_atual, limite=12, tamanho_pagina=1000):
+    """Último mês com preço de cada ano_id (em veiculos ou, no modo delta, em veiculos_inalterados)"""
+    mes_atual = int(mes_atual)
+    na_janela = lambda c: c.gte('mes_referencia_id', mes_atual - limite).lt('mes_referencia_id', mes_atual)
+    ultimos = {}
+
+    def registrar(ano_id, mes):
+        if mes > ultimos.get(ano_id, -1):
+            ultimos[ano_id] = mes
+
+    async for pagina in ler_paginas(armazenamento, 'veiculos', ('id', 'ano_id', 'mes_referencia_id'), 'id',
+                                    tamanho_pagina, filtro=na_janela):
+        for linha in pagina:
+            registrar(linha['ano_id'], linha['mes_referencia_id'])
+    async for pagina in ler_paginas(armazenamento, 'veiculos_inalterados', ('lote', 'mes_referencia_id', 'ano_ids'),
+                                    'lote', tamanho_pagina, filtro=na_janela):
+        for linha in pagina:
+            for ano_id in linha['ano_ids']:
+                registrar(ano_id, linha['mes_referencia_id'])
+    return Desatualizacao(ultimos, mes_atual, limite)
+
+
+class PrioridadeComposta(Prioridade):
+    """Soma ponderada de várias fontes de pontuação: ``[(fonte, peso), ...]``"""
+
+    def __init__(self, fontes):
+        self.fontes = [(fonte, peso) for fonte, peso in fontes if peso]
+
+    def marca(self, marca):
+        return sum(peso * fonte.marca(marca) for fonte, peso in self.fontes)
+
+    def modelo(self, modelo):
+        return sum(peso * fonte.modelo(modelo) for fonte, peso in self.fontes)
+
+    def ano(self, modelo, ano):
+        return sum(peso * fonte.ano(modelo, ano) for fonte, peso in self.fontes)
+
+    def descricao(self):
+        return ", ".join(f"{type(fonte).__name__} x{peso}" for fonte, peso in self.fontes) or "ordem da API"
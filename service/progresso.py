@@ -0,0 +1,125 @@
+import sys
+import time
+from collections import deque
+
+
+class RelatorioProgresso:
+    """Painel de progresso que redesenha no máximo ``max_por_segundo`` vezes por segundo.
+
+    Chamar ``atualizar()`` a cada item é barato: só guarda o estado e, se já
+    passou o intervalo mínimo, redesenha o painel no lugar usando códigos ANSI
+    (sem ``os.system('clear')``). Fora de um terminal (saída redirecionada),
+    escreve uma linha a cada ``intervalo_sem_tty`` segundos.
+
+    A velocidade (itens/s) é calculada sobre os últimos ``janela`` segundos e
+    usada para estimar o tempo restante. ``fonte_extras`` é uma função que
+    devolve linhas extras (dict) e só é chamada quando o painel é desenhado.
+    """
+
+    def __init__(self, titulo, total=None, max_por_segundo=4, janela=30.0,
+                 intervalo_sem_tty=10.0, saida=None, fonte_extras=None):
+        self.titulo = titulo
+        self.fonte_extras = fonte_extras
+        self.total = total
+        self.saida = saida or sys.stdout
+        self.tty = hasattr(self.saida, "isatty") and self.saida.isatty()
+        self.intervalo = 1 / max_por_segundo if self.tty else intervalo_sem_tty
+        self.janela = janela
+        self.concluidos = 0
+        self.falhas = 0
+        self.detalhe = ""
+        self.extras = {}
+        self.inicio = time.monotonic()
+        self._ultimo_desenho = 0.0
+        self._linhas_desenhadas = 0
+        self._amostras = deque([(self.inicio, 0)])
+        self.desenhos = 0
+
+    def atualizar(self, concluidos=None, falhas=None, total=None, detalhe=None, extras=None):
+        if concluidos is not None:
+            self.concluidos = concluidos
+        if falhas is not None:
+            self.falhas = falhas
+        if total is not None:
+            self.total = total
+        if detalhe is not None:
+            self.detalhe = detalhe
+        if extras:
+            self.extras.update(extras)
+        agora = time.monotonic()
+        if agora - self._ultimo_desenho >= self.intervalo:
+            self._desenhar(agora)
+
+    def incrementar(self, sucesso=True, detalhe=None, extras=None):
+        self.atualizar(self.concluidos + 1, self.falhas + (0 if sucesso else 1), detalhe=detalhe, extras=extras)
+
+    def velocidade(self, agora=None):
+        agora = agora or time.monotonic()
+        self._amostras.append((agora, self.concluidos))
+        while len(self._amostras) > 2 and agora - self._amostras[0][0] > self.janela:
+            self._amostras.popleft()
+        t0, c0 = self._amostras[0]
+        return (self.concluidos - c0) / (agora - t0) if agora > t0 else 0.0
+
+    def eta(self, velocidade):
+        if not self.total or velocidade <= 0:
+            return None
+        return max(0, self.total - self.concluidos) / velocidade
+
+    def linhas(self, agora=None):
+        agora = agora or time.monotonic()
+        velocidade = self.velocidade(agora)
+        eta = self.eta(velocidade)
+        if self.total:
+            percentual = self.concluidos / self.total * 100
+            contagem = f"{self.concluidos}/{self.total} ({percentual:.1f}%)"
+        else:
+            contagem = str(self.concluidos)
+        resumo = (f"{contagem} | falhas: {self.falhas} | {velocidade:.2f} itens/s"
+                  f" | ETA: {formatar_duracao(eta)} | decorrido: {formatar_duracao(agora - self.inicio)}")
+        linhas = [f"=== {self.titulo} ===", resumo]
+        extras = dict(self.extras)
+        if self.fonte_extras:
+            extras.update(self.fonte_extras())
+        linhas += [f"{chave}: {valor}" for chave, valor in extras.items()]
+        if self.detalhe:
+            linhas.append(self.detalhe)
+        return linhas
+
+    def _desenhar(self, agora):
+        self._ultimo_desenho = agora
+        self.desenhos += 1
+        linhas = self.linhas(agora)
+        if not self.tty:
+            self.saida.write(" | ".join(linhas) + "\n")
+            self.saida.flush()
+            return
+        texto = ""
+        if self._linhas_desenhadas:
+            # Volta o cursor para o início do painel anterior e o sobrescreve
+            texto += f"\x1b[{self._linhas_desenhadas}F"
+        texto += "".join(f"\x1b[2K{linha}\n" for linha in linhas)
+        # Limpa linhas que sobraram de um painel maior
+        sobra = self._linhas_desenhadas - len(linhas)
+        if sobra > 0:
+            texto += "\x1b[2K\n" * sobra + f"\x1b[{sobra}F"
+        self._linhas_desenhadas = len(linhas)
+        self.saida.write(texto)
+        self.saida.flush()
+
+    def finalizar(self):
+        self._desenhar(time.monotonic())
+        self._linhas_desenhadas = 0
+
+
+def formatar_duracao(segundos):
+    if segundos is None:
+        return "--"
+    segundos = int(segundos)
+    horas, resto = divmod(segundos, 3600)
+    minutos, segundos = divmod(resto, 60)
+    if horas:
+        return f"{horas}h{minutos:02d}m"
+    if minutos:
+        return f"{minutos}m{segundos:02d}s"
+    return f"{segundos}s"
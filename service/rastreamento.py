@@ -0,0 +1,231 @@
+"""Rastreamento (spans) e perfil por amostragem de uma execução do scraper.
+
+Com o rastreamento ligado, cada ``with span("nome", chave=valor):`` vira um
+evento "X" no formato Chrome trace (abre em https://ui.perfetto.dev ou em
+chrome://tracing), com uma linha por tarefa asyncio ou thread:
+
+    with span("http", "fipe", endpoint=endpoint):
+        ...
+
+``registrar`` grava um intervalo já medido e ``@rastreado`` envolve uma corrotina inteira.
+
+Desligado (o padrão), ``span`` devolve sempre o mesmo contexto vazio, então o
+custo em cada ponto instrumentado é uma chamada de função.
+
+``AmostradorPerfil`` é um perfil por amostragem com duração limitada: uma
+thread lê a pilha da thread do event loop a cada ``intervalo`` segundos e, ao
+fim da janela, grava as pilhas no formato "collapsed" (uma linha
+``a;b;c contagem``), que o speedscope e o flamegraph.pl abrem.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+
+_rastreador = None
+
+
+class _Nulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULO = _Nulo()
+
+
+class _Span:
+    __slots__ = ('rastreador', 'nome', 'categoria', 'args', 'inicio', 'tid')
+
+    def __init__(self, rastreador, nome, categoria, args):
+        self.rastreador = rastreador
+        self.nome = nome
+        self.categoria = categoria
+        self.args = args
+
+    def __enter__(self):
+        self.tid = self.rastreador.tid_atual()
+        self.inicio = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['erro'] = exc_type.__name__
+        self.rastreador.adicionar(self.nome, self.categoria, self.inicio, time.perf_counter_ns(), self.tid,
+                                  self.args)
+        return False
+
+
+class Rastreador:
+    """Guarda os spans em memória, até ``max_eventos`` (os seguintes são só contados)"""
+
+    def __init__(self, max_eventos=1_000_000):
+        self.max_eventos = max_eventos
+        self.eventos = []
+        self.descartados = 0
+        self.origem = time.perf_counter_ns()
+        self._tids = {}
+        self._nomes = {}
+
+    def tid_atual(self):
+        """Uma linha por tarefa asyncio (ou por thread, fora do event loop)"""
+        try:
+            tarefa = asyncio.current_task()
+        except RuntimeError:
+            tarefa = None
+        chave = id(tarefa) if tarefa is not None else threading.get_ident()
+        tid = self._tids.get(chave)
+        if tid is None:
+            tid = self._tids[chave] = len(self._tids) + 1
+            self._nomes[tid] = tarefa.get_name() if tarefa is not None else threading.current_thread().name
+        return tid
+
+    def adicionar(self, nome, categoria, inicio_ns, fim_ns, tid=None, args=None):
+        if len(self.eventos) >= self.max_eventos:
+            self.descartados += 1
+            return
+        # list.append é atômico: as threads do banco também registram aqui
+        self.eventos.append((nome, categoria, inicio_ns, fim_ns, tid if tid is not None else self.tid_atual(),
+                             args))
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        eventos = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': nome}}
+                   for tid, nome in self._nomes.items()]
+        for nome, categoria, inicio, fim, tid, args in self.eventos:
+            evento = {'name': nome, 'cat': categoria, 'ph': 'X', 'pid': pid, 'tid': tid,
+                      'ts': (inicio - self.origem) / 1000, 'dur': (fim - inicio) / 1000}
+            if args:
+                evento['args'] = {chave: valor if isinstance(valor, (int, float, bool)) or valor is None
+                                  else str(valor) for chave, valor in args.items()}
+            eventos.append(evento)
+        return {'traceEvents': eventos, 'displayTimeUnit': 'ms',
+                'otherData': {'descartados': self.descartados}}
+
+    def salvar(self, caminho):
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with open(caminho, "w") as f:
+            json.dump(self.chrome_trace(), f, separators=(",", ":"))
+
+    def resumo(self):
+        """{nome: (quantidade, segundos somados)}, do maior tempo para o menor.
+
+        Spans de tarefas concorrentes se sobrepõem, então a soma de um nome pode
+        passar da duração da execução.
+        """
+        totais = {}
+        for nome, _, inicio, fim, _, _ in self.eventos:
+            quantidade, soma = totais.get(nome, (0, 0))
+            totais[nome] = (quantidade + 1, soma + fim - inicio)
+        return {nome: (quantidade, soma / 1e9)
+                for nome, (quantidade, soma) in sorted(totais.items(), key=lambda item: -item[1][1])}
+
+
+def span(nome, categoria="autofipe", **args):
+    if _rastreador is None:
+        return _NULO
+    return _Span(_rastreador, nome, categoria, args)
+
+
+def rastreado(nome, categoria="autofipe"):
+    """Decorador de corrotinas: a chamada inteira vira um span ``nome``"""
+    def decorador(funcao):
+        @wraps(funcao)
+        async def envolvida(*args, **kwargs):
+            if _rastreador is None:
+                return await funcao(*args, **kwargs)
+            with _Span(_rastreador, nome, categoria, {}):
+                return await funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def registrar(nome, inicio, fim, categoria="autofipe", **args):
+    """Registra um intervalo já medido com ``time.perf_counter()`` (em segundos)"""
+    if _rastreador is not None:
+        _rastreador.adicionar(nome, categoria, int(inicio * 1e9), int(fim * 1e9), None, args)
+
+
+def ativo():
+    return _rastreador is not None
+
+
+def iniciar(max_eventos=1_000_000):
+    global _rastreador
+    _rastreador = Rastreador(max_eventos)
+    return _rastreador
+
+
+def finalizar(caminho=None):
+    """Desliga o rastreamento e grava o trace em ``caminho``; devolve o ``Rastreador``"""
+    global _rastreador
+    rastreador, _rastreador = _rastreador, None
+    if rastreador is not None and caminho:
+        rastreador.salvar(caminho)
+    return rastreador
+
+
+class AmostradorPerfil:
+    """Perfil por amostragem de ``duracao`` segundos da thread ``alvo`` (padrão: a que o inicia)"""
+
+    def __init__(self, caminho, duracao=30.0, intervalo=0.005, alvo=None, profundidade=64):
+        self.caminho = caminho
+        self.duracao = duracao
+        self.intervalo = intervalo
+        self.alvo = alvo if alvo is not None else threading.get_ident()
+        self.profundidade = profundidade
+        self.pilhas = {}
+        self.amostras = 0
+        self._parar = threading.Event()
+        self._thread = None
+
+    @property
+    def em_andamento(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self):
+        if self.em_andamento:
+            return False
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._amostrar, name="perfil", daemon=True)
+        self._thread.start()
+        return True
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _pilha(self, quadro):
+        nomes = []
+        while quadro is not None and len(nomes) < self.profundidade:
+            codigo = quadro.f_code
+            nomes.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+            quadro = quadro.f_back
+        return ";".join(reversed(nomes))
+
+    def _amostrar(self):
+        fim = time.monotonic() + self.duracao
+        while not self._parar.is_set() and time.monotonic() < fim:
+            quadro = sys._current_frames().get(self.alvo)
+            if quadro is not None:
+                pilha = self._pilha(quadro)
+                self.pilhas[pilha] = self.pilhas.get(pilha, 0) + 1
+                self.amostras += 1
+            del quadro
+            self._parar.wait(self.intervalo)
+        self._salvar()
+
+    def _salvar(self):
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        with open(self.caminho, "w") as f:
+            for pilha, contagem in sorted(self.pilhas.items(), key=lambda item: -item[1]):
+                f.write(f"{pilha} {contagem}\n")
+        print(f"Perfil: {self.amostras} amostras em {self.caminho}")
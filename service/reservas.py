@@ -0,0 +1,215 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from contextlib import closing
+
+
+def bloco_de(codigo, blocos):
+    """Bloco de um código (marca ou modelo). crc32 e não ``hash()``, que muda a cada processo."""
+    return zlib.crc32(str(codigo).encode()) % blocos
+
+
+class Reserva:
+    __slots__ = ('chave', 'mes', 'bloco', 'token', 'tentativas')
+
+    def __init__(self, chave, mes, bloco, token, tentativas):
+        self.chave = chave
+        self.mes = mes
+        self.bloco = bloco
+        self.token = token
+        self.tentativas = tentativas
+
+    def __repr__(self):
+        return f"Reserva({self.chave}, tentativa {self.tentativas})"
+
+
+class ReservasSqlite:
+    """Tabela de reservas de blocos de trabalho em um arquivo SQLite compartilhado.
+
+    Serve para vários processos na mesma máquina. Cada bloco ``(mes, bloco)``
+    passa por pendente -> reservado -> concluido. ``reservar`` pega, em uma
+    transação exclusiva, um bloco pendente ou cuja reserva expirou (trabalhador
+    que caiu ou travou) de um dos ``meses`` pedidos; ``renovar`` estende o prazo
+    e ``liberar`` conclui ou devolve o bloco. Renovar e liberar só valem com o
+    ``token`` da reserva, então um trabalhador que perdeu o bloco não
+    sobrescreve quem o pegou depois.
+
+    Um bloco que já foi tentado ``max_tentativas`` vezes sem concluir vai para
+    o estado falho e não é mais reservado (veja o readme para devolvê-lo à fila).
+    """
+
+    def __init__(self, caminho, max_tentativas=5):
+        self.caminho = caminho
+        self.max_tentativas = max_tentativas
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with closing(self._conectar()) as conexao:
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS blocos_trabalho (
+                    chave TEXT PRIMARY KEY,
+                    mes INTEGER NOT NULL,
+                    bloco INTEGER NOT NULL,
+                    estado TEXT NOT NULL DEFAULT 'pendente',
+                    trabalhador TEXT,
+                    token TEXT,
+                    expira_em REAL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    concluido_em REAL
+                )
+            """)
+
+    def _conectar(self):
+        # Uma conexão por operação: as chamadas rodam em threads do executor
+        return sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+
+    def _criar_blocos(self, mes, quantidade):
+        with closing(self._conectar()) as conexao:
+            conexao.executemany(
+                "INSERT OR IGNORE INTO blocos_trabalho (chave, mes, bloco) VALUES (?, ?, ?)",
+                [(f"{mes}:{bloco}", int(mes), bloco) for bloco in range(quantidade)],
+            )
+
+    def _reservar(self, trabalhador, ttl, meses=None):
+        agora = time.time()
+        filtro_meses, parametros = "", [agora, self.max_tentativas]
+        if meses is not None:
+            filtro_meses = f" AND mes IN ({', '.join('?' * len(meses))})"
+            parametros += [int(mes) for mes in meses]
+        conexao = self._conectar()
+        try:
+            conexao.execute("BEGIN IMMEDIATE")
+            # Reservas expiradas que já esgotaram as tentativas (o trabalhador caiu em todas)
+            conexao.execute(
+                """UPDATE blocos_trabalho SET estado = 'falho', token = NULL, expira_em = NULL
+                   WHERE estado = 'reservado' AND expira_em < ? AND tentativas >= ?""",
+                (agora, self.max_tentativas),
+            )
+            linha = conexao.execute(
+                f"""SELECT chave, mes, bloco, tentativas FROM blocos_trabalho
+                    WHERE (estado = 'pendente' OR (estado = 'reservado' AND expira_em < ?))
+                      AND tentativas < ?{filtro_meses}
+                    ORDER BY tentativas, mes DESC, bloco LIMIT 1""",
+                parametros,
+            ).fetchone()
+            if linha is None:
+                conexao.execute("COMMIT")
+                return None
+            chave, mes, bloco, tentativas = linha
+            token = uuid.uuid4().hex
+            conexao.execute(
+                """UPDATE blocos_trabalho SET estado = 'reservado', trabalhador = ?, token = ?,
+                   expira_em = ?, tentativas = tentativas + 1 WHERE chave = ?""",
+                (trabalhador, token, agora + ttl, chave),
+            )
+            conexao.execute("COMMIT")
+            return Reserva(chave, mes, bloco, token, tentativas + 1)
+        except BaseException:
+            if conexao.in_transaction:
+                conexao.execute("ROLLBACK")
+            raise
+        finally:
+            conexao.close()
+
+    def _renovar(self, reserva, ttl):
+        with closing(self._conectar()) as conexao:
+            cursor = conexao.execute(
+                "UPDATE blocos_trabalho SET expira_em = ? WHERE chave = ? AND token = ? AND estado = 'reservado'",
+                (time.time() + ttl, reserva.chave, reserva.token),
+            )
+            return cursor.rowcount == 1
+
+    def _liberar(self, reserva, concluido, interrompido=False):
+        with closing(self._conectar()) as conexao:
+            if concluido:
+                cursor = conexao.execute(
+                    """UPDATE blocos_trabalho SET estado = 'concluido', concluido_em = ?, expira_em = NULL
+                       WHERE chave = ? AND token = ?""",
+                    (time.time(), reserva.chave, reserva.token),
+                )
+            else:
+                # Uma interrupção (Ctrl-C) não gasta a tentativa
+                cursor = conexao.execute(
+                    """UPDATE blocos_trabalho
+                       SET estado = CASE WHEN ? = 0 AND tentativas >= ? THEN 'falho' ELSE 'pendente' END,
+                           tentativas = tentativas - ?, trabalhador = NULL, token = NULL, expira_em = NULL
+                       WHERE chave = ? AND token = ?""",
+                    (int(interrompido), self.max_tentativas, int(interrompido), reserva.chave, reserva.token),
+                )
+            return cursor.rowcount == 1
+
+    def _resumo(self):
+        with closing(self._conectar()) as conexao:
+            return dict(conexao.execute("SELECT estado, COUNT(*) FROM blocos_trabalho GROUP BY estado"))
+
+    async def criar_blocos(self, mes, quantidade):
+        await asyncio.to_thread(self._criar_blocos, mes, quantidade)
+
+    async def reservar(self, trabalhador, ttl, meses=None):
+        return await asyncio.to_thread(self._reservar, trabalhador, ttl, meses)
+
+    async def renovar(self, reserva, ttl):
+        return await asyncio.to_thread(self._renovar, reserva, ttl)
+
+    async def liberar(self, reserva, concluido, interrompido=False):
+        return await asyncio.to_thread(self._liberar, reserva, concluido, interrompido)
+
+    async def resumo(self):
+        return await asyncio.to_thread(self._resumo)
+
+
+class ReservasSupabase:
+    """A mesma tabela de reservas no Postgres do Supabase, para trabalhadores em várias máquinas.
+
+    Reservar, renovar e liberar são funções SQL (veja o readme): a reserva usa
+    ``FOR UPDATE SKIP LOCKED``, então dois trabalhadores nunca pegam o mesmo bloco.
+    """
+
+    def __init__(self, armazenamento, max_tentativas=5):
+        self.armazenamento = armazenamento
+        self.max_tentativas = max_tentativas
+
+    async def _rpc(self, nome, parametros):
+        resposta = await self.armazenamento.executar(
+            lambda db: db.rpc(nome, parametros).execute(), tabela='blocos_trabalho', operacao=nome,
+        )
+        return resposta.data
+
+    async def criar_blocos(self, mes, quantidade):
+        linhas = [{"chave": f"{mes}:{bloco}", "mes": int(mes), "bloco": bloco} for bloco in range(quantidade)]
+        await self.armazenamento.executar(
+            lambda db: db.table('blocos_trabalho').upsert(linhas, on_conflict='chave', ignore_duplicates=True).execute(),
+            tabela='blocos_trabalho', operacao='upsert',
+        )
+
+    async def reservar(self, trabalhador, ttl, meses=None):
+        linhas = await self._rpc('reservar_bloco', {
+            "p_trabalhador": trabalhador, "p_ttl": int(ttl), "p_max_tentativas": self.max_tentativas,
+            "p_meses": [int(mes) for mes in meses] if meses is not None else None,
+        })
+        if not linhas:
+            return None
+        linha = linhas[0]
+        return Reserva(linha['chave'], linha['mes'], linha['bloco'], linha['token'], linha['tentativas'])
+
+    async def renovar(self, reserva, ttl):
+        return bool(await self._rpc('renovar_reserva',
+                                    {"p_chave": reserva.chave, "p_token": reserva.token, "p_ttl": int(ttl)}))
+
+    async def liberar(self, reserva, concluido, interrompido=False):
+        return bool(await self._rpc('liberar_reserva', {
+            "p_chave": reserva.chave, "p_token": reserva.token, "p_concluido": concluido,
+            "p_interrompido": interrompido, "p_max_tentativas": self.max_tentativas,
+        }))
+
+    async def resumo(self):
+        resposta = await self.armazenamento.executar(
+            lambda db: db.table('blocos_trabalho').select('estado').execute(),
+            tabela='blocos_trabalho', operacao='select',
+        )
+        contagem = {}
+        for linha in resposta.data or []:
+            contagem[linha['estado']] = contagem.get(linha['estado'], 0) + 1
+        return contagem
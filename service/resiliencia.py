@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger("autofipe.resiliencia")
+
+FECHADO, MEIO_ABERTO, ABERTO = "fechado", "meio_aberto", "aberto"
+
+
+class FalhaRequisicao(Exception):
+    """A requisição à FIPE falhou em todas as tentativas (429, erro ou timeout)"""
+
+
+class RequisicaoLimitada(Exception):
+    """A FIPE respondeu 429 a uma tentativa"""
+
+
+class Disjuntor:
+    """Circuit breaker compartilhado por todas as requisições à FIPE.
+
+    Guarda o resultado das últimas ``janela`` requisições; quando pelo menos
+    ``minimo`` foram registradas e a fração de falhas (429, 5xx, timeout ou erro
+    de conexão) chega a ``limiar``, o circuito abre e ``aguardar()`` segura
+    todos os workers por ``pausa_inicial`` segundos, em vez de cada um insistir
+    sozinho. Depois da pausa uma única requisição de sondagem passa: sucesso
+    fecha o circuito, falha o abre de novo com o dobro da pausa (até ``pausa_max``).
+    """
+
+    def __init__(self, janela=20, minimo=10, limiar=0.5, pausa_inicial=5.0, pausa_max=300.0,
+                 prazo_sondagem=60.0, metricas=None):
+        self.janela = janela
+        self.minimo = minimo
+        self.limiar = limiar
+        self.pausa_inicial = pausa_inicial
+        self.pausa_max = pausa_max
+        self.prazo_sondagem = prazo_sondagem
+        self.estado = FECHADO
+        self.resultados = deque(maxlen=janela)
+        self.falhas = 0
+        self.aberturas = 0
+        self.aberturas_seguidas = 0
+        self.reabre_em = 0.0
+        self._sondagem_desde = None
+        self.metricas = metricas
+        if metricas is not None:
+            metricas.medidor("disjuntor_estado", "Circuito da API: 0 fechado, 1 meio aberto, 2 aberto",
+                             funcao=lambda: (FECHADO, MEIO_ABERTO, ABERTO).index(self.estado))
+
+    async def aguardar(self):
+        """Retorna quando a requisição pode ser feita"""
+        while True:
+            if self.estado == FECHADO:
+                return
+            agora = time.monotonic()
+            if self.estado == ABERTO:
+                if agora < self.reabre_em:
+                    await asyncio.sleep(self.reabre_em - agora)
+                    continue
+                self.estado = MEIO_ABERTO
+                self._sondagem_desde = None
+            # Meio aberto: só uma sondagem por vez (ou outra, se a anterior sumiu sem resultado)
+            if self._sondagem_desde is None or agora - self._sondagem_desde > self.prazo_sondagem:
+                self._sondagem_desde = agora
+                return
+            await asyncio.sleep(0.25)
+
+    def registrar(self, sucesso):
+        if self.estado == MEIO_ABERTO:
+            if sucesso:
+                self._fechar()
+            else:
+                self._abrir()
+            return
+        if self.estado == ABERTO:
+            # Resposta de uma requisição que saiu antes da abertura
+            return
+        if len(self.resultados) == self.resultados.maxlen and not self.resultados[0]:
+            self.falhas -= 1
+        self.resultados.append(sucesso)
+        if not sucesso:
+            self.falhas += 1
+            if len(self.resultados) >= self.minimo and self.falhas / len(self.resultados) >= self.limiar:
+                self._abrir()
+
+    def _abrir(self):
+        pausa = min(self.pausa_max, self.pausa_inicial * 2 ** self.aberturas_seguidas)
+        self.estado = ABERTO
+        self.reabre_em = time.monotonic() + pausa
+        self.aberturas += 1
+        self.aberturas_seguidas += 1
+        self.resultados.clear()
+        self.falhas = 0
+        logger.warning("circuito_aberto pausa=%.1f aberturas_seguidas=%d", pausa, self.aberturas_seguidas)
+        if self.metricas is not None:
+            self.metricas.contador("disjuntor_aberturas_total", "Vezes que o circuito da API abriu").inc()
+
+    def _fechar(self):
+        self.estado = FECHADO
+        self.aberturas_seguidas = 0
+        self._sondagem_desde = None
+        logger.info("circuito_fechado")
+
+
+class PoliticaHedge:
+    """Requisições "hedged": se a resposta demora mais que o quantil ``quantil`` da
+    latência do endpoint, uma segunda cópia é enviada e vale a que chegar primeiro.
+
+    Só entra em ação depois de ``minimo_amostras`` respostas do endpoint e limitada a
+    ``fracao_max`` das requisições, para não dobrar a carga quando a API inteira está
+    lenta. O atraso fica entre ``atraso_min`` e ``atraso_max`` segundos.
+    """
+
+    def __init__(self, quantil=0.95, fracao_max=0.05, minimo_amostras=50, atraso_min=0.2, atraso_max=5.0):
+        self.quantil = quantil
+        self.fracao_max = fracao_max
+        self.minimo_amostras = minimo_amostras
+        self.atraso_min = atraso_min
+        self.atraso_max = atraso_max
+        self.requisicoes = 0
+        self.hedges = 0
+        self.vitorias = 0
+
+    def atraso(self, histograma):
+        if self.fracao_max <= 0 or histograma.total < self.minimo_amostras:
+            return None
+        return min(self.atraso_max, max(self.atraso_min, histograma.quantil(self.quantil)))
+
+    async def executar(self, criar, atraso):
+        """Roda ``criar()`` e, se passar de ``atraso`` segundos, uma segunda cópia em paralelo.
+
+        Devolve o resultado da primeira cópia que terminar sem exceção; se as
+        duas falharem, propaga a exceção da última.
+        """
+        self.requisicoes += 1
+        primeira = asyncio.ensure_future(criar())
+        if atraso is None:
+            return await primeira
+        pendentes = {primeira}
+        try:
+            feitas, pendentes = await asyncio.wait(pendentes, timeout=atraso)
+            if feitas or self.hedges >= self.fracao_max * self.requisicoes:
+                return await primeira
+            self.hedges += 1
+            segunda = asyncio.ensure_future(criar())
+            pendentes = {primeira, segunda}
+            while True:
+                feitas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                vencedora = next((tarefa for tarefa in feitas if tarefa.exception() is None), None)
+                if vencedora is not None:
+                    if vencedora is segunda:
+                        self.vitorias += 1
+                    return vencedora.result()
+                if not pendentes:
+                    return next(iter(feitas)).result()
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()
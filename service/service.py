@@ -1,18 +1,46 @@
 import httpx
 import os
 import asyncio
-from aiolimiter import AsyncLimiter
 from supabase import create_client
 import aiohttp  # Adicione esta importação no topo do arquivo
 import time
-from collections import deque
-from datetime import datetime
-from functools import wraps
+from cliente_fipe import ClienteFipe
+from pool_trabalho import executar_pool
+from limitador import LimitadorAdaptativo
+from gravador import GravadorLote, CHAVES_CONFLITO
+from armazenamento import ArmazenamentoAsync
+from catalogo import carregar_catalogo
+from combinacoes import gerar_combinacoes, contar_combinacoes, ItemPreco
+from checkpoint import JournalCheckpoint
+from cache_respostas import CacheRespostas
+from pipeline import Estagio, executar_pipeline
+from progresso import RelatorioProgresso
+from historico import selecionar_tabelas, intercalar, ProgressoPorMes
+from metricas import Metricas, ServidorMetricas
+from reservas import ReservasSqlite, ReservasSupabase, bloco_de
+from delta import RegistroDelta, carregar_indice_precos
+from prioridade import Popularidade, RecenciaAno, PrioridadeComposta, carregar_desatualizacao
+from resiliencia import Disjuntor, PoliticaHedge, FalhaRequisicao, RequisicaoLimitada
+from agregados import AgregadosPrecos, preencher_catalogo
+from destinos import Destino, DestinoColunar, centavos_do_valor
+import rastreamento
+from rastreamento import span, rastreado, AmostradorPerfil
+from functools import partial, wraps
 import traceback
+import argparse
+import json
+import logging
+import signal
+import socket
+import subprocess
+import sys
+
+# Detalhes por item (requisições, valores, gravações) saem como DEBUG e ficam
+# desligados por padrão; use -v/-vv ou AUTOFIPE_LOG=DEBUG para vê-los.
+logger = logging.getLogger("autofipe")
 
 url = os.getenv("SUPABASE_URL")
 key = os.getenv("SUPABASE_KEY")
-supabase = create_client(url, key)
 
 
 # Endpoints da API da FIPE
@@ -21,9 +49,213 @@ HEADERS = {
     "Content-Type": "application/x-www-form-urlencoded"
 }
 
-# Adicione estas variáveis globais no início do arquivo, após as importações
-api_calls_counter = 0
-api_calls_by_endpoint = {}
+# Configuração do pool de conexões HTTP com a FIPE
+CONFIG_CLIENTE_FIPE = {
+    'limite_conexoes': 20,
+    'limite_por_host': 10,
+    'ttl_dns': 300,        # segundos de cache de DNS
+    'keepalive': 30,       # segundos que uma conexão ociosa fica aberta
+    'timeout_total': 30,
+    'timeout_conexao': 10,
+}
+
+# "pipeline": coleta marcas, modelos, anos e preços em uma única passada, com os
+# estágios ligados por filas. "etapas": fluxo antigo, uma etapa por execução,
+# escolhida por verificar_completude_dados.
+MODO_EXECUCAO = "pipeline"
+
+# Workers por estágio do pipeline (todos compartilham o mesmo limitador)
+CONCORRENCIA_PIPELINE = {
+    'modelos': 2,
+    'anos': 4,
+    'precos': 8,
+}
+
+# Tipos de veículo da FIPE (codigoTipoVeiculo)
+TIPOS_VEICULO = {1: "carros", 2: "motos", 3: "caminhões"}
+
+# Tipos coletados e o peso de cada um nas filas do pipeline. Todos dividem o
+# mesmo limitador: com pesos 3:1:1, enquanto houver trabalho dos três tipos os
+# carros ficam com 3/5 das requisições; um tipo sem itens na fila não segura os outros.
+CONFIG_TIPOS = {
+    'tipos': [1, 2, 3],
+    'pesos': {1: 3, 2: 1, 3: 1},
+}
+
+# Número de workers consultando preços em paralelo na etapa 5. O limitador
+# continua sendo o teto de requisições; os workers só garantem que o orçamento
+# seja usado por inteiro em vez de esperar a latência de cada chamada anterior.
+CONCORRENCIA_PRECOS = 8
+
+# Diretório local para estado entre execuções (taxa aprendida, caches, etc.)
+DIRETORIO_DADOS = os.getenv("AUTOFIPE_DADOS", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dados"))
+
+# Limitador adaptativo (AIMD): começa em taxa_inicial req/s, ou perto da última
+# taxa aprendida salva em arquivo_estado, e se ajusta conforme os 429 da API
+CONFIG_LIMITADOR = {
+    'taxa_inicial': 0.5,   # equivalente ao antigo AsyncLimiter(5, 10)
+    'taxa_min': 0.1,
+    'taxa_max': 20.0,
+    'aumento': 0.05,
+    'fator_reducao': 0.5,
+    'arquivo_estado': os.path.join(DIRETORIO_DADOS, "limitador.json"),
+}
+
+# Gravação em lote: linhas são acumuladas e enviadas em um único upsert quando a
+# tabela atinge tamanho_lote linhas ou a cada intervalo segundos
+CONFIG_GRAVADOR = {
+    'tamanho_lote': 500,
+    'intervalo': 5.0,
+    'max_tentativas': 3,
+    'arquivo_falhas': os.path.join(DIRETORIO_DADOS, "lotes_falhos.jsonl"),
+}
+
+# Threads dedicadas às chamadas ao Supabase, cada uma com o seu cliente
+CONFIG_ARMAZENAMENTO = {
+    'max_workers': 4,
+}
+
+# Cache em disco das respostas de catálogo da FIPE, por tabela de referência.
+# Defina AUTOFIPE_SEM_CACHE=1 para ignorar o cache e sempre consultar a API.
+CONFIG_CACHE = {
+    'caminho': os.path.join(DIRETORIO_DADOS, "cache_respostas.sqlite3"),
+    'endpoints': ['ConsultarTabelaDeReferencia', 'ConsultarMarcas', 'ConsultarModelos', 'ConsultarAnoModelo'],
+    'ttl_padrao': 30 * 24 * 3600,
+    # A lista de tabelas muda quando a FIPE publica um mês novo; as demais são fixas por tabela
+    'ttls': {'ConsultarTabelaDeReferencia': 3600},
+    'max_entradas': 200_000,
+    'ignorar': os.getenv("AUTOFIPE_SEM_CACHE") == "1",
+}
+
+# Métricas da execução. Com porta definida (ou AUTOFIPE_METRICAS_PORTA), ficam
+# disponíveis em http://127.0.0.1:<porta>/metrics (formato do Prometheus) e
+# /metricas.json durante a execução; o resumo final é salvo em arquivo_resumo.
+CONFIG_METRICAS = {
+    'porta': int(os.getenv("AUTOFIPE_METRICAS_PORTA", "0")) or None,
+    'arquivo_resumo': os.path.join(DIRETORIO_DADOS, "metricas.json"),
+}
+
+# Diário local do trabalho concluído, usado para retomar uma execução interrompida
+ARQUIVO_JOURNAL = os.path.join(DIRETORIO_DADOS, "journal.sqlite3")
+
+# Modo distribuido: o trabalho de cada mês é dividido em blocos por hash do
+# modelo (ou da marca) e vários trabalhadores, cada um com seu limitador e sua
+# saída de rede, reservam blocos em uma tabela de reservas compartilhada.
+# reservas: caminho de um SQLite (processos na mesma máquina) ou "supabase"
+# (tabela blocos_trabalho no banco, para várias máquinas; veja o readme).
+# Uma reserva não renovada em ttl_reserva segundos volta a ficar disponível.
+CONFIG_DISTRIBUIDO = {
+    'blocos': 32,
+    'particao': 'modelo',  # ou 'marca'
+    'ttl_reserva': 120,
+    'max_tentativas': 5,
+    'reservas': os.getenv("AUTOFIPE_RESERVAS") or os.path.join(DIRETORIO_DADOS, "reservas.sqlite3"),
+    'trabalhador': os.getenv("AUTOFIPE_TRABALHADOR") or f"{socket.gethostname()}-{os.getpid()}",
+}
+
+# Modo delta (--delta ou AUTOFIPE_DELTA=1, modos pipeline, historico, daemon e
+# distribuido): cada preço é comparado com o último preço conhecido dos
+# meses_indice meses anteriores (no historico, um mês por vez, do mais antigo); só os novos e alterados são gravados inteiros em veiculos e os
+# inalterados vão, agrupados em lotes de até tamanho_lote, para veiculos_inalterados
+CONFIG_DELTA = {
+    'ativo': os.getenv("AUTOFIPE_DELTA") == "1",
+    'meses_indice': 12,
+    'tamanho_lote': 500,
+}
+
+# Ordem de coleta: marcas, modelos e preços de maior pontuação primeiro, para que
+# uma execução parcial cubra antes o que mais importa. Cada critério tem um peso
+# (0 desliga): popularidade vem de arquivo_popularidade (veja prioridade.py),
+# recencia favorece anos modelo mais novos e desatualizacao os preços há mais
+# tempo sem atualização (exige uma leitura de veiculos no início). Fontes
+# próprias (subclasses de prioridade.Prioridade) entram em extras como (fonte, peso).
+CONFIG_PRIORIDADE = {
+    'pesos': {'popularidade': 1.0, 'recencia': 0.2, 'desatualizacao': 0.0},
+    'arquivo_popularidade': os.getenv("AUTOFIPE_POPULARIDADE") or os.path.join(DIRETORIO_DADOS, "popularidade.json"),
+    'extras': [],
+}
+
+# Modo daemon: consulta a lista de tabelas de referência (sem cache) a cada
+# intervalo segundos e coleta sozinho a tabela mais recente assim que ela aparece.
+# Uma coleta que terminou com falhas é retomada depois de intervalo_falha segundos.
+CONFIG_DAEMON = {
+    'intervalo': int(os.getenv("AUTOFIPE_DAEMON_INTERVALO", "600")),
+    'intervalo_falha': 120,
+}
+
+# Resiliência das requisições à FIPE. Cada tentativa tem o timeout do seu
+# endpoint (a consulta de preço é a mais lenta); 429, 5xx, timeouts e erros de
+# conexão são repetidos até max_tentativas vezes, com espera exponencial entre
+# espera_inicial e espera_max segundos. O disjuntor (circuit breaker) pausa todos
+# os workers quando a maioria das últimas requisições falhou, e o hedge envia uma
+# segunda cópia das requisições mais lentas que o p95 do endpoint. No pipeline,
+# os itens que ainda assim falharem são reprocessados ao fim da execução, em até
+# rodadas_reprocessamento rodadas; os que sobrarem vão para arquivo_perdidos.
+CONFIG_RESILIENCIA = {
+    'timeout_padrao': 15,
+    'timeouts': {'ConsultarValorComTodosParametros': 20},
+    'max_tentativas': 5,
+    'espera_inicial': 1.0,
+    'espera_max': 30.0,
+    'disjuntor': {'janela': 20, 'minimo': 10, 'limiar': 0.5, 'pausa_inicial': 5.0, 'pausa_max': 300.0},
+    'hedge': {'quantil': 0.95, 'fracao_max': 0.05, 'minimo_amostras': 50},
+    'rodadas_reprocessamento': 3,
+    'espera_reprocessamento': 10.0,
+    'arquivo_perdidos': os.path.join(DIRETORIO_DADOS, "itens_perdidos.jsonl"),
+}
+
+# Agregados de preço (--agregados ou AUTOFIPE_AGREGADOS=1): cada linha gravada
+# atualiza as estatísticas por veículo, modelo e marca de agregados.py, que são
+# carregadas de arquivo no início e salvas nele ao fim de cada tabela de
+# referência, para a API de consulta. Exige o NumPy.
+CONFIG_AGREGADOS = {
+    'ativo': os.getenv("AUTOFIPE_AGREGADOS") == "1",
+    'arquivo': os.path.join(DIRETORIO_DADOS, "agregados.json"),
+}
+
+# Snapshot local (--snapshot parquet|arrow ou AUTOFIPE_SNAPSHOT): além do banco, cada
+# preço coletado vai para um dataset em colunas em diretorio, uma partição por mês
+# de referência, gravado em lotes de tamanho_grupo linhas depois que o preço foi
+# confirmado no banco (veja destinos.py). Exige o pyarrow.
+CONFIG_SNAPSHOT = {
+    'formato': os.getenv("AUTOFIPE_SNAPSHOT") or None,
+    'diretorio': os.path.join(DIRETORIO_DADOS, "snapshot"),
+    'tamanho_grupo': 10_000,
+}
+
+# Rastreamento (--trace ou AUTOFIPE_TRACE=1): spans do limitador, da ida e volta HTTP,
+# do JSON, do preço e do banco em arquivo_trace, no formato Chrome trace (até
+# max_eventos). Perfil por amostragem (--perfil SEGUNDOS, ou SIGUSR1 durante a
+# execução): pilhas da thread do event loop por perfil_segundos segundos, no formato
+# collapsed, em arquivo_perfil (veja rastreamento.py).
+CONFIG_RASTREAMENTO = {
+    'ativo': os.getenv("AUTOFIPE_TRACE") == "1",
+    'arquivo_trace': os.path.join(DIRETORIO_DADOS, "trace.json"),
+    'max_eventos': 1_000_000,
+    'perfil_segundos': 0,
+    'perfil_sinal_segundos': 30,
+    'perfil_intervalo': 0.005,
+    'arquivo_perfil': os.path.join(DIRETORIO_DADOS, "perfil-{inicio}.txt"),
+}
+
+# Etapa do journal que marca uma tabela de referência inteira como coletada
+# (modos pipeline e historico); as etapas 1 a 5 são as do fluxo antigo
+ETAPA_MES_COMPLETO = 6
+
+# Cliente, gravador e journal compartilhados, abertos por rodar_scraping e reutilizados por todas as etapas
+cliente_fipe = None
+gravador = None
+journal = None
+registro_delta = None
+agregados = None
+perfil = None
+
+metricas = Metricas()
+
+cache_respostas = CacheRespostas(**CONFIG_CACHE)
+
+# Camada assíncrona de acesso ao Supabase (chamadas síncronas rodam em threads próprias)
+armazenamento = ArmazenamentoAsync(lambda: create_client(url, key), metricas=metricas, **CONFIG_ARMAZENAMENTO)
 
 # Configuração de amostragem
 MODO_AMOSTRAGEM = False  # Altere para False para processar todos os dados
@@ -36,143 +268,179 @@ LIMITES = {
     'meses': 1
 }
 
-class RateLimitTester:
-    def __init__(self):
-        self.requests_history = deque(maxlen=100)
-        self.errors_429 = 0
-        self.success_count = 0
-        self.start_time = None
-    
-    def add_request(self, success):
-        now = datetime.now()
-        if not self.start_time:
-            self.start_time = now
-        
-        self.requests_history.append((now, success))
-        if success:
-            self.success_count += 1
-        else:
-            self.errors_429 += 1
-    
-    def get_stats(self):
-        if not self.requests_history:
-            return "Sem dados suficientes"
-        
-        duration = (datetime.now() - self.start_time).total_seconds()
-        total_requests = len(self.requests_history)
-        success_rate = (self.success_count / total_requests) * 100 if total_requests > 0 else 0
-        
-        if len(self.requests_history) >= 2:
-            recent_requests = list(self.requests_history)[-2:]
-            time_diff = (recent_requests[1][0] - recent_requests[0][0]).total_seconds()
-            current_rate = 1 / time_diff if time_diff > 0 else 0
-        else:
-            current_rate = 0
-        
-        return {
-            "total_requests": total_requests,
-            "success_rate": f"{success_rate:.2f}%",
-            "errors_429": self.errors_429,
-            "requests_per_second": f"{current_rate:.2f}",
-            "duration_seconds": f"{duration:.2f}"
-        }
+rate_limit = LimitadorAdaptativo(**CONFIG_LIMITADOR)
 
-rate_tester = RateLimitTester()
-rate_limit = AsyncLimiter(5, 10)  # Ajuste estes valores durante os testes
+disjuntor = Disjuntor(metricas=metricas, **CONFIG_RESILIENCIA['disjuntor'])
+hedge = PoliticaHedge(**CONFIG_RESILIENCIA['hedge'])
 
-async def requisitar_api(endpoint, payload):
-    global api_calls_counter, api_calls_by_endpoint
-    max_retries = 3
-    retry_delay = 2
-    
-    for attempt in range(max_retries):
-        async with rate_limit:
-            try:
-                api_calls_counter += 1
-                api_calls_by_endpoint[endpoint] = api_calls_by_endpoint.get(endpoint, 0) + 1
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(f"{BASE_URL}/{endpoint}", data=payload, headers=HEADERS) as response:
-                        if response.status == 429:
-                            rate_tester.add_request(False)
-                            wait_time = (attempt + 1) * retry_delay
-                            print(f"\nRate limit atingido! Estatísticas:")
-                            print(rate_tester.get_stats())
-                            print(f"Aguardando {wait_time} segundos...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        
-                        rate_tester.add_request(True)
-                        if api_calls_counter % 10 == 0:
-                            print("\nEstatísticas de requisições:")
-                            print(rate_tester.get_stats())
-                        
-                        response.raise_for_status()
-                        return await response.json()
-                        
-            except aiohttp.ClientError as e:
-                print(f"Erro na requisição: {e}. Tentativa {attempt + 1} de {max_retries}")
-                if attempt == max_retries - 1:
+metricas.medidor("limitador_taxa", "Taxa atual do limitador (req/s)", funcao=lambda: rate_limit.taxa_atual)
+for _nome in ("hedges", "vitorias"):
+    metricas.medidor(f"fipe_{_nome}_total", f"Requisições hedged: {_nome}",
+                     funcao=lambda nome=_nome: getattr(hedge, nome))
+for _nome in ("acertos", "faltas", "coalescidas"):
+    metricas.medidor(f"cache_respostas_{_nome}", f"Cache de respostas: {_nome}",
+                     funcao=lambda nome=_nome: getattr(cache_respostas, nome))
+
+def criar_cliente_fipe():
+    return ClienteFipe(BASE_URL, HEADERS, **CONFIG_CLIENTE_FIPE)
+
+async def requisitar_api(endpoint, payload, usar_cache=True):
+    with span("requisitar_api", "fipe", endpoint=endpoint):
+        if usar_cache and cache_respostas.cacheavel(endpoint):
+            return await cache_respostas.obter_ou_buscar(
+                endpoint, payload, lambda: _requisitar_com_cliente(endpoint, payload)
+            )
+        return await _requisitar_com_cliente(endpoint, payload)
+
+async def _requisitar_com_cliente(endpoint, payload):
+    if cliente_fipe is None or not cliente_fipe.aberto:
+        # Chamada avulsa (fora de rodar_scraping): usa um cliente temporário
+        async with criar_cliente_fipe() as cliente:
+            return await _requisitar_api(cliente, endpoint, payload)
+    return await _requisitar_api(cliente_fipe, endpoint, payload)
+
+def _timeout(endpoint):
+    segundos = CONFIG_RESILIENCIA['timeouts'].get(endpoint, CONFIG_RESILIENCIA['timeout_padrao'])
+    return aiohttp.ClientTimeout(total=segundos)
+
+async def _tentativa(cliente, endpoint, payload, latencia):
+    """Uma requisição, dentro do limitador; 429 vira ``RequisicaoLimitada``"""
+    espera = time.perf_counter()
+    async with rate_limit:
+        inicio = time.perf_counter()
+        metricas.histograma("limitador_espera_segundos", "Tempo esperando o limitador",
+                            endpoint=endpoint).observar(inicio - espera)
+        rastreamento.registrar("limitador", espera, inicio, "fipe", endpoint=endpoint)
+        try:
+            async with cliente.post(endpoint, payload, timeout=_timeout(endpoint)) as response:
+                # Ida e volta até os cabeçalhos; o corpo é lido junto com o JSON
+                rastreamento.registrar("http", inicio, time.perf_counter(), "fipe", endpoint=endpoint,
+                                       status=response.status)
+                metricas.contador("fipe_requisicoes_total", "Requisições à FIPE por status",
+                                  endpoint=endpoint, status=response.status).inc()
+                if response.status == 429:
+                    # O limitador reduz a taxa e pausa todos os workers; a próxima
+                    # tentativa espera por ele em vez de um sleep fixo
+                    latencia.observar(time.perf_counter() - inicio)
+                    pausa = rate_limit.registrar_throttle(response.headers.get("Retry-After"))
+                    raise RequisicaoLimitada(f"429 (taxa={rate_limit.taxa_atual:.2f} pausa={pausa:.1f})")
+
+                rate_limit.registrar_sucesso()
+                response.raise_for_status()
+                try:
+                    with span("json", "fipe", endpoint=endpoint):
+                        dados = await response.json()
+                except ValueError:
+                    logger.error("json_invalido endpoint=%s resposta=%r", endpoint, await response.text())
                     raise
-                await asyncio.sleep(retry_delay)
-            except ValueError as e:
-                print(f"Erro ao decodificar JSON. Resposta recebida: {await response.text()}")
-                raise
-    
-    return None
+                latencia.observar(time.perf_counter() - inicio)
+                return dados
+        except asyncio.TimeoutError:
+            metricas.contador("fipe_requisicoes_total", "Requisições à FIPE por status",
+                              endpoint=endpoint, status="timeout").inc()
+            raise
+        except aiohttp.ClientResponseError:
+            raise
+        except aiohttp.ClientError:
+            # Sem resposta (conexão): o status não foi contado acima
+            metricas.contador("fipe_requisicoes_total", "Requisições à FIPE por status",
+                              endpoint=endpoint, status="erro").inc()
+            raise
+
+async def _requisitar_api(cliente, endpoint, payload):
+    """Requisição com novas tentativas, disjuntor e hedge; levanta ``FalhaRequisicao`` se todas falharem"""
+    max_tentativas = CONFIG_RESILIENCIA['max_tentativas']
+    latencia = metricas.histograma("fipe_requisicao_segundos", "Latência das requisições à FIPE", endpoint=endpoint)
+
+    for tentativa in range(max_tentativas):
+        if tentativa:
+            metricas.contador("fipe_novas_tentativas_total", "Requisições repetidas após 429 ou erro",
+                              endpoint=endpoint).inc()
+        with span("disjuntor", "fipe"):
+            await disjuntor.aguardar()
+        try:
+            dados = await hedge.executar(lambda: _tentativa(cliente, endpoint, payload, latencia),
+                                         hedge.atraso(latencia))
+        except RequisicaoLimitada as e:
+            # Sem espera extra: o limitador já pausou todos os workers
+            disjuntor.registrar(False)
+            logger.info("rate_limit endpoint=%s %s tentativa=%d/%d", endpoint, e, tentativa + 1, max_tentativas)
+            continue
+        except aiohttp.ClientResponseError as e:
+            if e.status < 500:
+                # A API respondeu: repetir o mesmo pedido não vai mudar a resposta
+                disjuntor.registrar(True)
+                raise FalhaRequisicao(f"{endpoint}: HTTP {e.status}") from e
+            erro = f"HTTP {e.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            erro = repr(e)
+        except ValueError as e:
+            disjuntor.registrar(True)
+            raise FalhaRequisicao(f"{endpoint}: resposta inválida") from e
+        else:
+            disjuntor.registrar(True)
+            return dados
+
+        disjuntor.registrar(False)
+        logger.warning("erro_requisicao endpoint=%s erro=%s tentativa=%d/%d",
+                       endpoint, erro, tentativa + 1, max_tentativas)
+        if tentativa < max_tentativas - 1:
+            with span("espera_nova_tentativa", "fipe", endpoint=endpoint, tentativa=tentativa + 1):
+                await asyncio.sleep(min(CONFIG_RESILIENCIA['espera_max'],
+                                        CONFIG_RESILIENCIA['espera_inicial'] * 2 ** tentativa))
+
+    raise FalhaRequisicao(f"{endpoint}: sem resposta após {max_tentativas} tentativas")
+
+# Obtém todas as tabelas de referência (uma por mês, da mais recente para a mais antiga)
+async def obter_tabelas_referencia():
+    return await requisitar_api("ConsultarTabelaDeReferencia", {})
 
 # Obtém a tabela de referência mais recente
 async def obter_tabela_referencia():
-    response = await requisitar_api("ConsultarTabelaDeReferencia", {})
+    response = await obter_tabelas_referencia()
     return response[0] # Retorna o código da tabela mais recente
 
 # Obtém todas as marcas de veículos
-async def obter_marcas(codigo_tabela):
+async def obter_marcas(codigo_tabela, tipo_veiculo=1):
     payload = {
         "codigoTabelaReferencia": codigo_tabela,
-        "codigoTipoVeiculo": 1  # 1 = Carro
+        "codigoTipoVeiculo": tipo_veiculo  # 1 = Carro, 2 = Moto, 3 = Caminhão
     }
     return await requisitar_api("ConsultarMarcas", payload)
 
 # Obtém todos os modelos de uma marca
-async def obter_modelos(codigo_tabela, codigo_marca):
+async def obter_modelos(codigo_tabela, codigo_marca, tipo_veiculo=1):
     payload = {
         "codigoTabelaReferencia": codigo_tabela,
-        "codigoTipoVeiculo": 1,
+        "codigoTipoVeiculo": tipo_veiculo,
         "codigoMarca": codigo_marca
     }
     response = await requisitar_api("ConsultarModelos", payload)
     return response["Modelos"]
 
 # Obtém os anos disponíveis de um modelo
-async def obter_anos_modelo(codigo_tabela, codigo_marca, codigo_modelo):
+async def obter_anos_modelo(codigo_tabela, codigo_marca, codigo_modelo, tipo_veiculo=1):
     payload = {
         "codigoTabelaReferencia": codigo_tabela,
         "codigoMarca": codigo_marca,
-        "codigoTipoVeiculo": 1,
+        "codigoTipoVeiculo": tipo_veiculo,
         "codigoModelo": codigo_modelo
     }
-    resultado = await requisitar_api("ConsultarAnoModelo", payload)
-    if resultado is None:
-        print(f"Falha ao obter anos para modelo {codigo_modelo}. Pulando...")
-        return []
-    return resultado
+    return await requisitar_api("ConsultarAnoModelo", payload)
 
 # Obtém o valor FIPE de um veículo específico
-async def obter_valor_veiculo(codigo_tabela, codigo_marca, codigo_modelo, ano_data):
+@rastreado("obter_valor_veiculo", "preco")
+async def obter_valor_veiculo(codigo_tabela, codigo_marca, codigo_modelo, ano_data, marcador=None, tipo_veiculo=1):
     try:
-        print(f"\nIniciando consulta de valor para:")
-        print(f"- Tabela: {codigo_tabela}")
-        print(f"- Marca: {codigo_marca}")
-        print(f"- Modelo: {codigo_modelo}")
-        print(f"- Ano/Combustível: {ano_data['codigo']}")
+        logger.debug("consulta_valor tabela=%s marca=%s modelo=%s ano=%s",
+                     codigo_tabela, codigo_marca, codigo_modelo, ano_data['codigo'])
         
         ano, combustivel = ano_data['codigo'].split("-")
         payload = {
             "codigoTabelaReferencia": codigo_tabela,
             "codigoMarca": codigo_marca,
             "codigoModelo": codigo_modelo,
-            "codigoTipoVeiculo": 1,
+            "codigoTipoVeiculo": tipo_veiculo,
             "anoModelo": ano,
             "codigoTipoCombustivel": combustivel,
             "tipoConsulta": "tradicional"
@@ -180,49 +448,61 @@ async def obter_valor_veiculo(codigo_tabela, codigo_marca, codigo_modelo, ano_da
         
         response = await requisitar_api("ConsultarValorComTodosParametros", payload)
         if not response:
-            print(f"❌ Erro: Resposta vazia para veículo {codigo_modelo} ano {ano_data['codigo']}")
+            logger.warning("resposta_vazia modelo=%s ano=%s", codigo_modelo, ano_data['codigo'])
             return None
             
-        print(f"✅ Resposta da API recebida:")
-        print(f"- Código FIPE: {response.get('CodigoFipe', 'N/A')}")
-        print(f"- Valor: {response.get('Valor', 'N/A')}")
-        print(f"- Combustível: {response.get('Combustivel', 'N/A')}")
+        logger.debug("valor_recebido codigo_fipe=%s valor=%s combustivel=%s",
+                     response.get('CodigoFipe'), response.get('Valor'), response.get('Combustivel'))
         
         try:
-            preco = float(response["Valor"].replace("R$ ", "").replace(".", "").replace(",", "."))
-            dados_veiculo = {
-                'modelo_id': int(codigo_modelo),  # Mantemos apenas o modelo_id
-                'ano_id': ano_data['id'],        # e o ano_id
-                'mes_referencia_id': int(codigo_tabela),
-                'codigo_fipe': response["CodigoFipe"],
-                'combustivel': response["Combustivel"],
-                'preco': preco,
-            }
-            
-            print("\n📝 Dados preparados para inserção:")
-            for campo, valor in dados_veiculo.items():
-                print(f"- {campo}: {valor} ({type(valor)})")
-            
-            resultado = salvar_no_banco("veiculos", dados_veiculo)
-            if resultado and resultado.data:
-                
-                print("✅ Veículo salvo com sucesso!")
-            else:
-                print("⚠️ Veículo não foi salvo (possível duplicata ou erro)")
+            with span("preco", "preco"):
+                centavos = centavos_do_valor(response["Valor"])
+                registro = {
+                    'tipo_veiculo': tipo_veiculo,
+                    'marca_id': int(codigo_marca),
+                    'marca': response.get("Marca"),
+                    'modelo_id': int(codigo_modelo),
+                    'modelo': response.get("Modelo"),
+                    'ano_id': ano_data['id'],
+                    'ano_modelo': int(ano),
+                    'combustivel': response["Combustivel"],
+                    'codigo_fipe': response["CodigoFipe"],
+                    'mes_referencia_id': int(codigo_tabela),
+                    'preco': centavos / 100,
+                    'centavos': centavos,
+                }
+            for destino in destinos:
+                with span("destino", "preco", destino=type(destino).__name__):
+                    gravado = await destino.gravar(registro, marcador)
+                if not gravado:
+                    logger.warning("veiculo_nao_gravado destino=%s dados=%s", type(destino).__name__, registro)
             
             return response
             
         except Exception as e:
-            print(f"❌ Erro ao preparar dados: {str(e)}")
-            print(f"Response original: {response}")
+            logger.warning("erro_preparar_dados erro=%s resposta=%s", e, response)
             return None
             
     except Exception as e:
-        print(f"❌ Erro em obter_valor_veiculo: {str(e)}")
+        logger.warning("erro_obter_valor modelo=%s ano=%s erro=%s", codigo_modelo, ano_data.get('codigo'), e)
         return None
 
 def retry_on_connection_error(max_retries=3, delay=1):
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                for attempt in range(max_retries):
+                    try:
+                        return await func(*args, **kwargs)
+                    except (httpx.RemoteProtocolError, httpx.ReadTimeout) as e:
+                        if attempt == max_retries - 1:
+                            raise
+                        logger.warning("erro_conexao_supabase erro=%s tentativa=%d/%d", e, attempt + 1, max_retries)
+                        await asyncio.sleep(delay * (attempt + 1))
+                return None
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
@@ -231,166 +511,170 @@ def retry_on_connection_error(max_retries=3, delay=1):
                 except (httpx.RemoteProtocolError, httpx.ReadTimeout) as e:
                     if attempt == max_retries - 1:
                         raise
-                    print(f"\nErro de conexão com Supabase: {e}")
-                    print(f"Tentativa {attempt + 1} de {max_retries}. Aguardando {delay} segundos...")
+                    logger.warning("erro_conexao_supabase erro=%s tentativa=%d/%d", e, attempt + 1, max_retries)
                     time.sleep(delay * (attempt + 1))
             return None
         return wrapper
     return decorator
 
+def montar_linha(tabela, dados):
+    """Converte os dados da API no formato de linha de cada tabela"""
+    if tabela == "veiculos":
+        campos_obrigatorios = ['modelo_id', 'ano_id', 'mes_referencia_id', 'codigo_fipe', 'combustivel', 'preco']
+        for campo in campos_obrigatorios:
+            if campo not in dados:
+                logger.warning("campo_ausente tabela=%s campo=%s", tabela, campo)
+                return None
+        return {**{campo: dados[campo] for campo in campos_obrigatorios},
+                'tipo_veiculo': dados.get("tipo_veiculo", 1)}
+    elif tabela == "veiculos_inalterados":
+        return {'mes_referencia_id': dados["mes_referencia_id"], 'lote': dados["lote"], 'ano_ids': dados["ano_ids"]}
+    elif tabela == "tabela_referencia":
+        return {'codigo': dados["Codigo"], 'mes': dados["Mes"]}
+    # Os códigos da FIPE se repetem entre tipos de veículo: o tipo faz parte da chave
+    elif tabela == "marcas":
+        return {'codigo': dados["Value"], 'nome': dados["Label"], 'tipo_veiculo': dados.get("tipo_veiculo", 1)}
+    elif tabela == "modelos":
+        return {'codigo': dados["Value"], 'nome': dados["Label"], 'marca_id': dados["marca_id"],
+                'tipo_veiculo': dados.get("tipo_veiculo", 1)}
+    elif tabela == "anos_modelo":
+        return {'codigo': dados["Value"], 'descricao': dados["Label"], 'modelo_id': dados["modelo_id"],
+                'tipo_veiculo': dados.get("tipo_veiculo", 1)}
+    raise ValueError(f"Tabela desconhecida: {tabela}")
+
+def registrar_gravacao(tabela, linhas):
+    """Repassa as linhas recém-gravadas aos agregados de preço, se estiverem ligados"""
+    if agregados is not None:
+        agregados.registrar_linhas(tabela, linhas)
+
+async def enfileirar_no_banco(tabela, dados, marcador=None):
+    """Adiciona a linha ao gravador em lote; sem gravador aberto, grava na hora"""
+    linha = montar_linha(tabela, dados)
+    if linha is None:
+        return False
+    if gravador is None:
+        await salvar_no_banco(tabela, dados)
+    else:
+        await gravador.adicionar(tabela, linha, marcador)
+    return True
+
+class DestinoSupabase(Destino):
+    """Grava o preço em veiculos pelo gravador em lote (no modo delta, os inalterados em veiculos_inalterados)"""
+
+    CAMPOS = ('modelo_id', 'ano_id', 'mes_referencia_id', 'codigo_fipe', 'combustivel', 'preco', 'tipo_veiculo')
+
+    async def gravar(self, registro, marcador=None):
+        dados = {campo: registro[campo] for campo in self.CAMPOS}
+        tabela = "veiculos"
+        if registro_delta is not None and registro_delta.classificar(dados) == "inalterado":
+            tabela, dados = "veiculos_inalterados", registro_delta.linha_inalterado(dados)
+        return await enfileirar_no_banco(tabela, dados, marcador)
+
+# Destinos de cada preço coletado; rodar_scraping acrescenta o snapshot local se ligado
+destinos = [DestinoSupabase()]
+
+def chave_journal(*partes):
+    return ":".join(str(parte) for parte in partes)
+
+def confirmar_unidade(marcador):
+    """Fecha a unidade de trabalho; o journal a marca como concluída quando suas linhas estiverem no banco"""
+    if gravador is not None:
+        gravador.selar(marcador)
+    elif journal is not None:
+        unidade_gravada(journal, marcador)
+
+def unidade_gravada(journal_unidade, marcador):
+    """Linhas da unidade no banco: conclui a unidade no journal e libera o preço para os demais destinos"""
+    journal_unidade.marcar_concluido(*marcador)
+    for destino in destinos:
+        destino.confirmar(marcador)
+
+def registrar_falha(marcador, erro):
+    if journal is not None:
+        journal.marcar_falha(*marcador, str(erro))
+
 @retry_on_connection_error()
-def salvar_no_banco(tabela, dados):
+async def salvar_no_banco(tabela, dados):
     try:
-        print(f"\n🔄 Iniciando salvamento na tabela {tabela}")
-        
-        if tabela == "veiculos":
-            print("Verificando existência do veículo...")
-            try:
-                # Verifica se todos os campos necessários estão presentes
-                campos_obrigatorios = ['modelo_id', 'ano_id', 'mes_referencia_id', 'codigo_fipe', 'combustivel', 'preco']
-                for campo in campos_obrigatorios:
-                    if campo not in dados:
-                        print(f"❌ Campo obrigatório ausente: {campo}")
-                        return None
-                
-                # Verifica tipos dos dados
-                print("\nVerificando tipos dos dados:")
-                print(f"modelo_id: {type(dados['modelo_id'])} = {dados['modelo_id']}")
-                print(f"ano_id: {type(dados['ano_id'])} = {dados['ano_id']}")
-                print(f"mes_referencia_id: {type(dados['mes_referencia_id'])} = {dados['mes_referencia_id']}")
-                print(f"codigo_fipe: {type(dados['codigo_fipe'])} = {dados['codigo_fipe']}")
-                print(f"combustivel: {type(dados['combustivel'])} = {dados['combustivel']}")
-                print(f"preco: {type(dados['preco'])} = {dados['preco']}")
-                
-                # Verifica existência
-                existing = supabase.table('veiculos')\
-                    .select('*')\
-                    .eq('modelo_id', dados['modelo_id'])\
-                    .eq('ano_id', dados['ano_id'])\
-                    .eq('mes_referencia_id', dados['mes_referencia_id'])\
-                    .execute()
-                
-                print(f"\nResultado da verificação de existência: {existing.data}")
-                
-                if existing and len(existing.data) > 0:
-                    print("⚠️ Veículo já existe no banco, pulando...")
-                    return existing
-                
-                print("\nTentando inserir novo veículo...")
-                try:
-                    response = supabase.table('veiculos').insert(dados).execute()
-                    print(f"Resposta da inserção: {response}")
-                    
-                    # Verifica se a inserção foi bem-sucedida
-                    if response and response.data:
-                        print("✅ Veículo inserido com sucesso!")
-                        
-                        # Verifica se realmente foi inserido
-                        verificacao = supabase.table('veiculos')\
-                            .select('*')\
-                            .eq('modelo_id', dados['modelo_id'])\
-                            .eq('ano_id', dados['ano_id'])\
-                            .eq('mes_referencia_id', dados['mes_referencia_id'])\
-                            .execute()
-                            
-                        print(f"Verificação pós-inserção: {verificacao.data}")
-                    else:
-                        print("❌ Falha na inserção: response vazia ou sem dados")
-                    
-                    return response
-                    
-                except Exception as e:
-                    print(f"❌ Erro na inserção: {str(e)}")
-                    print("Tentando debug da conexão...")
-                    try:
-                        # Tenta uma query simples para verificar a conexão
-                        test = supabase.table('veiculos').select('count').execute()
-                        print(f"Teste de conexão: {test}")
-                    except Exception as e2:
-                        print(f"❌ Erro no teste de conexão: {str(e2)}")
-                    raise
-                
-            except Exception as e:
-                print(f"❌ Erro específico na operação com veículos: {str(e)}")
-                print(f"Dados que causaram o erro: {dados}")
-                raise
-            
-        elif tabela == "tabela_referencia":
-            response = supabase.table('tabela_referencia').upsert({
-                'codigo': dados["Codigo"],
-                'mes': dados["Mes"]
-            }).execute()
-        
-        elif tabela == "marcas":
-            response = supabase.table('marcas').upsert({
-                'codigo': dados["Value"],
-                'nome': dados["Label"]
-            }).execute()
-
-        elif tabela == "modelos":
-            response = supabase.table('modelos').upsert({
-                'codigo': dados["Value"],
-                'nome': dados["Label"],
-                'marca_id': dados["marca_id"]
-            }).execute()
-
-        elif tabela == "anos_modelo":
-            response = supabase.table('anos_modelo').upsert({
-                'codigo': dados["Value"],
-                'descricao': dados["Label"],
-                'modelo_id': dados["modelo_id"]
-            }).execute()
-        
+        logger.debug("salvar tabela=%s", tabela)
+        linha = montar_linha(tabela, dados)
+        if linha is None:
+            return None
+        # Um único upsert substitui o antigo SELECT/INSERT/SELECT por linha
+        response = await armazenamento.executar(
+            lambda db: db.table(tabela).upsert(linha, on_conflict=CHAVES_CONFLITO[tabela]).execute(),
+            tabela=tabela, operacao="upsert",
+        )
+        registrar_gravacao(tabela, response.data or [linha])
         return response
     except Exception as e:
-        print(f"❌ Erro ao salvar no banco (tabela {tabela}): {str(e)}")
-        print(f"📄 Dados que tentamos salvar: {dados}")
-        print("Stacktrace completo:")
-        traceback.print_exc()
+        logger.exception("erro_salvar tabela=%s dados=%s", tabela, dados)
         raise
 
-def get_mes_referencia():
-    response = supabase.table('tabela_referencia').select('*').execute()
+async def gravar_lote_agora(tabela, linhas):
+    """Upsert imediato de várias linhas; devolve as linhas gravadas (com ids)"""
+    if not linhas:
+        return []
+    response = await armazenamento.executar(
+        lambda db: db.table(tabela).upsert(linhas, on_conflict=CHAVES_CONFLITO[tabela]).execute(),
+        tabela=tabela, operacao="upsert_lote",
+    )
+    registrar_gravacao(tabela, response.data or linhas)
+    return response.data or []
+
+@retry_on_connection_error()
+async def get_mes_referencia():
+    response = await armazenamento.executar(lambda db: db.table('tabela_referencia').select('*').execute(),
+                                            tabela='tabela_referencia', operacao='select')
     mes_referencia = response.data
     return [{"Value": mes_referencia['codigo'], "Label": mes_referencia['mes']} for mes_referencia in mes_referencia]
 
 @retry_on_connection_error()
-def get_marcas():
+async def get_marcas():
     try:
-        response = supabase.table('marcas').select('codigo', 'nome').execute()
+        response = await armazenamento.executar(
+            lambda db: db.table('marcas').select('codigo', 'nome', 'tipo_veiculo').execute(),
+            tabela='marcas', operacao='select',
+        )
         marcas = response.data
-        return [{"Value": marca['codigo'], "Label": marca['nome']} for marca in marcas]
+        return [{"Value": marca['codigo'], "Label": marca['nome'], "tipo_veiculo": marca.get('tipo_veiculo', 1)}
+                for marca in marcas]
     except Exception as e:
-        print(f"Erro ao buscar marcas: {e}")
+        logger.error("erro_buscar_marcas erro=%s", e)
         return []
 
 @retry_on_connection_error()
-def get_modelos_by_marca(marca_id):
+async def get_modelos_by_marca(marca_id, tipo_veiculo=1):
     try:
-        response = supabase.table('modelos').select('codigo', 'nome').eq('marca_id', marca_id).execute()
+        response = await armazenamento.executar(
+            lambda db: db.table('modelos').select('codigo', 'nome')
+                         .eq('tipo_veiculo', tipo_veiculo).eq('marca_id', marca_id).execute(),
+            tabela='modelos', operacao='select',
+        )
         modelos = response.data
         return [{"Value": modelo['codigo'], "Label": modelo['nome']} for modelo in modelos]
     except Exception as e:
-        print(f"Erro ao buscar modelos da marca {marca_id}: {e}")
+        logger.error("erro_buscar_modelos marca=%s erro=%s", marca_id, e)
         return []
 
 @retry_on_connection_error()
-def get_anos_by_modelo(modelo_id):
-    response = supabase.table('anos_modelo').select('id', 'codigo', 'descricao').eq('modelo_id', modelo_id).execute()
+async def get_anos_by_modelo(modelo_id, tipo_veiculo=1):
+    response = await armazenamento.executar(
+        lambda db: db.table('anos_modelo').select('id', 'codigo', 'descricao')
+                     .eq('tipo_veiculo', tipo_veiculo).eq('modelo_id', modelo_id).execute(),
+        tabela='anos_modelo', operacao='select',
+    )
     anos = response.data
     return [{"id": ano['id'], "codigo": ano['codigo'], "Label": ano['descricao']} for ano in anos]
 
-def clear_console():
-    # Limpa a tela do console (funciona em Windows e Unix)
-    os.system('cls' if os.name == 'nt' else 'clear')
-
 @retry_on_connection_error()
-def verificar_completude_dados():
+async def verificar_completude_dados():
     try:
         print("\n=== Verificando completude dos dados ===")
         
         # Consulta contagens
-        stats = supabase.rpc('get_table_stats').execute()
+        stats = await armazenamento.executar(lambda db: db.rpc('get_table_stats').execute(),
+        tabela='rpc', operacao='get_table_stats')
         if not stats.data:
             print("Erro ao obter estatísticas. Iniciando do começo.")
             return 1
@@ -407,7 +691,8 @@ def verificar_completude_dados():
             return 1
             
         # Verifica se há modelos para todas as marcas
-        modelos_por_marca = supabase.rpc('check_marcas_sem_modelos').execute()
+        modelos_por_marca = await armazenamento.executar(lambda db: db.rpc('check_marcas_sem_modelos').execute(),
+        tabela='rpc', operacao='check_marcas_sem_modelos')
         if modelos_por_marca.data:
             print("\nEncontradas marcas sem modelos:")
             for marca in modelos_por_marca.data[:5]:  # Mostra até 5 exemplos
@@ -416,7 +701,8 @@ def verificar_completude_dados():
             return 3
             
         # Verifica se há anos para todos os modelos
-        modelos_sem_anos = supabase.rpc('check_modelos_sem_anos').execute()
+        modelos_sem_anos = await armazenamento.executar(lambda db: db.rpc('check_modelos_sem_anos').execute(),
+        tabela='rpc', operacao='check_modelos_sem_anos')
         if modelos_sem_anos.data:
             print("\nEncontrados modelos sem anos:")
             for modelo in modelos_sem_anos.data[:5]:  # Mostra até 5 exemplos
@@ -433,171 +719,803 @@ def verificar_completude_dados():
         print("Iniciando do começo por segurança.")
         return 1
 
+def extras_requisicoes():
+    """Linhas extras do painel de progresso com o estado das requisições"""
+    return {
+        "Requisições": metricas.total("fipe_requisicoes_total"),
+        "429": metricas.total("fipe_requisicoes_total", status=429),
+        "Taxa atual": f"{rate_limit.taxa_atual:.2f} req/s",
+    }
+
 def aplicar_limite(lista, tipo):
     """Aplica limite na lista se estiver em modo amostragem"""
     if MODO_AMOSTRAGEM and tipo in LIMITES:
         return lista[:LIMITES[tipo]]
     return lista
 
-async def rodar_scraping():
+async def preparar_delta(tabelas):
+    """Carrega o índice de preços anteriores e liga a comparação em obter_valor_veiculo"""
+    global registro_delta
+    if len(tabelas) != 1:
+        print("⚠️ O modo delta compara uma tabela de referência por vez; gravando as linhas completas")
+        return
+    indice = await carregar_indice_precos(armazenamento, tabelas[0]['Codigo'], CONFIG_DELTA['meses_indice'])
+    registro_delta = RegistroDelta(indice, CONFIG_DELTA['tamanho_lote'], metricas=metricas)
+
+async def criar_prioridade(mes_atual):
+    pesos = CONFIG_PRIORIDADE['pesos']
+    fontes = []
+    if pesos.get('popularidade') and os.path.exists(CONFIG_PRIORIDADE['arquivo_popularidade']):
+        fontes.append((Popularidade.de_arquivo(CONFIG_PRIORIDADE['arquivo_popularidade']), pesos['popularidade']))
+    if pesos.get('recencia'):
+        fontes.append((RecenciaAno(), pesos['recencia']))
+    if pesos.get('desatualizacao'):
+        fontes.append((await carregar_desatualizacao(armazenamento, mes_atual), pesos['desatualizacao']))
+    return PrioridadeComposta(fontes + list(CONFIG_PRIORIDADE['extras']))
+
+async def abrir_agregados():
+    """Carrega os agregados salvos (ou começa do zero) e o catálogo que eles usam"""
+    global agregados
+    inicio = time.perf_counter()
+    arquivo = CONFIG_AGREGADOS['arquivo']
+    carregados = AgregadosPrecos.carregar(arquivo) if os.path.exists(arquivo) else AgregadosPrecos()
+    agregados = await preencher_catalogo(armazenamento, carregados)
+    print(f"⏱️ Agregados de preço: {len(agregados)} veículos ({time.perf_counter() - inicio:.2f}s)")
+
+def salvar_agregados():
+    if agregados is not None:
+        agregados.salvar(CONFIG_AGREGADOS['arquivo'])
+
+def encerrar_delta():
+    global registro_delta
+    if registro_delta is not None:
+        print(registro_delta.resumo())
+        registro_delta = None
+
+async def coletar_tabela(tabela):
+    """Pipeline de uma tabela de referência, no modo delta se estiver ligado"""
+    if CONFIG_DELTA['ativo']:
+        await preparar_delta([tabela])
+    try:
+        await _rodar_pipeline([tabela])
+    finally:
+        encerrar_delta()
+        if gravador is not None:
+            # Confirma as unidades pendentes antes de fechar os arquivos do snapshot
+            await gravador.descarregar()
+        salvar_agregados()
+        for destino in destinos:
+            await destino.descarregar()
+
+def tabela_completa(codigo):
+    return all(journal.concluido(ETAPA_MES_COMPLETO, chave_journal(codigo, tipo)) for tipo in CONFIG_TIPOS['tipos'])
+
+async def rodar_scraping(modo=None, porta_metricas=None, desde=None, ate=None, meses=None):
+    global cliente_fipe, gravador, journal, agregados
+    modo = modo or MODO_EXECUCAO
+    porta_metricas = porta_metricas or CONFIG_METRICAS['porta']
+    servidor_metricas = None
+    if porta_metricas:
+        servidor_metricas = await ServidorMetricas(metricas, porta_metricas).abrir()
+        print(f"Métricas em http://127.0.0.1:{porta_metricas}/metrics")
+    abrir_rastreamento()
+    if CONFIG_AGREGADOS['ativo']:
+        await abrir_agregados()
+    snapshot = None
+    if CONFIG_SNAPSHOT['formato']:
+        snapshot = DestinoColunar(CONFIG_SNAPSHOT['diretorio'], CONFIG_SNAPSHOT['formato'],
+                                  CONFIG_SNAPSHOT['tamanho_grupo'])
+        destinos.append(snapshot)
+    # O journal fecha por último, depois que o envio final dos lotes confirmou as unidades
+    with JournalCheckpoint(ARQUIVO_JOURNAL) as journal_local:
+        journal = journal_local
+        try:
+            async with criar_cliente_fipe() as cliente, \
+                    GravadorLote(armazenamento, ao_confirmar=partial(unidade_gravada, journal_local),
+                                 ao_gravar=registrar_gravacao, metricas=metricas,
+                                 **CONFIG_GRAVADOR) as gravador_lote:
+                cliente_fipe = cliente
+                gravador = gravador_lote
+                try:
+                    if modo == "pipeline":
+                        await coletar_tabela(await obter_tabela_referencia())
+                    elif modo == "daemon":
+                        await _rodar_daemon()
+                    elif modo == "distribuido":
+                        tabelas = [await obter_tabela_referencia()]
+                        if desde or ate or meses:
+                            tabelas = selecionar_tabelas(await obter_tabelas_referencia(), desde, ate, meses)
+                        if CONFIG_DELTA['ativo']:
+                            await preparar_delta(tabelas)
+                        await _rodar_distribuido(tabelas)
+                    elif modo == "historico":
+                        tabelas = selecionar_tabelas(await obter_tabelas_referencia(), desde, ate, meses)
+                        print(f"Histórico: {len(tabelas)} tabelas de referência "
+                              f"({tabelas[-1]['Mes'].strip()} a {tabelas[0]['Mes'].strip()})" if tabelas
+                              else "Histórico: nenhuma tabela de referência no intervalo")
+                        if CONFIG_DELTA['ativo']:
+                            # O delta compara um mês por vez com os anteriores: do mais antigo ao mais novo
+                            for tabela in sorted(tabelas, key=lambda t: int(t['Codigo'])):
+                                await coletar_tabela(tabela)
+                        else:
+                            await _rodar_pipeline(tabelas)
+                    else:
+                        await _rodar_scraping()
+                finally:
+                    # O envio final dos lotes acontece ao sair do "async with"
+                    cliente_fipe = None
+                    gravador = None
+                    rate_limit.salvar()
+        finally:
+            journal = None
+            if servidor_metricas is not None:
+                await servidor_metricas.fechar()
+            metricas.salvar_resumo(CONFIG_METRICAS['arquivo_resumo'])
+            # Depois do envio final dos lotes, que ainda passa pelos agregados
+            salvar_agregados()
+            agregados = None
+            if snapshot is not None:
+                destinos.remove(snapshot)
+                await snapshot.fechar()
+            encerrar_rastreamento()
+    print(f"Cache de respostas: {cache_respostas.get_stats()}")
+    print(f"Lotes gravados: {gravador_lote.lotes_gravados}, linhas: {gravador_lote.linhas_gravadas}")
+    encerrar_delta()
+    imprimir_resumo_metricas()
+
+def imprimir_resumo_metricas():
+    """Tempo gasto na API, no banco e esperando o limitador, para achar o gargalo"""
+    resumo = metricas.resumo()['metricas']
+    print(f"\n=== Métricas (resumo completo em {CONFIG_METRICAS['arquivo_resumo']}) ===")
+    print(f"{'origem':<52}{'chamadas':>10}{'total (s)':>11}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+    for nome, rotulo in (("fipe_requisicao_segundos", "endpoint"),
+                         ("limitador_espera_segundos", "endpoint"),
+                         ("banco_operacao_segundos", None)):
+        for serie in resumo.get(nome, []):
+            rotulos = serie['rotulos']
+            origem = rotulos[rotulo] if rotulo else f"{rotulos['tabela']}.{rotulos['operacao']}"
+            valor = serie['valor']
+            print(f"{nome.split('_')[0] + ' ' + origem:<52}{valor['contagem']:>10}{valor['soma']:>11.2f}"
+                  f"{(valor['p50'] or 0) * 1000:>10.1f}{(valor['p95'] or 0) * 1000:>10.1f}")
+    print(f"429 recebidos: {metricas.total('fipe_requisicoes_total', status=429)}, "
+          f"novas tentativas: {metricas.total('fipe_novas_tentativas_total')}")
+
+def iniciar_perfil(segundos):
+    """Abre uma janela do perfil por amostragem, se não houver outra em andamento"""
+    global perfil
+    if perfil is not None and perfil.em_andamento:
+        return
+    caminho = CONFIG_RASTREAMENTO['arquivo_perfil'].format(inicio=time.strftime("%Y%m%d-%H%M%S"))
+    perfil = AmostradorPerfil(caminho, segundos, CONFIG_RASTREAMENTO['perfil_intervalo'])
+    perfil.iniciar()
+    print(f"Perfil por amostragem por {segundos}s em {caminho}")
+
+def abrir_rastreamento():
+    if CONFIG_RASTREAMENTO['ativo']:
+        rastreamento.iniciar(CONFIG_RASTREAMENTO['max_eventos'])
+    if CONFIG_RASTREAMENTO['perfil_segundos']:
+        iniciar_perfil(CONFIG_RASTREAMENTO['perfil_segundos'])
+    try:
+        # kill -USR1 <pid> abre uma janela do perfil durante a execução
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, lambda: iniciar_perfil(CONFIG_RASTREAMENTO['perfil_sinal_segundos']))
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass
+
+def encerrar_rastreamento():
+    global perfil
+    try:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass
+    if perfil is not None:
+        perfil.parar()
+        perfil = None
+    rastreador = rastreamento.finalizar(CONFIG_RASTREAMENTO['arquivo_trace'])
+    if rastreador is None:
+        return
+    print(f"\n=== Rastreamento: {len(rastreador.eventos)} spans em {CONFIG_RASTREAMENTO['arquivo_trace']}"
+          f"{f' ({rastreador.descartados} descartados)' if rastreador.descartados else ''} ===")
+    print(f"{'span':<28}{'quantidade':>12}{'soma (s)':>11}{'média (ms)':>12}")
+    for nome, (quantidade, soma) in rastreador.resumo().items():
+        print(f"{nome:<28}{quantidade:>12}{soma:>11.2f}{soma / quantidade * 1000:>12.2f}")
+
+async def _rodar_scraping():
     print(f"\n=== Iniciando processo de scraping {'(AMOSTRAGEM)' if MODO_AMOSTRAGEM else ''} ===")
     
-    def update_progress(etapa, detalhe="", progresso=""):
-        clear_console()
-        print(f"=== Processo de Scraping em Andamento {'(AMOSTRAGEM)' if MODO_AMOSTRAGEM else ''} ===")
-        print(f"Etapa atual: {etapa}/5")
-        if detalhe:
-            print(f"Processando: {detalhe}")
-        if progresso:
-            print(f"Progresso: {progresso}")
-        print("\nEstatísticas de requisições:")
-        print(rate_tester.get_stats())
-    
-    etapa_inicial = verificar_completude_dados()
+    etapa_inicial = await verificar_completude_dados()
     
     if etapa_inicial == 1:
-        update_progress("1", "Obtendo referência")
+        print("\nEtapa 1/5: obtendo referência")
         codigo_tabela = await obter_tabela_referencia()
-        salvar_no_banco("tabela_referencia", codigo_tabela)
+        await salvar_no_banco("tabela_referencia", codigo_tabela)
         codigo_tabela = codigo_tabela['Codigo']
         
-        update_progress("2", "Obtendo marcas")
-        marcas = aplicar_limite(await obter_marcas(codigo_tabela), 'marcas')
-        total_marcas = len(marcas)
-        for i, marca in enumerate(marcas, 1):
-            update_progress("2", f"Marca: {marca['Label']}", f"{i}/{total_marcas}")
-            salvar_no_banco("marcas", marca)
+        marcador = (2, chave_journal(codigo_tabela))
+        marcas = []
+        for tipo in CONFIG_TIPOS['tipos']:
+            for marca in aplicar_limite(await obter_marcas(codigo_tabela, tipo), 'marcas'):
+                marca["tipo_veiculo"] = tipo
+                marcas.append(marca)
+        progresso = RelatorioProgresso("Etapa 2/5: marcas", total=len(marcas))
+        for marca in marcas:
+            await enfileirar_no_banco("marcas", marca, marcador)
+            progresso.incrementar(detalhe=f"Marca: {marca['Label']}")
+        confirmar_unidade(marcador)
+        progresso.finalizar()
 
     elif etapa_inicial == 3:
-        update_progress("3", "Obtendo modelos")
         codigo_tabela = (await obter_tabela_referencia())['Codigo']
-        marcas = aplicar_limite(get_marcas(), 'marcas')
-        total_marcas = len(marcas)
+        marcas = [marca for marca in await get_marcas() if marca["tipo_veiculo"] in CONFIG_TIPOS['tipos']]
+        marcas = aplicar_limite(marcas, 'marcas')
+        progresso = RelatorioProgresso("Etapa 3/5: modelos por marca", total=len(marcas),
+                                       fonte_extras=extras_requisicoes)
         
-        for i, marca in enumerate(marcas, 1):
-            modelos = aplicar_limite(await obter_modelos(codigo_tabela, marca["Value"]), 'modelos')
-            total_modelos = len(modelos)
+        for marca in marcas:
+            tipo = marca["tipo_veiculo"]
+            marcador = (3, chave_journal(codigo_tabela, tipo, marca["Value"]))
+            if journal.concluido(*marcador):
+                progresso.incrementar()
+                continue
+            journal.iniciar(*marcador)
+            try:
+                modelos = aplicar_limite(await obter_modelos(codigo_tabela, marca["Value"], tipo), 'modelos')
+            except Exception as e:
+                logger.warning("falha_modelos marca=%s erro=%s", marca['Label'], e)
+                registrar_falha(marcador, e)
+                progresso.incrementar(sucesso=False)
+                continue
             
-            for j, modelo in enumerate(modelos, 1):
-                update_progress("3", 
-                              f"Marca: {marca['Label']} ({i}/{total_marcas})",
-                              f"Modelo: {modelo['Label']} ({j}/{total_modelos})")
+            for modelo in modelos:
                 modelo["marca_id"] = marca["Value"]
-                salvar_no_banco("modelos", modelo)
+                modelo["tipo_veiculo"] = tipo
+                await enfileirar_no_banco("modelos", modelo, marcador)
+            confirmar_unidade(marcador)
+            progresso.incrementar(detalhe=f"Marca: {marca['Label']} ({len(modelos)} modelos)")
+        progresso.finalizar()
 
     elif etapa_inicial == 4:
-        update_progress("4", "Obtendo anos dos modelos")
         codigo_tabela = (await obter_tabela_referencia())['Codigo']
-        marcas = aplicar_limite(get_marcas(), 'marcas')
-        total_marcas = len(marcas)
+        catalogo = await carregar_catalogo(armazenamento)
+        marcas = aplicar_limite([m for m in catalogo.marcas if m["tipo_veiculo"] in CONFIG_TIPOS['tipos']], 'marcas')
+        modelos_por_marca = [(marca, aplicar_limite(catalogo.modelos_de(marca["Value"], marca["tipo_veiculo"]), 'modelos'))
+                             for marca in marcas]
+        progresso = RelatorioProgresso("Etapa 4/5: anos por modelo",
+                                       total=sum(len(modelos) for _, modelos in modelos_por_marca),
+                                       fonte_extras=extras_requisicoes)
         
-        for i, marca in enumerate(marcas, 1):
-            modelos = aplicar_limite(get_modelos_by_marca(marca["Value"]), 'modelos')
-            total_modelos = len(modelos)
-            
-            for j, modelo in enumerate(modelos, 1):
-                anos_modelo = aplicar_limite(
-                    await obter_anos_modelo(codigo_tabela, marca["Value"], modelo["Value"]), 
-                    'anos'
-                )
-                total_anos = len(anos_modelo)
+        for marca, modelos in modelos_por_marca:
+            tipo = marca["tipo_veiculo"]
+            for modelo in modelos:
+                marcador = (4, chave_journal(codigo_tabela, tipo, modelo["Value"]))
+                if journal.concluido(*marcador):
+                    progresso.incrementar()
+                    continue
+                journal.iniciar(*marcador)
+                try:
+                    anos_modelo = aplicar_limite(
+                        await obter_anos_modelo(codigo_tabela, marca["Value"], modelo["Value"], tipo),
+                        'anos'
+                    )
+                except Exception as e:
+                    logger.warning("falha_anos modelo=%s erro=%s", modelo['Label'], e)
+                    registrar_falha(marcador, e)
+                    progresso.incrementar(sucesso=False)
+                    continue
                 
-                for k, ano in enumerate(anos_modelo, 1):
-                    update_progress("4",
-                                  f"Marca: {marca['Label']} ({i}/{total_marcas})",
-                                  f"Modelo: {modelo['Label']} ({j}/{total_modelos}) - Ano: {ano['Label']} ({k}/{total_anos})")
+                for ano in anos_modelo:
                     ano["modelo_id"] = modelo["Value"]
-                    salvar_no_banco("anos_modelo", ano)
+                    ano["tipo_veiculo"] = tipo
+                    await enfileirar_no_banco("anos_modelo", ano, marcador)
+                confirmar_unidade(marcador)
+                progresso.incrementar(detalhe=f"Marca: {marca['Label']} - Modelo: {modelo['Label']} ({len(anos_modelo)} anos)")
+        progresso.finalizar()
 
     else:
-        update_progress("5", "Obtendo valores dos veículos")
-        codigo_tabela = (await obter_tabela_referencia())['Codigo']
-        meses = aplicar_limite(get_mes_referencia(), 'meses')
-        marcas = aplicar_limite(get_marcas(), 'marcas')
-        
-        total_combinacoes = 0
-        todas_combinacoes = []
+        print("\nEtapa 5/5: obtendo valores dos veículos")
+        meses = aplicar_limite(await get_mes_referencia(), 'meses')
+        # Uma carga paginada do catálogo substitui uma consulta por marca e por modelo
+        catalogo = await carregar_catalogo(armazenamento)
+        catalogo.marcas = [m for m in catalogo.marcas if m["tipo_veiculo"] in CONFIG_TIPOS['tipos']]
+        marcas = aplicar_limite(catalogo.marcas, 'marcas')
         
-        def update_combination_progress(marca_info, modelo_info="", anos_info="", total_info=""):
-            clear_console()
-            print("\n=== Gerando combinações ===")
-            print(f"Modo amostragem: {'Ativo' if MODO_AMOSTRAGEM else 'Inativo'}")
-            print(f"\n📍 Marca: {marca_info}")
-            if modelo_info:
-                print(f"   ↳ Modelo: {modelo_info}")
-            if anos_info:
-                print(f"      ↳ {anos_info}")
-            if total_info:
-                print(f"\nProgresso: {total_info}")
-        
-        for i, marca in enumerate(marcas, 1):
-            update_combination_progress(
-                f"{marca['Label']} ({i}/{len(marcas)})"
-            )
-            
-            modelos = aplicar_limite(get_modelos_by_marca(marca["Value"]), 'modelos')
-            
-            for j, modelo in enumerate(modelos, 1):
-                update_combination_progress(
-                    f"{marca['Label']} ({i}/{len(marcas)})",
-                    f"{modelo['Label']} ({j}/{len(modelos)})"
-                )
-                
-                anos = aplicar_limite(get_anos_by_modelo(modelo["Value"]), 'anos')
-                combinacoes_modelo = 0
-                
-                for mes in meses:
-                    for ano in anos:
-                        todas_combinacoes.append({
-                            'mes': mes,
-                            'marca': marca,
-                            'modelo': modelo,
-                            'ano': ano
-                        })
-                        combinacoes_modelo += 1
-                        total_combinacoes += 1
-                        
-                update_combination_progress(
-                    f"{marca['Label']} ({i}/{len(marcas)})",
-                    f"{modelo['Label']} ({j}/{len(modelos)})",
-                    f"Anos processados: {len(anos)}",
-                    f"Total de combinações: {total_combinacoes}"
-                )
-
-        clear_console()
-        print("\n=== Geração de combinações finalizada ===")
-        print(f"Total final de combinações: {total_combinacoes}")
-        print(f"Total de marcas processadas: {len(marcas)}")
-        print(f"Modo amostragem: {'Ativo' if MODO_AMOSTRAGEM else 'Inativo'}")
+        def chave_item(mes, modelo, ano):
+            return chave_journal(mes["Value"], modelo["Value"], ano["id"])
 
-        total = len(todas_combinacoes)
-        print(f"\nTotal de combinações a processar: {total}")
+        def ja_concluido(mes, modelo, ano):
+            return journal.concluido(5, chave_item(mes, modelo, ano))
 
-        for idx, combo in enumerate(todas_combinacoes, 1):
-            update_progress("5",
-                          f"Progresso: {idx}/{total}",
-                          f"Mês: {combo['mes']['Label']} - Marca: {combo['marca']['Label']} - Modelo: {combo['modelo']['Label']} - Ano: {combo['ano']['Label']}")
-            
+        interrompidos = journal.em_andamento(5)
+        falhas_anteriores = journal.falhas(5)
+        if journal.total_concluidos(5) or interrompidos or falhas_anteriores:
+            print(f"\n♻️ Retomando: {journal.total_concluidos(5)} preços já concluídos, "
+                  f"{len(interrompidos)} interrompidos e {len(falhas_anteriores)} com falha serão refeitos")
+
+        # As combinações são geradas sob demanda direto para a fila do pool;
+        # só o total é calculado antes, sem criar os itens
+        prioridade = await criar_prioridade(max((int(mes["Value"]) for mes in meses), default=0))
+        inicio_contagem = time.perf_counter()
+        total = contar_combinacoes(catalogo, meses, aplicar_limite, pular=ja_concluido, prioridade=prioridade)
+
+        print("\n=== Combinações prontas para processamento ===")
+        print(f"Total de combinações a processar: {total} (contadas em {time.perf_counter() - inicio_contagem:.2f}s)")
+        print(f"Total de marcas: {len(marcas)}")
+        print(f"Meses de referência: {len(meses)}")
+        print(f"Modo amostragem: {'Ativo' if MODO_AMOSTRAGEM else 'Inativo'}")
+        print(f"Prioridade: {prioridade.descricao()}")
+
+        async def processar_combinacao(combo):
+            marcador = (5, chave_item(combo.mes, combo.modelo, combo.ano))
+            journal.iniciar(*marcador)
             valor = await obter_valor_veiculo(
-                codigo_tabela,
-                combo['marca']["Value"],
-                combo['modelo']["Value"],
-                combo['ano']
+                combo.mes["Value"],
+                combo.marca["Value"],
+                combo.modelo["Value"],
+                combo.ano,
+                marcador,
+                tipo_veiculo=combo.tipo_veiculo,
             )
-            
-            if valor:
-                salvar_no_banco("veiculos", {
-                    'modelo_id': combo['modelo']["Value"],
-                    'ano_id': combo['ano']["id"],
-                    'mes_referencia_id': combo['mes']["Value"],
-                    'codigo_fipe': valor["CodigoFipe"],
-                    'combustivel': valor["Combustivel"],
-                    'preco': float(valor["Valor"].replace("R$ ", "").replace(".", "").replace(",", ".")),
-                })
-
-    clear_console()
+            # obter_valor_veiculo já enfileira a linha no gravador
+            if valor is None:
+                registrar_falha(marcador, "valor não obtido")
+                return False
+            confirmar_unidade(marcador)
+            return True
+
+        relatorio = RelatorioProgresso("Etapa 5/5: preços", total=total, fonte_extras=extras_requisicoes)
+
+        def ao_concluir(idx, combo, progresso):
+            relatorio.atualizar(
+                progresso.concluidos, progresso.falhas,
+                detalhe=f"Completo até o item {progresso.marca_agua} - Último: {combo.marca['Label']} - {combo.modelo['Label']} - {combo.ano['Label']}",
+            )
+
+        progresso = await executar_pool(
+            gerar_combinacoes(catalogo, meses, aplicar_limite, pular=ja_concluido, prioridade=prioridade),
+            processar_combinacao,
+            concorrencia=CONCORRENCIA_PRECOS,
+            total=total,
+            ao_concluir=ao_concluir,
+            metricas=metricas,
+            nome="precos",
+        )
+        relatorio.finalizar()
+        print(f"\nPreços processados: {progresso.concluidos} ({progresso.falhas} falhas), "
+              f"{progresso.itens_por_segundo:.2f} itens/s")
+
     print(f"\n\n=== Processo de scraping {'(AMOSTRAGEM)' if MODO_AMOSTRAGEM else ''} finalizado com sucesso! ===")
 
+def _partes_item(item):
+    """(mês, marca, modelo, ano) de um item de qualquer estágio do pipeline"""
+    if isinstance(item, ItemPreco):
+        return item.mes, item.marca, item.modelo, item.ano
+    return (*item, None, None)[:4]
+
+async def reprocessar_falhas(falhas, estagios, ao_concluir=None, antes=None):
+    """Fila de itens que falharam (dead-letter), reprocessada ao fim do pipeline.
+
+    ``falhas`` é uma lista de ``(estagio, item, erro)``. Cada rodada espera
+    ``espera_reprocessamento`` segundos (além do que o disjuntor exigir) e
+    passa cada item de novo pelo seu estágio e pelos seguintes; ``antes(item)``
+    desfaz a falha registrada. Devolve as falhas que sobraram.
+    """
+    rodadas = CONFIG_RESILIENCIA['rodadas_reprocessamento']
+    for rodada in range(1, rodadas + 1):
+        if not falhas:
+            break
+        print(f"\n🔁 Reprocessando {len(falhas)} itens com falha (rodada {rodada}/{rodadas})")
+        await asyncio.sleep(CONFIG_RESILIENCIA['espera_reprocessamento'])
+        pendentes, falhas = falhas, []
+        for indice, estagio in enumerate(estagios):
+            itens = [item for origem, item, _ in pendentes if origem is estagio]
+            if not itens:
+                continue
+            for item in itens:
+                estagio.processados -= 1
+                estagio.falhas -= 1
+                if antes:
+                    antes(item)
+            await executar_pipeline(itens, estagios[indice:], ao_concluir,
+                                    ao_falhar=lambda e, item, erro: falhas.append((e, item, erro)))
+        print(f"   {len(pendentes)} reprocessados, {len(falhas)} ainda com falha")
+    return falhas
+
+def registrar_perdidos(falhas):
+    """Conta e salva em ``arquivo_perdidos`` os itens que falharam mesmo após o reprocessamento"""
+    if not falhas:
+        return
+    os.makedirs(os.path.dirname(CONFIG_RESILIENCIA['arquivo_perdidos']), exist_ok=True)
+    with open(CONFIG_RESILIENCIA['arquivo_perdidos'], "a") as f:
+        for estagio, item, erro in falhas:
+            metricas.contador("itens_perdidos_total", "Itens do pipeline que falharam mesmo após o reprocessamento",
+                              estagio=estagio.nome).inc()
+            mes, marca, modelo, ano = _partes_item(item)
+            f.write(json.dumps({
+                'estagio': estagio.nome,
+                'mes_referencia_id': mes['Value'],
+                'tipo_veiculo': mes['tipo_veiculo'],
+                'marca': marca['Value'],
+                'modelo': modelo and modelo['Value'],
+                'ano': ano and ano['codigo'],
+                'erro': str(erro),
+                'horario': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }, ensure_ascii=False) + "\n")
+
+async def _rodar_pipeline(tabelas, filtro_marca=None, filtro_modelo=None, catalogo_meses=None):
+    """Coleta o catálogo e os preços das ``tabelas`` de referência em uma única passada.
+
+    (mês, marca) -> modelos -> anos -> preços, com filas limitadas entre os estágios.
+    Marcas, modelos e anos são gravados na hora (um upsert por marca/modelo),
+    garantindo as chaves estrangeiras e os ids de anos_modelo usados nos preços;
+    os preços seguem pelo gravador em lote e pelo journal.
+
+    Cada tabela é coletada para cada tipo de veículo de ``CONFIG_TIPOS``. As
+    marcas de todos os meses e tipos entram intercaladas, então avançam juntos e
+    dividem o orçamento do limitador; as filas dos estágios atendem os tipos
+    conforme os pesos. Um (mês, tipo) sem nenhuma falha é marcado como completo
+    no journal e pulado nas próximas execuções.
+
+    ``filtro_marca(marca)`` e ``filtro_modelo(modelo)`` restringem a coleta a
+    parte do mês (um bloco do modo distribuido); nesse caso o mês não é marcado.
+    ``catalogo_meses``, compartilhado entre os blocos de um trabalhador, guarda
+    as marcas e os modelos já baixados e gravados de cada mês e a prioridade,
+    para que só o primeiro bloco de um mês faça esse trabalho.
+
+    Devolve os itens que falharam mesmo após o reprocessamento (``(estágio, item,
+    erro)``, os mesmos salvos em ``arquivo_perdidos``).
+    """
+    print(f"\n=== Iniciando pipeline de scraping {'(AMOSTRAGEM)' if MODO_AMOSTRAGEM else ''} ===")
+    if catalogo_meses is None:
+        catalogo_meses = {}
+    novas = [t for t in tabelas if ('tabela', t['Codigo']) not in catalogo_meses]
+    if novas:
+        await gravar_lote_agora("tabela_referencia", [montar_linha("tabela_referencia", t) for t in novas])
+        catalogo_meses.update({('tabela', t['Codigo']): True for t in novas})
+
+    # Cada "mês" do pipeline é uma tabela de referência de um tipo de veículo
+    meses = []
+    for tabela in tabelas:
+        for tipo in CONFIG_TIPOS['tipos']:
+            rotulo = f"{tabela['Mes'].strip()} {TIPOS_VEICULO.get(tipo, tipo)}"
+            if journal.concluido(ETAPA_MES_COMPLETO, chave_journal(tabela['Codigo'], tipo)):
+                print(f"⏭️ Tabela {tabela['Codigo']} ({rotulo}) já está completa")
+                continue
+            meses.append({"Value": tabela['Codigo'], "Label": rotulo, "tipo_veiculo": tipo})
+    if not meses:
+        print("Nenhuma tabela de referência pendente.")
+        return []
+
+    chave_prioridade = ('prioridade', max(int(mes["Value"]) for mes in meses))
+    if chave_prioridade not in catalogo_meses:
+        catalogo_meses[chave_prioridade] = await criar_prioridade(chave_prioridade[1])
+    prioridade = catalogo_meses[chave_prioridade]
+    print(f"Prioridade: {prioridade.descricao()}")
+
+    marcas_por_mes = []
+    novas_marcas = {}
+    for mes in meses:
+        chave_marcas = ('marcas', mes["Value"], mes["tipo_veiculo"])
+        marcas = catalogo_meses.get(chave_marcas)
+        if marcas is None:
+            marcas = await obter_marcas(mes["Value"], mes["tipo_veiculo"])
+            for marca in marcas:
+                marca["tipo_veiculo"] = mes["tipo_veiculo"]
+            marcas = novas_marcas[chave_marcas] = aplicar_limite(sorted(marcas, key=prioridade.marca, reverse=True),
+                                                                 'marcas')
+        if filtro_marca is not None:
+            marcas = [marca for marca in marcas if filtro_marca(marca)]
+        marcas_por_mes.append([(mes, marca) for marca in marcas])
+        print(f"{len(marcas)} marcas na tabela {mes['Value']} ({mes['Label']})")
+    if novas_marcas:
+        # Mesma marca em vários meses: uma linha só, senão o upsert toca a mesma linha duas vezes
+        linhas_marcas = {(marca["tipo_veiculo"], marca["Value"]): montar_linha("marcas", marca)
+                         for marcas in novas_marcas.values() for marca in marcas}
+        await gravar_lote_agora("marcas", list(linhas_marcas.values()))
+        catalogo_meses.update(novas_marcas)
+
+    progresso_meses = ProgressoPorMes(meses)
+
+    async def estagio_modelos(par):
+        mes, marca = par
+        tipo = mes["tipo_veiculo"]
+        chave_modelos = ('modelos', mes["Value"], tipo, marca["Value"])
+        try:
+            modelos = catalogo_meses.get(chave_modelos)
+            if modelos is None:
+                modelos = await obter_modelos(mes["Value"], marca["Value"], tipo)
+                for modelo in modelos:
+                    modelo["marca_id"] = marca["Value"]
+                    modelo["tipo_veiculo"] = tipo
+                modelos = aplicar_limite(sorted(modelos, key=prioridade.modelo, reverse=True), 'modelos')
+                await gravar_lote_agora("modelos", [montar_linha("modelos", modelo) for modelo in modelos])
+                catalogo_meses[chave_modelos] = modelos
+            if filtro_modelo is not None:
+                modelos = [modelo for modelo in modelos if filtro_modelo(modelo)]
+        except Exception:
+            progresso_meses.falha(mes)
+            raise
+        return [(mes, marca, modelo) for modelo in modelos]
+
+    async def estagio_anos(trio):
+        mes, marca, modelo = trio
+        tipo = mes["tipo_veiculo"]
+        try:
+            anos = aplicar_limite(await obter_anos_modelo(mes["Value"], marca["Value"], modelo["Value"], tipo), 'anos')
+            for ano in anos:
+                ano["modelo_id"] = modelo["Value"]
+                ano["tipo_veiculo"] = tipo
+            gravados = await gravar_lote_agora("anos_modelo", [montar_linha("anos_modelo", ano) for ano in anos])
+        except Exception:
+            progresso_meses.falha(mes)
+            raise
+        itens = []
+        for linha in gravados:
+            ano = {"id": linha['id'], "codigo": linha['codigo'], "Label": linha['descricao']}
+            if journal.concluido(5, chave_journal(mes["Value"], modelo["Value"], ano["id"])):
+                progresso_meses.pular(mes)
+            else:
+                itens.append(ItemPreco(mes, marca, modelo, ano))
+        return itens
+
+    async def estagio_precos(item):
+        marcador = (5, chave_journal(item.mes["Value"], item.modelo["Value"], item.ano["id"]))
+        journal.iniciar(*marcador)
+        valor = await obter_valor_veiculo(item.mes["Value"], item.marca["Value"], item.modelo["Value"],
+                                          item.ano, marcador, tipo_veiculo=item.tipo_veiculo)
+        progresso_meses.registrar(item.mes, sucesso=valor is not None)
+        if valor is None:
+            registrar_falha(marcador, "valor não obtido")
+            raise RuntimeError(f"valor não obtido para {item}")
+        confirmar_unidade(marcador)
+
+    # Uma subfila por tipo de veículo em cada estágio, atendidas conforme os pesos;
+    # dentro de cada subfila, o item de maior prioridade sai primeiro
+    pesos = CONFIG_TIPOS['pesos']
+    estagios = [
+        Estagio("modelos", estagio_modelos, CONCORRENCIA_PIPELINE['modelos'],
+                chave_fila=lambda par: par[0]["tipo_veiculo"], pesos=pesos,
+                prioridade=lambda par: prioridade.marca(par[1])),
+        Estagio("anos", estagio_anos, CONCORRENCIA_PIPELINE['anos'],
+                chave_fila=lambda trio: trio[0]["tipo_veiculo"], pesos=pesos,
+                prioridade=lambda trio: prioridade.modelo(trio[2])),
+        Estagio("precos", estagio_precos, CONCORRENCIA_PIPELINE['precos'], tamanho_fila=500,
+                chave_fila=lambda item: item.tipo_veiculo, pesos=pesos, prioridade=prioridade.preco),
+    ]
+
+    def extras_pipeline():
+        extras = {e.nome: e.resumo(com_nome=False) for e in estagios}
+        if len(CONFIG_TIPOS['tipos']) > 1:
+            extras["Fila por tipo"] = " | ".join(
+                f"{TIPOS_VEICULO.get(tipo, tipo)} {tamanho}" for tipo, tamanho in estagios[-1].fila.tamanhos().items()
+            ) or "--"
+        if len(meses) > 1:
+            extras["Por mês"] = progresso_meses.resumo_curto()
+        return {**extras, **extras_requisicoes()}
+
+    relatorio = RelatorioProgresso(
+        f"Pipeline em andamento {'(AMOSTRAGEM)' if MODO_AMOSTRAGEM else ''}".strip(),
+        fonte_extras=extras_pipeline,
+    )
+
+    def ao_concluir(estagio, item):
+        precos = estagios[-1]
+        if estagio is precos:
+            relatorio.atualizar(precos.processados, precos.falhas,
+                                detalhe=f"Último: {item.mes['Label']} - {item.marca['Label']} - "
+                                        f"{item.modelo['Label']} - {item.ano['Label']}")
+        else:
+            relatorio.atualizar()
+
+    falhas = []
+    inicio = time.monotonic()
+    await executar_pipeline(intercalar(marcas_por_mes), estagios, ao_concluir, metricas=metricas,
+                            ao_falhar=lambda estagio, item, erro: falhas.append((estagio, item, erro)))
+    falhas = await reprocessar_falhas(falhas, estagios, ao_concluir,
+                                      antes=lambda item: progresso_meses.reprocessar(_partes_item(item)[0]))
+    duracao = time.monotonic() - inicio
+    relatorio.finalizar()
+    print(f"\n=== Pipeline finalizado em {duracao:.1f}s ===")
+    for e in estagios:
+        print(e.resumo())
+    registrar_perdidos(falhas)
+    perdidos = {e.nome: sum(1 for origem, _, _ in falhas if origem is e) for e in estagios}
+    print(f"Preços perdidos: {perdidos['precos']}")
+    if perdidos['modelos'] or perdidos['anos']:
+        print(f"⚠️ Sem catálogo para coletar os preços de {perdidos['modelos']} marcas e {perdidos['anos']} modelos")
+    if falhas:
+        print(f"   Itens perdidos salvos em {CONFIG_RESILIENCIA['arquivo_perdidos']}")
+
+    # Só marca o mês como completo depois que todos os preços estiverem no banco
+    await gravador.descarregar()
+    parcial = filtro_marca is not None or filtro_modelo is not None
+    if not MODO_AMOSTRAGEM and not parcial and gravador.pendentes() == 0:
+        for mes in meses:
+            if progresso_meses.completo(mes):
+                journal.marcar_concluido(ETAPA_MES_COMPLETO, chave_journal(mes["Value"], mes["tipo_veiculo"]))
+    print()
+    for linha in progresso_meses.linhas():
+        print(linha)
+    return falhas
+
+async def _rodar_daemon():
+    """Fica em execução e coleta cada tabela de referência nova assim que a FIPE a publica.
+
+    A cada ``intervalo`` segundos consulta ConsultarTabelaDeReferencia sem
+    cache. Se a tabela mais recente ainda não está completa no journal, roda o
+    pipeline só para ela (retomando o que já foi feito) e volta a esperar. O
+    cliente HTTP, o cache de respostas, o limitador aprendido e o gravador
+    ficam abertos entre os ciclos. SIGTERM ou Ctrl-C interrompem a coleta em
+    andamento e encerram; o journal a retoma na próxima vez.
+    """
+    parar = asyncio.Event()
+    coleta = None
+
+    def encerrar():
+        parar.set()
+        if coleta is not None:
+            coleta.cancel()
+
+    loop = asyncio.get_running_loop()
+    sinais = []
+    for sinal in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sinal, encerrar)
+            sinais.append(sinal)
+        except (NotImplementedError, RuntimeError):
+            pass
+    verificacao = metricas.medidor("daemon_ultima_verificacao", "Horário (epoch) da última consulta às tabelas")
+    ultima_tabela = metricas.medidor("daemon_ultima_tabela_completa", "Código da última tabela coletada por inteiro")
+    print(f"\n=== Daemon: verificando novas tabelas de referência a cada {CONFIG_DAEMON['intervalo']}s "
+          f"(tipos {CONFIG_TIPOS['tipos']}{', delta' if CONFIG_DELTA['ativo'] else ''}) ===")
+    try:
+        while not parar.is_set():
+            espera = CONFIG_DAEMON['intervalo']
+            verificacao.definir(time.time())
+            try:
+                tabelas = await requisitar_api("ConsultarTabelaDeReferencia", {}, usar_cache=False)
+            except Exception as e:
+                logger.warning("daemon_erro_verificacao erro=%s", e)
+                tabelas = None
+            if not tabelas:
+                resultado = "erro"
+            else:
+                if cache_respostas.cacheavel("ConsultarTabelaDeReferencia"):
+                    cache_respostas.guardar("ConsultarTabelaDeReferencia", {}, tabelas)
+                recente = tabelas[0]
+                if tabela_completa(recente['Codigo']):
+                    resultado = "sem_novidade"
+                    ultima_tabela.definir(int(recente['Codigo']))
+                else:
+                    resultado = "nova_tabela"
+                    inicio = time.monotonic()
+                    print(f"\n🆕 {time.strftime('%Y-%m-%d %H:%M:%S')} tabela {recente['Codigo']} "
+                          f"({recente['Mes'].strip()}) pendente, iniciando a coleta")
+                    coleta = asyncio.create_task(coletar_tabela(recente))
+                    try:
+                        await coleta
+                    except asyncio.CancelledError:
+                        if parar.is_set():
+                            break
+                        raise
+                    except Exception as e:
+                        logger.warning("daemon_erro_coleta tabela=%s erro=%s", recente['Codigo'], e)
+                    finally:
+                        coleta = None
+                    if tabela_completa(recente['Codigo']):
+                        ultima_tabela.definir(int(recente['Codigo']))
+                        print(f"✅ Tabela {recente['Codigo']} completa em {time.monotonic() - inicio:.0f}s")
+                    else:
+                        espera = CONFIG_DAEMON['intervalo_falha']
+                        print(f"⚠️ Tabela {recente['Codigo']} ainda incompleta; nova tentativa em {espera}s")
+            metricas.contador("daemon_verificacoes_total", "Consultas às tabelas de referência pelo daemon",
+                              resultado=resultado).inc()
+            try:
+                await asyncio.wait_for(parar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for sinal in sinais:
+            loop.remove_signal_handler(sinal)
+    print("\n=== Daemon encerrado ===")
+
+def criar_reservas():
+    if CONFIG_DISTRIBUIDO['reservas'] == "supabase":
+        return ReservasSupabase(armazenamento, CONFIG_DISTRIBUIDO['max_tentativas'])
+    return ReservasSqlite(CONFIG_DISTRIBUIDO['reservas'], CONFIG_DISTRIBUIDO['max_tentativas'])
+
+async def _manter_reserva(reservas, reserva, tarefa, perdida):
+    """Renova a reserva a cada terço do prazo; se ela foi perdida, cancela o bloco"""
+    ttl = CONFIG_DISTRIBUIDO['ttl_reserva']
+    while not tarefa.done():
+        await asyncio.sleep(ttl / 3)
+        if not await reservas.renovar(reserva, ttl):
+            logger.warning("reserva_perdida chave=%s", reserva.chave)
+            perdida.set()
+            tarefa.cancel()
+            return
+
+async def _rodar_distribuido(tabelas):
+    """Reserva blocos (mês, hash do modelo ou da marca) até não sobrar nenhum.
+
+    Cada bloco roda o pipeline filtrado e só é dado como concluído depois que
+    os seus preços foram gravados. Um bloco que falha volta para a fila (até
+    ``max_tentativas``); o de um trabalhador que parou de renovar a reserva é
+    retomado por outro. Só são reservados blocos dos meses de ``tabelas``, e o
+    catálogo de cada mês é baixado e gravado uma vez, no primeiro bloco dele.
+    """
+    reservas = criar_reservas()
+    trabalhador = CONFIG_DISTRIBUIDO['trabalhador']
+    blocos = CONFIG_DISTRIBUIDO['blocos']
+    ttl = CONFIG_DISTRIBUIDO['ttl_reserva']
+    por_codigo = {int(tabela['Codigo']): tabela for tabela in tabelas}
+    for codigo in por_codigo:
+        await reservas.criar_blocos(codigo, blocos)
+    print(f"\n=== Trabalhador {trabalhador}: {len(tabelas)} tabela(s), {blocos} blocos por mês "
+          f"(partição por {CONFIG_DISTRIBUIDO['particao']}) ===")
+
+    concluidos = falhos = 0
+    catalogo_meses = {}
+    while True:
+        reserva = await reservas.reservar(trabalhador, ttl, meses=list(por_codigo))
+        if reserva is None:
+            break
+        tabela = por_codigo[int(reserva.mes)]
+        print(f"\n📦 Bloco {reserva.chave} (tentativa {reserva.tentativas})")
+        no_bloco = lambda item, bloco=reserva.bloco: bloco_de(item["Value"], blocos) == bloco
+        filtros = {'filtro_marca': no_bloco} if CONFIG_DISTRIBUIDO['particao'] == 'marca' else {'filtro_modelo': no_bloco}
+        tarefa = asyncio.create_task(_rodar_pipeline([tabela], catalogo_meses=catalogo_meses, **filtros))
+        perdida = asyncio.Event()
+        renovacao = asyncio.create_task(_manter_reserva(reservas, reserva, tarefa, perdida))
+        sucesso = False
+        try:
+            perdidos = await tarefa
+            await gravador.descarregar()
+            # Itens perdidos devolvem o bloco para a fila (até max_tentativas)
+            sucesso = not perdidos and gravador.pendentes() == 0
+            if perdidos:
+                logger.warning("bloco_com_perdidos chave=%s itens=%d", reserva.chave, len(perdidos))
+        except asyncio.CancelledError:
+            if not perdida.is_set():
+                # Interrompido (Ctrl-C): devolve o bloco antes de sair
+                renovacao.cancel()
+                await reservas.liberar(reserva, concluido=False, interrompido=True)
+                raise
+        except Exception as e:
+            logger.warning("erro_bloco chave=%s erro=%s", reserva.chave, e)
+        renovacao.cancel()
+        if perdida.is_set():
+            # Outro trabalhador já pode estar com o bloco: não mexe mais na reserva
+            falhos += 1
+            continue
+        await reservas.liberar(reserva, concluido=sucesso)
+        if sucesso:
+            concluidos += 1
+        else:
+            falhos += 1
+
+    print(f"\n=== Trabalhador {trabalhador} finalizado: {concluidos} blocos concluídos, {falhos} devolvidos ===")
+    print(f"Blocos na tabela de reservas: {await reservas.resumo()}")
+
+def iniciar_trabalhadores(quantidade, argv):
+    """Sobe ``quantidade`` processos do modo distribuido nesta máquina.
+
+    Cada um tem o próprio diretório de dados (journal, cache e limitador) e
+    todos compartilham o mesmo arquivo de reservas.
+    """
+    reservas = os.path.abspath(CONFIG_DISTRIBUIDO['reservas']) if CONFIG_DISTRIBUIDO['reservas'] != "supabase" else "supabase"
+    processos = []
+    for indice in range(quantidade):
+        env = {
+            **os.environ,
+            "AUTOFIPE_DADOS": os.path.join(DIRETORIO_DADOS, f"trabalhador-{indice}"),
+            "AUTOFIPE_TRABALHADOR": f"{socket.gethostname()}-{indice}",
+            "AUTOFIPE_RESERVAS": reservas,
+        }
+        if CONFIG_METRICAS['porta']:
+            env["AUTOFIPE_METRICAS_PORTA"] = str(CONFIG_METRICAS['porta'] + indice)
+        processos.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv], env=env))
+    return max(processo.wait() for processo in processos)
+
 def log_error(e, context=""):
     """Função auxiliar para logging detalhado de erros"""
     print(f"\n❌ Erro {context}:")
@@ -607,4 +1525,53 @@ def log_error(e, context=""):
     print(traceback.format_exc())
 
 if __name__ == "__main__":
-    asyncio.run(rodar_scraping())
+    parser = argparse.ArgumentParser(description="Scraper da tabela FIPE")
+    parser.add_argument("--modo", choices=["pipeline", "historico", "distribuido", "daemon", "etapas"],
+                        default=MODO_EXECUCAO,
+                        help="pipeline: tudo em uma passada; historico: o pipeline para vários meses; "
+                             "distribuido: um trabalhador que reserva blocos; daemon: fica em execução e "
+                             "coleta cada mês novo; etapas: uma etapa por execução")
+    parser.add_argument("--intervalo", type=int, default=CONFIG_DAEMON['intervalo'],
+                        help="daemon: segundos entre as consultas às tabelas de referência")
+    parser.add_argument("--trabalhadores", type=int, default=1,
+                        help="distribuido: quantidade de processos a iniciar nesta máquina")
+    parser.add_argument("--desde", type=int, help="historico: menor codigoTabelaReferencia a coletar")
+    parser.add_argument("--ate", type=int, help="historico: maior codigoTabelaReferencia a coletar")
+    parser.add_argument("--meses", type=int, help="historico/distribuido: quantidade de meses, a partir do mais recente")
+    parser.add_argument("--tipos", default=",".join(map(str, CONFIG_TIPOS['tipos'])),
+                        help="tipos de veículo a coletar, ex.: 1,2,3 (1 = carros, 2 = motos, 3 = caminhões)")
+    parser.add_argument("--delta", action="store_true", default=CONFIG_DELTA['ativo'],
+                        help="grava inteiras só as linhas de preços novos ou alterados desde o mês anterior")
+    parser.add_argument("--agregados", action="store_true", default=CONFIG_AGREGADOS['ativo'],
+                        help="mantém as estatísticas de preço por veículo, modelo e marca (agregados.py)")
+    parser.add_argument("--snapshot", choices=["parquet", "arrow"], default=CONFIG_SNAPSHOT['formato'],
+                        help="grava também um dataset local dos preços, uma partição por mês (destinos.py)")
+    parser.add_argument("--trace", action="store_true", default=CONFIG_RASTREAMENTO['ativo'],
+                        help="grava os spans da execução em .dados/trace.json (formato Chrome trace)")
+    parser.add_argument("--perfil", type=float, default=CONFIG_RASTREAMENTO['perfil_segundos'], metavar="SEGUNDOS",
+                        help="perfil por amostragem dos primeiros SEGUNDOS da execução (ou kill -USR1 durante ela)")
+    parser.add_argument("--porta-metricas", type=int, default=None,
+                        help="expõe as métricas em http://127.0.0.1:<porta>/metrics durante a execução")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="-v mostra eventos (INFO), -vv mostra o detalhe de cada item (DEBUG)")
+    args = parser.parse_args()
+    CONFIG_TIPOS['tipos'] = [int(tipo) for tipo in args.tipos.split(",")]
+    CONFIG_DELTA['ativo'] = args.delta
+    CONFIG_AGREGADOS['ativo'] = args.agregados
+    CONFIG_SNAPSHOT['formato'] = args.snapshot
+    CONFIG_RASTREAMENTO['ativo'] = args.trace
+    CONFIG_RASTREAMENTO['perfil_segundos'] = args.perfil
+    CONFIG_DAEMON['intervalo'] = args.intervalo
+    if args.modo == "distribuido" and args.trabalhadores > 1:
+        argv, pular = [], False
+        for arg in sys.argv[1:]:
+            if pular or arg.startswith("--trabalhadores="):
+                pular = False
+                continue
+            pular = arg == "--trabalhadores"
+            if not pular:
+                argv.append(arg)
+        sys.exit(iniciar_trabalhadores(args.trabalhadores, argv))
+    nivel = os.getenv("AUTOFIPE_LOG") or ["WARNING", "INFO", "DEBUG"][min(args.verbose, 2)]
+    logging.basicConfig(level=nivel, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(rodar_scraping(args.modo, args.porta_metricas, args.desde, args.ate, args.meses))